@@ -1,111 +1,285 @@
+import gzip
+import http.client
+import json
+import os
+import queue
+import time
+from urllib.parse import urlencode, urlsplit
 import pandas as pd
-import alpaca_trade_api as tradeapi
-import datetime
-from datetime import timedelta
-
-# Set up Alpaca API credentials
-# Replace with your actual API key and secret
-API_KEY = 'PKUS51O4UYY0CVNN043D'
-API_SECRET = '9sXWKRHgVJYiKcaT8IHNqXyQ68OY9FgbKWpK8NMm'
+from bar_cache import _parse_size, to_timedelta
+from ohlcv import PRICE_DTYPE, canonical, empty_bars, from_alpaca # the bar format shared by every client
+
+# Historical bars from Alpaca's market data API. One request of the
+# multi-symbol endpoint
+#   GET /v2/stocks/bars?symbols=AAPL,MSFT&timeframe=1Day&start=...&end=...
+# returns up to PAGE_LIMIT bars of many symbols, grouped by symbol, and a
+# next_page_token while more are left. Requests go over a small pool of
+# keep-alive connections, so only the first one pays the TCP and TLS
+# handshakes, and nothing is connected until a request is made.
+
+# Alpaca API credentials come from APCA_API_KEY_ID and APCA_API_SECRET_KEY, never from the code
 BASE_URL = 'https://paper-api.alpaca.markets'  # Use this for paper trading
+DATA_URL = 'https://data.alpaca.markets'  # market data comes from its own host for paper and live accounts
+
+PAGE_LIMIT = 10000 # most bars Alpaca returns per page, counted over all symbols of the request
+SYMBOLS_PER_REQUEST = 200 # keeps the query string well below URL length limits
+MAX_RETRIES = 5
+
+# Set to a BarCache to keep downloaded bars on disk, later calls then only download the missing ranges
+bar_cache = None
+
+
+class AlpacaDataError(Exception):
+    """Alpaca answered a request with an error status"""
+
+    def __init__(self, status, message):
+        super().__init__(f"Alpaca returned {status}: {message}")
+        self.status = status
+
+
+def to_timeframe(bar_size):
+    """Alpaca timeframe ("15Min", "1Hour", "1Day") of a bar size written for any provider ("15 mins", "1h", "1d")"""
+    number, unit = _parse_size(bar_size)
+    names = {"min": "Min", "h": "Hour", "D": "Day", "W": "Week", "M": "Month"}
+    if unit not in names:
+        raise ValueError(f"Alpaca has no {bar_size!r} bars")
+    return f"{number}{names[unit]}"
+
+
+def _utc(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
+
+
+class AlpacaDataClient:
+    """Historical bars of Alpaca's market data API in the same format as IBClient and YahooFinanceClient
+
+    Parameters:
+    - api_key, secret_key: Credentials, APCA_API_KEY_ID and APCA_API_SECRET_KEY from the environment by default
+    - data_url: Base URL of the data API, e.g. FakeAlpaca.url for offline runs
+    - feed: "iex" (free plan) or "sip" (every US exchange, needs a subscription)
+    - adjustment: "raw", "split", "dividend" or "all"
+    - bar_cache: Optional BarCache, when set only bars missing on disk are downloaded
+    - pool_size: Connections kept open between requests
+    - timeout: Seconds to wait for an answer
+    """
+
+    def __init__(self, api_key=None, secret_key=None, data_url=DATA_URL, feed="iex", adjustment="raw",
+                 bar_cache=None, pool_size=4, timeout=30):
+        self.api_key = api_key or os.environ.get("APCA_API_KEY_ID")
+        self.secret_key = secret_key or os.environ.get("APCA_API_SECRET_KEY")
+        if not self.api_key or not self.secret_key:
+            raise ValueError("Alpaca credentials missing, set APCA_API_KEY_ID and APCA_API_SECRET_KEY or pass api_key and secret_key")
+        self.feed = feed
+        self.adjustment = adjustment
+        self.bar_cache = bar_cache
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.price_dtype = PRICE_DTYPE # dtype of the price columns of the bars, np.float32 halves their memory
+        self.stats = {"requests": 0, "connections": 0, "pages": 0, "bars": 0}
+        url = urlsplit(data_url)
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._host, self._port, self._path = url.hostname, url.port, url.path.rstrip("/")
+        self._pool = queue.LifoQueue() # idle connections, the most recently used first as it is least likely to be timed out
+
+    def _get(self, path, params):
+        """GET a path of the data API and return the decoded JSON, retrying when rate limited"""
+        target = f"{self._path}{path}?{urlencode(params)}"
+        headers = {
+            "APCA-API-KEY-ID": self.api_key,
+            "APCA-API-SECRET-KEY": self.secret_key,
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip", # bar JSON compresses about tenfold
+        }
+        for attempt in range(MAX_RETRIES):
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                connection = self._connection_class(self._host, self._port, timeout=self.timeout) # connects on its first request
+                self.stats["connections"] += 1
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                continue # most likely a kept-alive connection the server closed meanwhile, retry on a fresh one
+            if response.will_close or self._pool.qsize() >= self.pool_size:
+                connection.close()
+            else:
+                self._pool.put(connection)
+            self.stats["requests"] += 1
+
+            if response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            if response.status == 429 and attempt < MAX_RETRIES - 1: # 200 requests a minute on the free plan
+                reset = response.getheader("X-RateLimit-Reset") # epoch second the limit resets at
+                time.sleep(min(max(float(reset) - time.time(), 0.0), 60.0) if reset else 2 ** attempt)
+                continue
+            if response.status != 200:
+                raise AlpacaDataError(response.status, body.decode(errors="replace"))
+            return json.loads(body)
+
+    def close(self):
+        """Close the pooled connections, the next request opens a new one"""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def iter_bars(self, symbols, timeframe="1Day", start=None, end=None):
+        """Generator of (symbol, DataFrame) pages of bars of many symbols, following the page tokens
+
+        Up to SYMBOLS_PER_REQUEST symbols share each request and the next page is only
+        requested once the previous one was consumed. A symbol can come in several
+        frames, in time order.
+
+        Parameters:
+        - symbols: List of ticker symbols
+        - timeframe: Alpaca timeframe, e.g. "15Min" or "1Day"
+        - start, end: Range of bar start times, both inclusive
+        """
+        symbols = list(symbols)
+        for first in range(0, len(symbols), SYMBOLS_PER_REQUEST):
+            params = {
+                "symbols": ",".join(symbols[first:first + SYMBOLS_PER_REQUEST]),
+                "timeframe": timeframe,
+                "limit": PAGE_LIMIT,
+                "adjustment": self.adjustment,
+                "feed": self.feed,
+            }
+            if start is not None:
+                params["start"] = _utc(start).isoformat()
+            if end is not None:
+                params["end"] = _utc(end).isoformat()
+            while True:
+                page = self._get("/v2/stocks/bars", params)
+                self.stats["pages"] += 1
+                for symbol, bars in (page.get("bars") or {}).items():
+                    if bars:
+                        self.stats["bars"] += len(bars)
+                        yield symbol, from_alpaca(bars, symbol, self.price_dtype)
+                token = page.get("next_page_token")
+                if not token:
+                    break
+                params["page_token"] = token
+
+    def _download(self, symbols, timeframe, start, end):
+        """Dictionary symbol -> bars in [start, end) of every symbol, from shared requests"""
+        pages = {symbol: [] for symbol in symbols}
+        for symbol, df in self.iter_bars(symbols, timeframe, start, end):
+            pages.setdefault(symbol, []).append(df)
+        bars = {}
+        for symbol, frames in pages.items():
+            df = pd.concat(frames) if frames else empty_bars(symbol, self.price_dtype)
+            bars[symbol] = df[df.index < end] # Alpaca's end is inclusive, ours isn't
+        return bars
+
+    def get_bars(self, symbols, bar_size="1Day", start=None, end=None, duration="30 D"):
+        """Dictionary symbol -> time indexed OHLCV bars, downloaded with as few requests as possible
+
+        Parameters:
+        - symbols: List of ticker symbols
+        - bar_size: Bar size in Alpaca's ("15Min") or another provider's format ("15 mins", "15m")
+        - start, end: Range of bar start times, end defaults to now and start to end - duration
+        - duration: Length of the range when start isn't given, e.g. "30 D" or "1y"
+        """
+        timeframe = to_timeframe(bar_size)
+        end = _utc(end) if end is not None else pd.Timestamp.now(tz="UTC")
+        start = _utc(start) if start is not None else end - to_timedelta(duration)
+        symbols = list(dict.fromkeys(symbols))
+        if self.bar_cache is None:
+            return self._download(symbols, timeframe, start, end)
+
+        # symbols missing the same ranges are downloaded together, usually all of them miss the newest bars
+        groups = {}
+        for symbol in symbols:
+            segments = self.bar_cache.missing("alpaca", symbol, timeframe, start, end)
+            groups.setdefault(tuple(segments), []).append(symbol)
+        bars = {}
+        for segments, group in groups.items():
+            fetched = {symbol: [] for symbol in group}
+            for segment_start, segment_end in segments:
+                for symbol, df in self._download(group, timeframe, segment_start, segment_end).items():
+                    df = df[df.index >= segment_start]
+                    self.bar_cache.store("alpaca", symbol, timeframe, df, segment_start, segment_end)
+                    fetched[symbol].append(df)
+            for symbol in group:
+                df = self.bar_cache.combine("alpaca", symbol, timeframe, start, end, list(segments), fetched[symbol])
+                bars[symbol] = canonical(df, symbol, self.price_dtype) # also reads bars cached with extra columns
+        return bars
+
+    def get_historical_data(self, request_id, symbol, duration="30 D", bar_size="1Day", start=None, end=None):
+        """Get historical data for a symbol
+
+        Parameters:
+        - request_id: Unique identifier for this request
+        - symbol: Stock ticker symbol
+        - duration: Time period before end (e.g. "30 D", "2 W", "1y")
+        - bar_size: Interval for bars ("1Min", "15Min", "1Hour", "1Day", or e.g. "15 mins" and "1d")
+        - start, end: Explicit range instead of duration, end defaults to now
+        """
+        df = self.get_bars([symbol], bar_size, start, end, duration)[symbol]
+        df.request_id = request_id
+        return df
+
+    def get_historical_data_for_many(self, request_id, symbols, duration="30 D", bar_size="1Day", col_to_use="close",
+                                     start=None, end=None):
+        """Get historical data for multiple symbols, a (time x symbol) DataFrame of col_to_use"""
+        bars = self.get_bars(symbols, bar_size, start, end, duration)
+        df = pd.DataFrame({symbol: df[col_to_use] for symbol, df in bars.items()}).sort_index()
+        df.columns.name = "symbol"
+        df.request_id = request_id
+        return df
+
+
+_client = None
+
+
+def _default_client():
+    global _client
+    if _client is None:
+        _client = AlpacaDataClient()
+    _client.bar_cache = bar_cache # the module level setting is read on every call, as before
+    return _client
 
-# Initialize Alpaca API
-api = tradeapi.REST(API_KEY, API_SECRET, BASE_URL, api_version='v2')
 
 def get_historical_data(symbol, timeframe='1Day', start_date=None, end_date=None):
+    """Bars of one symbol with time as a column, the module level interface of older scripts"""
+    df = _default_client().get_historical_data(0, symbol, bar_size=timeframe, start=start_date, end=end_date)
+    return df.reset_index()
+
 
-    # Set default dates if not provided
-    if end_date is None:
-        end_date = datetime.datetime.now()
-    else:
-        end_date = pd.Timestamp(end_date)
-        
-    if start_date is None:
-        start_date = end_date - timedelta(days=30)  # Default to 30 days
-    else:
-        start_date = pd.Timestamp(start_date)
-    
-    # Format for Alpaca API
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
-    
-    # Get the data
-    bars = api.get_bars(
-        symbol,
-        timeframe,
-        start=start_date_str,
-        end=end_date_str,
-        adjustment='raw'  # 'raw', 'split', 'dividend', 'all'
-    ).df
-    
-    # Reset index to make timestamp a column
-    bars = bars.reset_index()
-    
-    # Rename columns to match typical OHLCV format
-    bars = bars.rename(columns={
-        'timestamp': 'time',
-        'open': 'open',
-        'high': 'high',
-        'low': 'low',
-        'close': 'close',
-        'volume': 'volume'
-    })
-    
-    # Add symbol column
-    bars['symbol'] = symbol
-    
-    return bars
-
-# Example usage for a single symbol
-aapl_data = get_historical_data(
-    symbol='AAPL',
-    timeframe='15Min',
-    start_date='2023-10-01',
-    end_date='2023-10-15'
-)
-
-print(f"Retrieved {len(aapl_data)} bars for AAPL")
-print(aapl_data.head())
-
-# Retrieve data for multiple stocks
 def get_historical_data_for_many(symbols, timeframe='1Day', start_date=None, end_date=None):
-    
-    
-    # Dictionary of DataFrames with historical price data
-    
+    """Dictionary symbol -> get_historical_data frame, downloaded together through the multi-symbol endpoint"""
+    bars = _default_client().get_bars(symbols, timeframe, start_date, end_date)
     data_dict = {}
-    
-    for symbol in symbols:
-        try:
-            data = get_historical_data(symbol, timeframe, start_date, end_date)
-            data_dict[symbol] = data
-            print(f"Retrieved {len(data)} bars for {symbol}")
-        except Exception as e:
-            print(f"Error retrieving data for {symbol}: {e}")
-    
+    for symbol, df in bars.items():
+        data_dict[symbol] = df.assign(symbol=symbol).reset_index()
+        print(f"Retrieved {len(df)} bars for {symbol}")
     return data_dict
 
-# Example usage for multiple symbols
-symbols = ['AAPL', 'MSFT', 'GOOGL', 'AMZN']
-all_data = get_historical_data_for_many(
-    symbols=symbols,
-    timeframe='1Day',
-    start_date='2025-02-01',
-    end_date='2025-03-02'
-)
-
-# Create a consolidated dataframe with closing prices
-if all_data:
-    # Combine all dataframes
-    all_dfs = []
-    for symbol, df in all_data.items():
-        all_dfs.append(df)
-    
-    if all_dfs:
-        combined_df = pd.concat(all_dfs)
-        
-        # Create pivot table with time as index, symbols as columns, close price as values
-        pivot_df = combined_df.pivot(index='time', columns='symbol', values='close')
-        
-        print("\nPivot table of closing prices:")
-        print(pivot_df.head())
\ No newline at end of file
+
+if __name__ == "__main__":
+    # Example usage for a single symbol
+    aapl_data = get_historical_data(
+        symbol='AAPL',
+        timeframe='15Min',
+        start_date='2023-10-01',
+        end_date='2023-10-15'
+    )
+
+    print(f"Retrieved {len(aapl_data)} bars for AAPL")
+    print(aapl_data.head())
+
+    # Closing prices of multiple stocks, time as index and symbols as columns
+    client = AlpacaDataClient()
+    pivot_df = client.get_historical_data_for_many(
+        0, ['AAPL', 'MSFT', 'GOOGL', 'AMZN'], bar_size='1Day', start='2025-02-01', end='2025-03-02'
+    )
+
+    print("\nPivot table of closing prices:")
+    print(pivot_df.head())
@@ -4,16 +4,21 @@ from wrapper import IBWrapper
 from client import IBClient
 from contract import stock, future, option # Import our contracts
 from order import limit, market, stop, BUY, SELL # Import our orders
+from order_router import OrderRouter # submits orders and tracks their status and latency
+from contract_registry import ContractRegistry # resolves contracts once and keeps them on disk
 
 class IBApp(IBWrapper, IBClient): # Inherits both our custom classes, creating a single class that can both send requests and process responses
 
-    def __init__(self, ip, port, client_id):
+    def __init__(self, ip, port, client_id, timeout=10):
         IBWrapper.__init__(self) # Initializes the wrapper 
         IBClient.__init__(self, wrapper=self) # Initializes the client functionality, passing itself as the wrapper since the class inherits from IBWrapper
+        self.order_router = OrderRouter(self) # receives orderStatus, openOrder and execDetails through IBWrapper
         self.connect(ip, port, client_id) # Creates a connection to the IB servers
         thread = threading.Thread(target=self.run, daemon=True) # makes a separate daemon thread that runs 'self.run()', which is the message processing loop that continously checks for incoming messages from the server
         thread.start()
-        time.sleep(2) # allow for time to make the connection
+        if not self.ready.wait(timeout): # TWS sends nextValidId as soon as it accepts requests, usually within milliseconds
+            self.disconnect()
+            raise ConnectionError(f"TWS at {ip}:{port} did not send nextValidId within {timeout} seconds")
 
 
 if __name__ == "__main__":
@@ -24,8 +29,8 @@ if __name__ == "__main__":
     aapl = stock("AAPL", "SMART", "USD")
     gbl = future("GBL", "EUREX", "202403")
     pltr = option("PLTR", "BOX", "20240315", 20, "C")
-    es = future("ES", "CME", "202506", "USD", "50")
-    es.localSymbol = "ESZ5"
+    contracts = ContractRegistry(app) # resolved contracts are kept in contracts.json between runs
+    es = contracts.front_month("ES", "CME") # rolls over to the next quarter by itself
     for tick in app.get_streaming_data(99, es):
         print(tick)
 
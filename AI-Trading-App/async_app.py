@@ -0,0 +1,204 @@
+import asyncio
+import threading
+from functools import partial
+from bar_cache import to_timedelta
+from client import IBClient
+from history_planner import fetch_history, max_request_span
+from ohlcv import pivot_bars
+from order_router import OrderRouter
+from tick_buffer import BufferClosed, DEFAULT_BUFFER_SIZE
+from ticks import Tick, TickBatch
+from wrapper import IBWrapper
+from yahoo_client import YahooFinanceClient
+
+_CLOSED = object() # put into the queue by close() so the consumer wakes up and stops
+
+
+class AsyncTickQueue:
+    """Stream buffer for asyncio consumers, filled from the EReader or poller thread
+
+    It has the put/close interface of TickBuffer, so IBWrapper.tickByTickBidAsk and
+    the Yahoo poller can feed it, but hands the ticks to the event loop thread-safely.
+    When maxsize ticks are waiting the oldest one is dropped and counted.
+    """
+
+    def __init__(self, loop, maxsize=DEFAULT_BUFFER_SIZE):
+        self.dropped = 0
+        self.closed = False
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def put(self, item):
+        if self.closed:
+            return False
+        try:
+            self._loop.call_soon_threadsafe(self._put, item) # the queue itself may only be touched from the loop
+        except RuntimeError: # the event loop is already closed, the tick has nowhere to go
+            return False
+        return True
+
+    def _put(self, item):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(item)
+
+    async def get(self):
+        item = await self._queue.get()
+        if item is _CLOSED:
+            raise BufferClosed()
+        return item
+
+    async def get_batch(self, max_items):
+        batch = [await self.get()] # wait for the first tick, then take whatever else is already there
+        while len(batch) < max_items and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is _CLOSED:
+                self._queue.put_nowait(item) # seen again by the next get()
+                break
+            batch.append(item)
+        return batch
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._loop.call_soon_threadsafe(self._put, _CLOSED)
+        except RuntimeError: # the event loop is already closed, nobody is waiting anymore
+            pass
+
+
+async def _iterate_ticks(queue, batch_size):
+    while True:
+        try:
+            if batch_size:
+                yield TickBatch.from_tuples(await queue.get_batch(batch_size))
+            else:
+                yield Tick(*await queue.get())
+        except BufferClosed:
+            return
+
+
+class AsyncIBApp(IBWrapper, IBClient):
+    """IBApp for asyncio, nothing waits on a fixed sleep
+
+    Parameters:
+    - ip, port, client_id: Where TWS or IB Gateway listens and our client id
+    - bar_cache: Optional BarCache, see IBClient
+    """
+
+    def __init__(self, ip, port, client_id, bar_cache=None):
+        IBWrapper.__init__(self)
+        IBClient.__init__(self, wrapper=self, bar_cache=bar_cache)
+        self.order_router = OrderRouter(self)
+        self.ip = ip
+        self.port = port
+        self.client_id = client_id
+        self.loop = None
+        self._connected = None # asyncio Future resolved by nextValidId
+
+    async def connect(self, timeout=10):
+        """Connect to TWS, returns once nextValidId arrived and requests are accepted"""
+        self.loop = asyncio.get_running_loop()
+        self._connected = self.loop.create_future() # created first, nextValidId can arrive right after the handshake
+        await self.loop.run_in_executor(None, partial(IBClient.connect, self, self.ip, self.port, self.client_id))
+        thread = threading.Thread(target=self.run, daemon=True) # the EReader message loop
+        thread.start()
+        await asyncio.wait_for(asyncio.shield(self._connected), timeout)
+        return self.next_valid_id
+
+    def nextValidId(self, order_id):
+        IBWrapper.nextValidId(self, order_id)
+        if self._connected is not None:
+            self.loop.call_soon_threadsafe(self._resolve_connected)
+
+    def _resolve_connected(self):
+        if not self._connected.done():
+            self._connected.set_result(self.next_valid_id)
+
+    async def get_historical_data(self, request_id, contract, duration, bar_size, timeout=60):
+        """Historical bars of one contract, resolves on historicalDataEnd of its last request"""
+        if self.bar_cache is not None: # the cache reads and writes files, keep that off the event loop
+            return await self.loop.run_in_executor(None, partial(
+                IBClient.get_historical_data, self, request_id, contract, duration, bar_size, timeout))
+        span = max_request_span("ib", bar_size)
+        if span is not None and to_timedelta(duration) > span: # split like IBClient's version, the chunks are waited for in a worker thread
+            df = await self.loop.run_in_executor(None, lambda: fetch_history(
+                self, request_id, contract, bar_size, duration=duration, timeout=timeout).to_frame())
+            df.request_id = request_id
+            return df
+        # the pacer may hold the request back, so it is sent from a worker thread
+        future = await self.loop.run_in_executor(
+            None, self.request_historical_data, request_id, contract, duration, bar_size)
+        try:
+            data = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            # the same clean up as the blocking client, which also raises the TimeoutError
+            return self._historical_bars_to_frame(
+                request_id, contract, bar_size, self._wait_for_historical_data(request_id, future, 0))
+        return self._historical_bars_to_frame(request_id, contract, bar_size, data)
+
+    async def get_historical_data_for_many(self, request_id, contracts, duration, bar_size, col_to_use="close", timeout=60):
+        """Historical bars of several contracts fetched concurrently, pivoted like IBClient's version"""
+        span = max_request_span("ib", bar_size)
+        if self.bar_cache is not None or (span is not None and to_timedelta(duration) > span):
+            # contracts needing several requests each take a block of request ids, IBClient's version hands them out
+            return await self.loop.run_in_executor(None, partial(
+                IBClient.get_historical_data_for_many, self, request_id, contracts, duration, bar_size, col_to_use, timeout))
+        results = await asyncio.gather(
+            *(self.get_historical_data(request_id + i, contract, duration, bar_size, timeout) for i, contract in enumerate(contracts)),
+            return_exceptions=True,
+        )
+        dfs = []
+        for contract, result in zip(contracts, results):
+            if isinstance(result, Exception):
+                print(f"Error retrieving data for {contract.symbol}: {result}")
+                continue
+            dfs.append(result)
+        return pivot_bars(dfs, col_to_use) # an empty frame when every request failed
+
+    async def get_streaming_data(self, request_id, contract, maxsize=None, batch_size=None):
+        """Async iterator over the bid/ask ticks of contract, stops after stop_streaming_data"""
+        queue = AsyncTickQueue(self.loop or asyncio.get_running_loop(), maxsize or self.stream_buffer_size)
+        self.start_tick_stream(request_id, contract, queue)
+        try:
+            async for tick in _iterate_ticks(queue, batch_size):
+                yield tick
+        finally:
+            if self.streaming_data.get(request_id) is queue: # the consumer left without stopping the stream
+                self.stop_streaming_data(request_id)
+
+
+class AsyncYahooFinanceClient(YahooFinanceClient):
+    """YahooFinanceClient for asyncio, downloads run in worker threads and streams are async iterators"""
+
+    async def get_historical_data(self, request_id, symbol, duration="2d", bar_size="30m"):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(
+            YahooFinanceClient.get_historical_data, self, request_id, symbol, duration, bar_size))
+
+    async def get_historical_data_for_many(self, request_id, symbols, duration, bar_size, col_to_use="close"):
+        results = await asyncio.gather(
+            *(self.get_historical_data(request_id + i, symbol, duration, bar_size) for i, symbol in enumerate(symbols)),
+            return_exceptions=True,
+        )
+        dfs = []
+        for symbol, result in zip(symbols, results):
+            if isinstance(result, Exception):
+                print(f"Error retrieving data for {symbol}: {result}")
+                continue
+            dfs.append(result)
+        return pivot_bars(dfs, col_to_use) # an empty frame when every request failed
+
+    async def get_streaming_data(self, request_id, symbol, polling_interval=5, batch_size=None):
+        queue = AsyncTickQueue(asyncio.get_running_loop())
+        self.start_polling(request_id, symbol, polling_interval, queue) # the shared poller thread feeds the queue
+        try:
+            async for tick in _iterate_ticks(queue, batch_size):
+                yield tick
+        finally:
+            self.stop_streaming_data(request_id)
@@ -0,0 +1,177 @@
+import numpy as np
+from ohlcv import PRICE_DTYPE, bars_frame # the bar format shared by every client
+from ticks import TickBatch, NS_PER_SECOND
+
+
+class Bar:
+    """One OHLCV bar, time is the start of the bar in seconds since the epoch"""
+
+    __slots__ = ("time", "open", "high", "low", "close", "volume", "ticks")
+
+    def __init__(self, time, price, volume):
+        self.time = time
+        self.open = self.high = self.low = self.close = price
+        self.volume = volume
+        self.ticks = 1
+
+    def add(self, price, volume):
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += volume
+        self.ticks += 1
+
+    def as_tuple(self):
+        return (self.time, self.open, self.high, self.low, self.close, self.volume)
+
+    def __repr__(self):
+        return f"Bar(time={self.time}, open={self.open}, high={self.high}, low={self.low}, close={self.close}, volume={self.volume})"
+
+
+class TimeBars:
+    """Bars covering a fixed number of seconds, aligned to the epoch (a 60 second bar starts on the minute)
+
+    Ticks older than the open bar arrive too late to be included, they are
+    counted in late_ticks and dropped.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.name = f"{seconds}s"
+        self.late_ticks = 0
+        self.bar = None
+
+    def update(self, time, price, volume):
+        start = time - time % self.seconds
+        bar = self.bar
+        if bar is None:
+            self.bar = Bar(start, price, volume)
+            return None
+        if start == bar.time:
+            bar.add(price, volume)
+            return None
+        if start < bar.time: # belongs to a bar we already emitted
+            self.late_ticks += 1
+            return None
+        self.bar = Bar(start, price, volume) # the tick opens the next bar, which closes this one
+        return bar
+
+    def flush(self):
+        bar, self.bar = self.bar, None
+        return bar
+
+
+class TickBars:
+    """Bars of a fixed number of ticks"""
+
+    def __init__(self, ticks):
+        self.ticks = ticks
+        self.name = f"{ticks}t"
+        self.bar = None
+
+    def update(self, time, price, volume):
+        bar = self.bar
+        if bar is None:
+            self.bar = bar = Bar(time, price, volume)
+        else:
+            bar.add(price, volume)
+        if bar.ticks >= self.ticks:
+            self.bar = None
+            return bar
+        return None
+
+    def flush(self):
+        bar, self.bar = self.bar, None
+        return bar
+
+
+class VolumeBars:
+    """Bars that close as soon as they hold at least a given volume"""
+
+    def __init__(self, volume):
+        self.volume = volume
+        self.name = f"{volume}v"
+        self.bar = None
+
+    def update(self, time, price, volume):
+        bar = self.bar
+        if bar is None:
+            self.bar = bar = Bar(time, price, volume)
+        else:
+            bar.add(price, volume)
+        if bar.volume >= self.volume:
+            self.bar = None
+            return bar
+        return None
+
+    def flush(self):
+        bar, self.bar = self.bar, None
+        return bar
+
+
+def mid_price(tick):
+    return (tick.bid_price + tick.ask_price) / 2 # same price IB's MIDPOINT history uses
+
+
+def tick_count(tick):
+    return 1 # bid/ask ticks carry no traded volume, so each quote update counts as one
+
+
+class BarAggregator:
+    """Builds several kinds of bars from one tick stream with O(1) work per tick and bar kind
+
+    Parameters:
+    - bar_types: TimeBars, TickBars and VolumeBars instances to build at the same time
+    - price: Function tick -> price, the bid/ask midpoint by default
+    - volume: Function tick -> volume added to the bar, 1 per tick by default
+    - session_gap: Seconds without ticks after which every open bar is closed,
+      so no bar spans the overnight break; None never closes bars on a gap
+    """
+
+    def __init__(self, bar_types, price=mid_price, volume=tick_count, session_gap=None):
+        self.bar_types = list(bar_types)
+        self.price = price
+        self.volume = volume
+        self.session_gap = session_gap
+        self.last_time = None
+
+    def update(self, tick):
+        """Add a tick, returns the (bar type name, Bar) pairs it completed"""
+        time = tick.time
+        completed = []
+        if self.session_gap is not None and self.last_time is not None and time - self.last_time > self.session_gap:
+            completed = self.flush() # a new session starts, close what the old one left open
+        if self.last_time is None or time > self.last_time:
+            self.last_time = time
+        price = self.price(tick)
+        volume = self.volume(tick)
+        for bar_type in self.bar_types:
+            bar = bar_type.update(time, price, volume)
+            if bar is not None:
+                completed.append((bar_type.name, bar))
+        return completed
+
+    def flush(self):
+        """Close every open bar, e.g. at the end of the stream or session"""
+        completed = []
+        for bar_type in self.bar_types:
+            bar = bar_type.flush()
+            if bar is not None:
+                completed.append((bar_type.name, bar))
+        return completed
+
+    def aggregate(self, ticks):
+        """Generator over the (bar type name, Bar) pairs built from a Tick or TickBatch iterator"""
+        for item in ticks:
+            for tick in (item if isinstance(item, TickBatch) else (item,)):
+                yield from self.update(tick)
+        yield from self.flush() # the stream ended, the open bars are as complete as they will get
+
+
+def bars_to_frame(bars, symbol, price_dtype=PRICE_DTYPE):
+    """DataFrame of bars in the format of the clients' historical data (see ohlcv.py), indexed by UTC bar start time"""
+    rows = np.array([bar.as_tuple() for bar in bars], dtype=np.float64).reshape(-1, 6) # time, open, high, low, close, volume
+    time_ns = np.round(rows[:, 0] * NS_PER_SECOND).astype(np.int64)
+    return bars_frame(time_ns, *rows[:, 1:].T, symbol, price_dtype)
@@ -0,0 +1,276 @@
+import json
+import os
+import re
+import threading
+import pandas as pd
+
+# Bars are stored as Parquet files partitioned like
+#   <root>/<provider>/<symbol>/<bar size>/<day or year>.parquet
+# (for IB the symbol is contract_key(contract), which tells expiries and listings apart)
+# next to a _coverage.json that lists the time ranges already downloaded, so
+# weekends, holidays and empty sessions are not fetched again and again.
+
+COVERAGE_FILE = "_coverage.json"
+
+# bar size units used by IB ("30 secs", "1 day"), Yahoo ("30m", "1wk") and Alpaca ("15Min", "1Day")
+_UNITS = {
+    "s": "s", "sec": "s", "secs": "s",
+    "m": "min", "min": "min", "mins": "min",
+    "h": "h", "hour": "h", "hours": "h",
+    "d": "D", "day": "D", "days": "D",
+    "w": "W", "wk": "W", "week": "W", "weeks": "W",
+    "mo": "M", "month": "M", "months": "M",
+    "y": "Y", "year": "Y", "years": "Y",
+}
+
+
+def _parse_size(text):
+    match = re.fullmatch(r"\s*(\d+)\s*([a-zA-Z]+)\s*", text)
+    if match is None:
+        raise ValueError(f"Can't parse {text!r} as a bar size or duration")
+    number, unit = int(match.group(1)), match.group(2)
+    unit = _UNITS.get("mo" if unit == "M" else unit.lower()) # IB writes a month as "1 M", every other unit ignores case
+    if unit is None:
+        raise ValueError(f"Unknown unit in {text!r}")
+    return number, unit
+
+
+# Yahoo intervals of IB's bar sizes, the Yahoo client downloads and caches bars under the interval
+YAHOO_INTERVALS = {
+    "1 min": "1m",
+    "5 mins": "5m",
+    "15 mins": "15m",
+    "30 secs": "1m",  # Yahoo doesn't support 30s, default to 1m
+    "30 mins": "30m",
+    "1 hour": "60m",
+    "1 day": "1d",
+}
+
+
+def contract_key(contract):
+    """Name the bars of an IB contract are cached under, e.g. "STK_AAPL_SMART_USD" or "FUT_ES_202412_CME_USD"
+
+    A symbol alone is shared by every expiry of a future, by a stock and a future of
+    the same name and by the listings of a stock on several exchanges. The key adds the
+    fields that tell them apart, those a contract leaves empty are left out.
+    """
+    strike = getattr(contract, "strike", 0)
+    parts = [contract.secType, contract.symbol, getattr(contract, "lastTradeDateOrContractMonth", ""),
+             f"{float(strike):g}" if strike else "", getattr(contract, "right", ""),
+             contract.exchange, getattr(contract, "primaryExchange", ""), contract.currency]
+    return "_".join(str(part).upper() for part in parts if part)
+
+
+def yahoo_interval(bar_size):
+    """Yahoo interval of a bar size, bar sizes already written for Yahoo ("15m", "1d") are returned as they are"""
+    return YAHOO_INTERVALS.get(bar_size, bar_size)
+
+
+def to_timedelta(text):
+    """Convert a bar size or duration of any provider ("30 secs", "15m", "1Day", "2 D", "1mo") to a Timedelta"""
+    number, unit = _parse_size(text)
+    if unit == "M":
+        return pd.Timedelta(days=31 * number) # long enough to cover any calendar month
+    if unit == "Y":
+        return pd.Timedelta(days=366 * number)
+    if unit == "W":
+        return pd.Timedelta(weeks=number)
+    return pd.Timedelta(number, unit=unit)
+
+
+def _to_ns(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return timestamp.value
+
+
+def _subtract(start, end, covered):
+    """Parts of [start, end) that are not inside any of the sorted covered ranges"""
+    missing = []
+    for covered_start, covered_end in covered:
+        if covered_end <= start:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+        if start >= end:
+            return missing
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def _merge(covered, start, end):
+    ranges = sorted(covered + [(start, end)])
+    merged = [list(ranges[0])]
+    for range_start, range_end in ranges[1:]:
+        if range_start <= merged[-1][1]: # overlapping or touching ranges become one
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return [tuple(r) for r in merged]
+
+
+class BarCache:
+    """On-disk store of OHLCV bars shared by the IB, Yahoo and Alpaca clients
+
+    Parameters:
+    - root: Directory the Parquet files are written to
+    - cache_forming_bar: Also keep the bar that is still forming at download time,
+      by default it is dropped and downloaded again on the next request
+    """
+
+    def __init__(self, root="bar_cache", cache_forming_bar=False):
+        self.root = root
+        self.cache_forming_bar = cache_forming_bar
+        self.stats = {"hits": 0, "partial_hits": 0, "misses": 0, "bars_read": 0, "bars_fetched": 0}
+        self._lock = threading.Lock()
+
+    def _directory(self, provider, symbol, bar_size):
+        parts = [provider, symbol, bar_size.replace(" ", "_")]
+        return os.path.join(self.root, *(re.sub(r"[^\w.=-]", "_", part) for part in parts))
+
+    def _coverage(self, directory):
+        path = os.path.join(directory, COVERAGE_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [tuple(r) for r in json.load(f)]
+
+    def _write_coverage(self, directory, coverage):
+        tmp = os.path.join(directory, COVERAGE_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(coverage, f)
+        os.replace(tmp, os.path.join(directory, COVERAGE_FILE)) # readers see the old or the new coverage, never half of it
+
+    def _partition(self, timestamp, bar_size):
+        # intraday bars get one file per day, daily and longer bars one file per year
+        if to_timedelta(bar_size) < pd.Timedelta(days=1):
+            return timestamp.strftime("%Y-%m-%d")
+        return timestamp.strftime("%Y")
+
+    def missing(self, provider, symbol, bar_size, start, end):
+        """List the (start, end) Timestamp ranges inside [start, end) that still have to be downloaded"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        covered = self._coverage(self._directory(provider, symbol, bar_size))
+        tz = start.tzinfo
+        return [
+            (self._from_ns(a, tz), self._from_ns(b, tz))
+            for a, b in _subtract(_to_ns(start), _to_ns(end), covered)
+        ]
+
+    @staticmethod
+    def _from_ns(value, tz):
+        timestamp = pd.Timestamp(value)
+        return timestamp.tz_localize("UTC").tz_convert(tz) if tz is not None else timestamp
+
+    def read(self, provider, symbol, bar_size, start, end):
+        """Read the cached bars in [start, end), indexed by time"""
+        directory = self._directory(provider, symbol, bar_size)
+        if not os.path.isdir(directory):
+            return None
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        first, last = self._partition(start, bar_size), self._partition(end, bar_size)
+        files = sorted(
+            name for name in os.listdir(directory)
+            if name.endswith(".parquet") and first <= name[:-len(".parquet")] <= last
+        )
+        if not files:
+            return None
+        df = pd.concat([pd.read_parquet(os.path.join(directory, name)) for name in files])
+        times = df.index.tz_convert("UTC").tz_localize(None) if df.index.tz is not None else df.index
+        return df[(times >= pd.Timestamp(_to_ns(start))) & (times < pd.Timestamp(_to_ns(end)))]
+
+    def store(self, provider, symbol, bar_size, df, start, end):
+        """Write freshly downloaded bars and mark [start, end) as covered"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if not self.cache_forming_bar:
+            # a bar that started less than one bar ago is still changing, keep it out of the cache
+            now = pd.Timestamp.now(tz=start.tzinfo) if start.tzinfo is not None else pd.Timestamp.now()
+            end = min(end, now - to_timedelta(bar_size))
+            if len(df):
+                df = df[df.index < end]
+        if end <= start:
+            return
+        directory = self._directory(provider, symbol, bar_size)
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            if len(df):
+                for partition, part in df.groupby(df.index.map(lambda t: self._partition(t, bar_size))):
+                    path = os.path.join(directory, f"{partition}.parquet")
+                    if os.path.exists(path):
+                        part = pd.concat([pd.read_parquet(path), part])
+                        part = part[~part.index.duplicated(keep="last")] # fresh bars win over old ones
+                    tmp = path + ".tmp"
+                    part.sort_index().to_parquet(tmp)
+                    os.replace(tmp, path) # readers never see a half written file
+            self._write_coverage(directory, _merge(self._coverage(directory), _to_ns(start), _to_ns(end)))
+
+    def get(self, provider, symbol, bar_size, start, end, fetch):
+        """Return the bars in [start, end), downloading only the ranges not cached yet
+
+        Parameters:
+        - provider: Name of the data source, e.g. "ib", "yahoo" or "alpaca"
+        - symbol: Ticker symbol, or contract_key(contract) for IB contracts
+        - bar_size: Bar size as the provider spells it
+        - start, end: Range of bar start times to return
+        - fetch: Function fetch(start, end) that downloads a range and returns a time indexed DataFrame
+        """
+        segments = self.missing(provider, symbol, bar_size, start, end)
+        fetched = []
+        for segment_start, segment_end in segments:
+            df = fetch(segment_start, segment_end)
+            df = df[(df.index >= segment_start) & (df.index < segment_end)]
+            self.store(provider, symbol, bar_size, df, segment_start, segment_end)
+            fetched.append(df)
+        return self.combine(provider, symbol, bar_size, start, end, segments, fetched)
+
+    def combine(self, provider, symbol, bar_size, start, end, segments, fetched):
+        """Merge freshly fetched segments with the cached bars and update the statistics"""
+        cached = self.read(provider, symbol, bar_size, start, end) # already contains what store() kept of fetched
+        frames = [df for df in [cached] + fetched if df is not None and len(df)]
+        if frames:
+            df = pd.concat(frames)
+            df = df[~df.index.duplicated(keep="last")].sort_index()
+        else:
+            df = fetched[0] if fetched else cached
+        n_fetched = sum(len(f) for f in fetched)
+        with self._lock:
+            if not segments:
+                self.stats["hits"] += 1
+            elif segments == [(pd.Timestamp(start), pd.Timestamp(end))]:
+                self.stats["misses"] += 1
+            else:
+                self.stats["partial_hits"] += 1
+            self.stats["bars_fetched"] += n_fetched
+            self.stats["bars_read"] += max((len(df) if df is not None else 0) - n_fetched, 0)
+        return df
+
+    def invalidate(self, provider, symbol, bar_size, since=None):
+        """Forget the cached bars of a symbol, or only those from since onwards"""
+        directory = self._directory(provider, symbol, bar_size)
+        if not os.path.isdir(directory):
+            return
+        with self._lock:
+            if since is None:
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+                return
+            since = pd.Timestamp(since)
+            since = since.tz_localize("UTC") if since.tzinfo is None else since.tz_convert("UTC") # naive times are UTC, like the bars
+            since_ns = _to_ns(since)
+            coverage = [(a, min(b, since_ns)) for a, b in self._coverage(directory) if a < since_ns]
+            self._write_coverage(directory, coverage) # shrunk before the files, so it never claims bars that are gone
+            for name in os.listdir(directory):
+                if name.endswith(".parquet") and name[:-len(".parquet")] >= self._partition(since, bar_size):
+                    path = os.path.join(directory, name)
+                    df = pd.read_parquet(path)
+                    df = df[df.index < (since if df.index.tz is not None else since.tz_localize(None))] # files of naive times too
+                    if len(df):
+                        df.to_parquet(path + ".tmp")
+                        os.replace(path + ".tmp", path)
+                    else:
+                        os.remove(path)
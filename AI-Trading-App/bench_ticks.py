@@ -0,0 +1,76 @@
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+import pandas as pd
+from ticks import Tick, TickBatch
+
+N_TICKS = 200_000
+BATCH_SIZE = 1_000
+
+
+# The dataclass the clients used before ticks.py, kept here as the baseline
+@dataclass
+class DataclassTick:
+    time: int
+    bid_price: float
+    ask_price: float
+    bid_size: float
+    ask_size: float
+    timestamp_: pd.Timestamp = field(init=False)
+
+    def __post_init__(self):
+        self.timestamp_ = pd.to_datetime(self.time, unit="s")
+        self.bid_price = float(self.bid_price)
+        self.ask_price = float(self.ask_price)
+        self.bid_size = int(self.bid_size)
+        self.ask_size = int(self.ask_size)
+
+
+def make_raw_ticks(n):
+    """The tuples IBWrapper.tickByTickBidAsk puts in a stream's buffer"""
+    start = 1_700_000_000
+    return [(start + i // 50, 5000.25 + (i % 4) * 0.25, 5000.5 + (i % 4) * 0.25, 10 + i % 7, 12 + i % 5) for i in range(n)]
+
+
+def measure(name, build, raw):
+    """Run build(raw) once for speed and once under tracemalloc for memory"""
+    start = time.perf_counter()
+    build(raw)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    kept = build(raw) # kept alive so its memory is still allocated when we take the snapshot
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {
+        "name": name,
+        "ticks_per_sec": len(raw) / elapsed,
+        "bytes_per_tick": current / len(raw),
+    }
+
+
+def build_dataclass_ticks(raw):
+    return [DataclassTick(*t) for t in raw]
+
+
+def build_slotted_ticks(raw):
+    return [Tick(*t) for t in raw]
+
+
+def build_batches(raw):
+    return [TickBatch.from_tuples(raw[i:i + BATCH_SIZE]) for i in range(0, len(raw), BATCH_SIZE)]
+
+
+def run(n=N_TICKS):
+    raw = make_raw_ticks(n)
+    return [
+        measure("dataclass Tick (before)", build_dataclass_ticks, raw),
+        measure("__slots__ Tick", build_slotted_ticks, raw),
+        measure(f"TickBatch of {BATCH_SIZE}", build_batches, raw),
+    ]
+
+
+if __name__ == "__main__":
+    for result in run():
+        print(f"{result['name']:<28} {result['ticks_per_sec']:>14,.0f} ticks/sec {result['bytes_per_tick']:>8.1f} bytes/tick")
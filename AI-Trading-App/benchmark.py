@@ -0,0 +1,199 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import threading
+import time
+import tracemalloc
+import bench_ticks
+from client import IBClient
+from contract import stock
+from fake_tws import FakeTWS
+from latency import LatencyRecorder
+from wrapper import IBWrapper
+
+# Benchmarks of the client hot paths against FakeTWS and the yfinance stub,
+# run with
+#   python benchmark.py --output results.json
+#   python benchmark.py --compare results.json   (after a change)
+# Every benchmark returns a flat dictionary of numbers so runs can be diffed.
+
+
+class BenchApp(IBWrapper, IBClient):
+    """IBApp without the fixed sleep, connected once nextValidId arrived"""
+
+    def __init__(self, port):
+        IBWrapper.__init__(self)
+        IBClient.__init__(self, wrapper=self)
+        self.connect("127.0.0.1", port, 1)
+        threading.Thread(target=self.run, daemon=True).start()
+        if not self.ready.wait(10):
+            raise RuntimeError("FakeTWS did not send nextValidId")
+
+
+def bench_ib_stream(n_ticks=200_000, batch_size=None, trace_memory=False, timed=False):
+    """Ticks per second through IBClient.get_streaming_data, or with trace_memory the peak memory it allocates
+
+    tracemalloc slows every allocation down several times, so throughput and memory are separate runs.
+    timed switches the latency instrumentation on, to see what it costs.
+    """
+    with FakeTWS(n_ticks=n_ticks) as tws:
+        app = BenchApp(tws.port)
+        if timed:
+            app.latency = LatencyRecorder()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        received = 0
+        for item in app.get_streaming_data(1, stock("ES", "CME", "USD"), batch_size=batch_size):
+            received += len(item) if batch_size else 1
+            if received >= n_ticks:
+                break
+        elapsed = time.perf_counter() - start
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        app.stop_streaming_data(1)
+        app.disconnect()
+    if trace_memory:
+        return {"ticks": received, "peak_traced_bytes": peak}
+    return {"ticks": received, "ticks_per_sec": received / elapsed}
+
+
+def bench_ib_history(n_symbols=50, latency=0.2, bars=500):
+    """Wall time of get_historical_data_for_many when each request takes latency seconds on the server"""
+    with FakeTWS(history_latency=latency, bars_per_request=bars) as tws:
+        app = BenchApp(tws.port)
+        contracts = [stock(f"SYM{i}", "SMART", "USD") for i in range(n_symbols)]
+        start = time.perf_counter()
+        df = app.get_historical_data_for_many(1, contracts, "2 Y", "1 day")
+        elapsed = time.perf_counter() - start
+        app.disconnect()
+    return {"symbols": df.shape[1], "seconds": elapsed, "server_latency": latency}
+
+
+def bench_idle_cpu(seconds=2.0):
+    """CPU seconds used per wall second while a consumer waits on a stream that sends nothing"""
+    with FakeTWS(tick_rate=0) as tws:
+        app = BenchApp(tws.port)
+        stream = app.get_streaming_data(1, stock("ES", "CME", "USD"))
+        consumer = threading.Thread(target=lambda: next(stream, None), daemon=True)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        consumer.start()
+        time.sleep(seconds)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        app.stop_streaming_data(1) # closes the buffer, which ends the waiting consumer
+        consumer.join(5)
+        app.disconnect()
+    return {"cpu_per_wall_second": cpu / wall}
+
+
+def bench_yahoo(n_symbols=50, latency=0.05, n_ticks=20):
+    """Historical fetch time and polled ticks per download through YahooFinanceClient and the yfinance stub"""
+    try:
+        import fake_yahoo
+        from yahoo_client import YahooFinanceClient
+    except ImportError as e: # yfinance is optional for the IB benchmarks
+        return {"skipped": str(e)}
+
+    symbols = [f"SYM{i}" for i in range(n_symbols)]
+    with fake_yahoo.install(latency) as fake:
+        client = YahooFinanceClient()
+        start = time.perf_counter()
+        client.get_historical_data_for_many(1, symbols, "1mo", "1d")
+        history_seconds = time.perf_counter() - start
+
+        calls_before = fake.calls
+        received = 0
+        start = time.perf_counter()
+        streams = [client.get_streaming_data(100 + i, symbol, polling_interval=0.01) for i, symbol in enumerate(symbols[:10])]
+        for stream in streams: # each stream is read in turn, they all share the one poller
+            for _ in range(n_ticks):
+                next(stream)
+                received += 1
+        stream_seconds = time.perf_counter() - start
+        client.disconnect()
+    return {
+        "history_seconds": history_seconds,
+        "stream_ticks_per_sec": received / stream_seconds,
+        "downloads_per_tick": (fake.calls - calls_before) / received,
+    }
+
+
+def bench_tick_objects():
+    return {result["name"]: {"ticks_per_sec": result["ticks_per_sec"], "bytes_per_tick": result["bytes_per_tick"]}
+            for result in bench_ticks.run()}
+
+
+BENCHMARKS = {
+    "tick_objects": bench_tick_objects,
+    "ib_stream": bench_ib_stream,
+    "ib_stream_batched": lambda: bench_ib_stream(batch_size=1000),
+    "ib_stream_timed": lambda: bench_ib_stream(timed=True),
+    "ib_stream_memory": lambda: bench_ib_stream(n_ticks=50_000, trace_memory=True),
+    "ib_history_50_symbols": bench_ib_history,
+    "idle_cpu": bench_idle_cpu,
+    "yahoo": bench_yahoo,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(names=None):
+    results = {}
+    for name, benchmark in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        print(f"running {name}...", flush=True)
+        results[name] = benchmark()
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new):
+    """Print every metric of two runs side by side with the relative change"""
+    old_flat, new_flat = _flatten(old["results"]), _flatten(new["results"])
+    print(f"{'metric':<60} {old['commit'] or 'old':>14} {new['commit'] or 'new':>14} {'change':>8}")
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[key], new_flat[key]
+        change = f"{(after - before) / before:+.1%}" if before else ""
+        print(f"{key:<60} {before:>14.4g} {after:>14.4g} {change:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the trading clients against local stand-ins")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = run(args.names)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,247 @@
+import time
+
+STARTED = time.perf_counter() # taken before any other import, the base of the startup timing
+
+import argparse
+import importlib
+import sys
+import types
+
+# Command line entry point for one-off fetches, streams, cache warming and
+# benchmarks:
+#   python cli.py fetch AAPL MSFT --provider yahoo --duration 5d --bar-size 1d
+#   python cli.py fetch AAPL MSFT --provider yahoo --cache bar_cache --cache-only
+#   python cli.py stream AAPL --provider ib --port 7497 --count 100
+#   python cli.py cache-warm AAPL MSFT --provider alpaca --cache bar_cache --duration 1y
+#   python cli.py benchmark ib_stream idle_cpu
+# Only the standard library is imported up front. pandas, ibapi, yfinance and
+# the clients are imported by the command that needs them, so a cache-only
+# fetch never loads ibapi or yfinance, and --timing prints how long every import,
+# the connection and the command took.
+
+PROVIDERS = ("ib", "yahoo", "alpaca")
+STREAM_PROVIDERS = ("ib", "yahoo") # Alpaca's client only has historical bars
+DEFAULT_BAR_SIZES = {"ib": "1 day", "yahoo": "1d", "alpaca": "1Day"}
+DEFAULT_DURATIONS = {"ib": "1 M", "yahoo": "1mo", "alpaca": "30 D"}
+
+_timings = [] # (stage, seconds) in the order they happened
+
+
+def _timed(stage, function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    _timings.append((stage, time.perf_counter() - started))
+    return result
+
+
+def _import(module):
+    """Import a module on first use and record how long that took"""
+    if module in sys.modules:
+        return sys.modules[module]
+    return _timed(f"import {module}", importlib.import_module, module)
+
+
+def _report_timing():
+    for stage, seconds in _timings:
+        print(f"{stage:<24} {seconds * 1000:9.1f} ms", file=sys.stderr)
+    print(f"{'total':<24} {(time.perf_counter() - STARTED) * 1000:9.1f} ms", file=sys.stderr)
+
+
+def _connect(args, bar_cache=None):
+    """Client of args.provider, ready for requests"""
+    if args.provider == "ib":
+        app = _import("app")
+        client = _timed("connect", app.IBApp, args.host, args.port, args.client_id, args.timeout) # returns on nextValidId
+    elif args.provider == "yahoo":
+        client = _import("yahoo_client").YahooFinanceClient()
+    else:
+        alpacadata = _import("alpacadata")
+        client = alpacadata.AlpacaDataClient(data_url=args.alpaca_url or alpacadata.DATA_URL)
+    client.bar_cache = bar_cache
+    return client
+
+
+def _disconnect(client):
+    if hasattr(client, "disconnect"):
+        client.disconnect()
+    else:
+        client.close()
+
+
+def _instruments(args):
+    # IB wants contracts, the other providers take the symbols as they are
+    if args.provider != "ib":
+        return args.symbols
+    contract = _import("contract")
+    return [contract.stock(symbol, args.exchange, args.currency) for symbol in args.symbols]
+
+
+def _bar_cache(args):
+    if args.cache is None:
+        return None
+    return _import("bar_cache").BarCache(args.cache)
+
+
+def _read_cache(args, bar_size, duration):
+    """(time x symbol) frame of args.field from what the cache holds, without importing any provider"""
+    pd = _import("pandas")
+    bar_cache = _import("bar_cache")
+    if args.provider == "alpaca": # cached under Alpaca's timeframe name
+        bar_size = _import("alpacadata").to_timeframe(bar_size)
+    elif args.provider == "yahoo": # cached under the yfinance interval, "1 min" is "1m"
+        bar_size = bar_cache.yahoo_interval(bar_size)
+    end = pd.Timestamp.now(tz="UTC") # every provider's bars are cached by UTC time
+    cache = _bar_cache(args)
+    columns = {}
+    for symbol in args.symbols:
+        key = symbol
+        if args.provider == "ib": # cached under the stock contract _instruments would build, without importing ibapi
+            key = bar_cache.contract_key(
+                types.SimpleNamespace(secType="STK", symbol=symbol, exchange=args.exchange, currency=args.currency))
+        df = _timed(f"read {symbol}", cache.read, args.provider, key, bar_size, end - bar_cache.to_timedelta(duration), end)
+        if df is None:
+            print(f"Nothing cached for {symbol}", file=sys.stderr)
+            continue
+        columns[symbol] = df[args.field]
+    df = pd.DataFrame(columns)
+    df.columns.name = "symbol"
+    return df
+
+
+def fetch(args):
+    """Print or save historical bars of one field for every symbol"""
+    bar_size = args.bar_size or DEFAULT_BAR_SIZES[args.provider]
+    duration = args.duration or DEFAULT_DURATIONS[args.provider]
+    if args.cache_only:
+        if args.cache is None:
+            raise SystemExit("--cache-only needs --cache")
+        df = _read_cache(args, bar_size, duration)
+    else:
+        client = _connect(args, _bar_cache(args))
+        try:
+            df = _timed("download", client.get_historical_data_for_many,
+                        args.request_id, _instruments(args), duration, bar_size, col_to_use=args.field)
+        finally:
+            _disconnect(client)
+    if args.output is None:
+        print(df)
+    elif args.output.endswith(".parquet"):
+        df.to_parquet(args.output)
+    else:
+        df.to_csv(args.output)
+
+
+def stream(args):
+    """Print ticks of one symbol until --count ticks arrived or Ctrl+C"""
+    client = _connect(args)
+    instrument = _instruments(args)[0]
+    if args.provider == "ib":
+        ticks = client.get_streaming_data(args.request_id, instrument, batch_size=args.batch_size)
+    else:
+        ticks = client.get_streaming_data(args.request_id, instrument, args.interval, batch_size=args.batch_size)
+    waiting = time.perf_counter()
+    received = 0
+    try:
+        for tick in ticks:
+            if not received:
+                _timings.append(("first tick", time.perf_counter() - waiting))
+            print(tick)
+            received += len(tick) if args.batch_size else 1
+            if args.count and received >= args.count:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.stop_streaming_data(args.request_id)
+        _disconnect(client)
+
+
+def cache_warm(args):
+    """Download everything missing in the cache for the symbols, so later fetches are served from disk"""
+    if args.cache is None:
+        raise SystemExit("cache-warm needs --cache")
+    cache = _bar_cache(args)
+    client = _connect(args, cache)
+    try:
+        _timed("download", client.get_historical_data_for_many, args.request_id, _instruments(args),
+               args.duration or DEFAULT_DURATIONS[args.provider], args.bar_size or DEFAULT_BAR_SIZES[args.provider])
+    finally:
+        _disconnect(client)
+    print(cache.stats)
+
+
+def benchmark(args):
+    """Run benchmark.py's benchmarks and print or save their report"""
+    json = _import("json")
+    report = _timed("benchmarks", _import("benchmark").run, args.names)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def _provider_options(providers):
+    # options shared by the commands that talk to a provider
+    provider = argparse.ArgumentParser(add_help=False)
+    provider.add_argument("--provider", choices=providers, default="yahoo")
+    provider.add_argument("--request-id", type=int, default=1)
+    provider.add_argument("--host", default="127.0.0.1", help="TWS or IB Gateway host")
+    provider.add_argument("--port", type=int, default=7497, help="TWS or IB Gateway port")
+    provider.add_argument("--client-id", type=int, default=10)
+    provider.add_argument("--timeout", type=float, default=10, help="seconds to wait for TWS to send nextValidId")
+    provider.add_argument("--alpaca-url", help="base URL of Alpaca's data API, e.g. a FakeAlpaca's")
+    provider.add_argument("--exchange", default="SMART", help="exchange of the IB stock contracts")
+    provider.add_argument("--currency", default="USD", help="currency of the IB stock contracts")
+    return provider
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--timing", action="store_true", help="print import, connection and command times to stderr")
+    provider = _provider_options(PROVIDERS)
+
+    history = argparse.ArgumentParser(add_help=False)
+    history.add_argument("symbols", nargs="+")
+    history.add_argument("--duration", help="range to fetch, e.g. '2 D' for IB, '5d' for Yahoo, '30 D' for Alpaca")
+    history.add_argument("--bar-size", help="e.g. '30 secs' for IB, '15m' for Yahoo, '15Min' for Alpaca")
+    history.add_argument("--cache", help="directory of a BarCache, only missing bars are downloaded")
+
+    main = argparse.ArgumentParser(description="Fetch, stream and cache market data")
+    commands = main.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("fetch", parents=[common, provider, history], help=fetch.__doc__)
+    command.add_argument("--field", default="close", help="bar column to return")
+    command.add_argument("--cache-only", action="store_true", help="only read --cache, no provider library is imported or contacted")
+    command.add_argument("--output", help="write to a .csv or .parquet file instead of printing")
+    command.set_defaults(run=fetch)
+
+    command = commands.add_parser("stream", parents=[common, _provider_options(STREAM_PROVIDERS)], help=stream.__doc__)
+    command.add_argument("symbols", nargs=1, metavar="symbol")
+    command.add_argument("--count", type=int, help="stop after this many ticks")
+    command.add_argument("--batch-size", type=int, help="print TickBatches of up to this many ticks")
+    command.add_argument("--interval", type=float, default=5, help="polling interval of the Yahoo stream in seconds")
+    command.set_defaults(run=stream)
+
+    command = commands.add_parser("cache-warm", parents=[common, provider, history], help=cache_warm.__doc__)
+    command.set_defaults(run=cache_warm)
+
+    command = commands.add_parser("benchmark", parents=[common], help=benchmark.__doc__)
+    command.add_argument("names", nargs="*", help="benchmarks to run, all by default")
+    command.add_argument("--output", help="write the results as JSON to this file")
+    command.set_defaults(run=benchmark)
+    return main
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    _timings.append(("startup", time.perf_counter() - STARTED)) # the standard library imports and argument parsing
+    try:
+        args.run(args)
+    finally:
+        if args.timing:
+            _report_timing()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,119 +1,260 @@
 import time
 import pandas as pd
-from dataclasses import dataclass, field
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError # a Future is a result that another thread fills in later
 from ibapi.client import EClient # imports the class responsible for managing the network connection to TWS that we use to send requests/receiving responses
+from bar_cache import contract_key, to_timedelta
+from utils import HistoricalPacer
+from history_planner import fetch_history, max_request_span # splits ranges longer than IB answers in one request
+from wrapper import HistoricalDataError
+from ohlcv import PRICE_DTYPE, canonical, from_ib, pivot_bars # the bar format shared by every client
+from tick_buffer import TickBuffer, BufferClosed # per-stream ring buffer filled by IBWrapper.tickByTickBidAsk
+from ticks import Tick, TickBatch # compact single tick and columnar batch of ticks
+from latency import timed_ticks # instrumented version of the streaming loop, used when self.latency is set
 
-# List of constants we want to set, that represent the candlestick data structure 
-TRADE_BAR_PROPERTIES = ["time", "open", "high", "low", "close", "volume"] # The standard properties used to price action
-
-# This represents each price tik
-@dataclass # Here we used Python's built-in dataclass to generate methods like __init__
-class Tick: # represents a single price tick
-    time: int 
-    bid_price: float
-    ask_price: float 
-    bid_size: float 
-    ask_size: float 
-    timestamp_: pd.Timestamp = field(init=False) # A pandas Timestamp object initalized with 'field(init=False) so that it won't be passed __init__
-    def __post_init__(self): # special method that runs after the normal __init__ 
-        self.timestamp_ = pd.to_datetime(self.time, unit="s") # makes time a pandas Timestamp
-        self.bid_price = float(self.bid_price) # makes sure they are float values
-        self.ask_price = float(self.ask_price)
-        self.bid_size = int(self.bid_size) # converts from floats to integers
-        self.ask_size = int(self.ask_size)
+SMALL_BAR_SIZES = ["1 secs", "5 secs", "10 secs", "15 secs", "30 secs"] # bar sizes that fall under IB's historical data pacing rules
+
+def is_small_bar_size(bar_size):
+    return bar_size.strip() in SMALL_BAR_SIZES
 
 class IBClient(EClient): # custom class that inherits from the Eclient class so that we extend the client functionality
 
-    def __init__(self, wrapper): # the wrapper parameter is expected to be an instance of our IBWrapper class
+    def __init__(self, wrapper, bar_cache=None): # the wrapper parameter is expected to be an instance of our IBWrapper class
     
         EClient.__init__(self, wrapper) # initializes the parent class with the wrapper object to connect our client that sends requests, and the wrapper that processes responses
+        self.historical_pacer = HistoricalPacer() # keeps parallel historical requests inside IB's pacing rules
+        self.bar_cache = bar_cache # optional BarCache, when set only bars missing on disk are requested from IB
+        self.price_dtype = PRICE_DTYPE # dtype of the price columns of historical bars, np.float32 halves their memory
 
-    # function to get historical data
-    def get_historical_data(self, request_id, contract, duration, bar_size):
-        # self is the class which contains the reqHistorical Data function we use
-        # request_id paramaeter is a unique identifier for the data request
-        # duration is how much(eg. month's) worth data we must retrieve data
+    # function to send a historical data request without waiting for the answer
+    def request_historical_data(self, request_id, contract, duration, bar_size, end_datetime="", timeout=None):
+        # end_datetime is the end of the requested range in UTC as "yyyymmdd-hh:mm:ss" (history_planner.ib_end_datetime), empty means now
+        # timeout is how many seconds we wait for the pacer to allow the request, None waits as long as it takes
+        # and a TimeoutError is raised when it doesn't, e.g. because 50 earlier requests never got an answer
+        # returns a Future that IBWrapper.historicalDataEnd completes with the list of bars
+        # or that IBWrapper.error fails with a HistoricalDataError
+
+        small_bars = is_small_bar_size(bar_size) # IB only paces requests for bars of 30 secs or less
+        if not self.historical_pacer.acquire((contract.symbol, contract.secType, contract.exchange), small_bars, timeout): # waits until IB allows another request
+            raise TimeoutError(f"No room for historical request {request_id} within {timeout:.1f} seconds")
+
+        future = Future()
+        future.add_done_callback(lambda _: self.historical_pacer.release()) # frees the in-flight slot however the request ends
+        self.historical_data[request_id] = [] # forget bars left over from an earlier request with the same id
+        self.historical_futures[request_id] = future
+        if self.latency is not None:
+            self.latency.start("historical_request", request_id) # stopped by historicalDataEnd
+            self.latency.count("historical_requests", request_id)
 
         # API call 
         self.reqHistoricalData(
             reqId=request_id,
             contract=contract,
-            endDateTime="",
+            endDateTime=end_datetime,
             durationStr=duration,
             barSizeSetting=bar_size,
             whatToShow="MIDPOINT", # midpoint of bid/ask
             useRTH=1, # regular trading hours
-            formatDate=1,
+            formatDate=2, # seconds since the epoch for intraday bars, so the bars need no date parsing and come in UTC
             keepUpToDate=False,
             chartOptions=[],
         )
-        
-        # wait for it to get historical data
-        time.sleep(5)
+        return future
 
-        bar_sizes = ["day", "D", "week", "W", "month"] # the time interval for each data point
+    # function to look up every contract matching a (possibly incomplete) contract without waiting for the answer
+    def request_contract_details(self, request_id, contract):
+        # returns a Future that IBWrapper.contractDetailsEnd completes with the list of ContractDetails
+        # or that IBWrapper.error fails with a ContractDetailsError
 
-        # Checks what the bar_size is and then applies the suitable format
-        if any(x in bar_size for x in bar_sizes): 
-            fmt = "%Y%m%d"
-        else:
-            fmt = "%Y%m%d  %H:%M:%S"
+        future = Future()
+        self.contract_details[request_id] = []
+        self.contract_details_futures[request_id] = future
+        self.reqContractDetails(request_id, contract)
+        return future
 
-        # Processes the data we requested
-        data = self.historical_data[request_id]
+    # function to get historical data
+    def get_historical_data(self, request_id, contract, duration, bar_size, timeout=60):
+        # self is the class which contains the reqHistorical Data function we use
+        # request_id paramaeter is a unique identifier for the data request
+        # duration is how much(eg. month's) worth data we must retrieve data
+        # timeout is how many seconds we wait for historicalDataEnd before giving up
+        # a duration longer than IB allows for the bar size is split into requests request_id, request_id + 1, ...
 
-        df = pd.DataFrame(data, columns=TRADE_BAR_PROPERTIES)
+        if self.bar_cache is not None:
+            return self._get_cached_historical_data(request_id, [contract], duration, bar_size, timeout, raise_errors=True)[0]
 
-        # converts the data we request into proper datetime objects for easier analysis and manipulation
-        df.set_index(pd.to_datetime(df.time, format=fmt), inplace=True)
-    
-        df.drop("time", axis=1, inplace=True) # removes the original "time" column for formatting
-        df["symbol"] = contract.symbol # adds symbol column
-        df.request_id = request_id 
-        return df # Returns our fixed up data in the Dataframe
+        span = max_request_span("ib", bar_size)
+        if span is not None and to_timedelta(duration) > span: # more than IB sends in one request, e.g. a year of 1 min bars
+            df = fetch_history(self, request_id, contract, bar_size, duration=duration, timeout=timeout).to_frame()
+            df.request_id = request_id
+            return df
 
+        future = self.request_historical_data(request_id, contract, duration, bar_size)
+        data = self._wait_for_historical_data(request_id, future, timeout) # returns as soon as IB sends historicalDataEnd
+        return self._historical_bars_to_frame(request_id, contract, bar_size, data)
 
     # function to request data for several contracts
-    def get_historical_data_for_many(self, request_id, contracts, duration, bar_size, col_to_use="close"):
+    def get_historical_data_for_many(self, request_id, contracts, duration, bar_size, col_to_use="close", timeout=60):
             # request_id is an identifier for tracking requests, (starts at e.g. 99, then 100 for next security)
             # col_to_use is parametere we use to specify the data columns we want to include
 
-            dfs = [] # list to store the DataFrames 
-            
-            # loops through all the securties we want to request DataFrame 
+            if self.bar_cache is not None:
+                dfs = self._get_cached_historical_data(request_id, contracts, duration, bar_size, timeout)
+                return pivot_bars(dfs, col_to_use)
+
+            span = max_request_span("ib", bar_size)
+            if span is not None and to_timedelta(duration) > span: # more than one request per contract
+                end = pd.Timestamp.now(tz="UTC") # the same range for every contract
+                histories = self._start_histories(
+                    request_id, [(contract, end - to_timedelta(duration), end) for contract in contracts], bar_size, timeout)
+                dfs = []
+                for contract, history in zip(contracts, histories):
+                    df = history.to_frame()
+                    for gap in history.gaps:
+                        if "error" in gap: # the other chunks of the contract are kept
+                            print(f"Error retrieving data for {contract.symbol} from {gap['start']} to {gap['end']}: {gap['error']}")
+                    dfs.append(df)
+                return pivot_bars(dfs, col_to_use)
+
+            # sends every request first so they are all in flight together, the pacer holds back what IB would reject
+            requests = []
+            deadline = time.monotonic() + timeout # one deadline for the whole batch, not per contract
             for contract in contracts:
-                data = self.get_historical_data(request_id, contract, duration, bar_size)
-                dfs.append(data) # After we call the function we created above, we attach the results to the list of DataFrames
+                try: # past 50 open requests this waits for earlier answers, but never beyond the deadline
+                    future = self.request_historical_data(
+                        request_id, contract, duration, bar_size, timeout=max(deadline - time.monotonic(), 0))
+                except TimeoutError as e:
+                    print(f"Error retrieving data for {contract.symbol}: {e}")
+                else:
+                    requests.append((request_id, contract, future))
                 request_id += 1 # Create a new request id
 
+            dfs = [] # list to store the DataFrames 
+            for request_id, contract, future in requests:
+                try:
+                    data = self._wait_for_historical_data(request_id, future, max(deadline - time.monotonic(), 0))
+                except (HistoricalDataError, TimeoutError) as e:
+                    print(f"Error retrieving data for {contract.symbol}: {e}")
+                    continue
+                dfs.append(self._historical_bars_to_frame(request_id, contract, bar_size, data)) # attach the results to the list of DataFrames
+
             # Returns our data changed for analysis
-            return (
-                pd.concat(df) # Groups together all our dataframes into 1
-                .reset_index() # Reset our index after we dropped time in the first function
-                .pivot( # Reshapes data
-                    index="time", columns="symbol", values=col_to_use 
-                )
-            )
+            return pivot_bars(dfs, col_to_use)
+
+    # function that serves historical data from self.bar_cache and only asks IB for the missing ranges
+    def _get_cached_historical_data(self, request_id, contracts, duration, bar_size, timeout, raise_errors=False):
+        # returns one DataFrame per contract, None for contracts IB returned an error for unless raise_errors is set
+
+        end = pd.Timestamp.now(tz="UTC") # the bars are indexed by UTC time
+        start = end - to_timedelta(duration)
+        keys = [contract_key(c) for c in contracts] # not the symbol, every expiry and listing has bars of its own
+        segments = [self.bar_cache.missing("ib", key, bar_size, start, end) for key in keys]
+        # usually one segment for the tail, two when the head is missing as well, each split into requests IB answers
+        histories = iter(self._start_histories(
+            request_id, [(contract, *segment) for contract, s in zip(contracts, segments) for segment in s], bar_size, timeout))
+
+        dfs = []
+        for i, contract in enumerate(contracts):
+            fetched, errors = [], []
+            for segment_start, segment_end in segments[i]:
+                history = next(histories)
+                df = history.to_frame()
+                segment_errors = [gap["error"] for gap in history.gaps if "error" in gap]
+                if segment_errors: # not stored, so the next call asks for the segment again
+                    errors += segment_errors
+                    continue
+                self.bar_cache.store("ib", keys[i], bar_size, df, segment_start, segment_end)
+                fetched.append(df)
+            if errors:
+                if raise_errors:
+                    raise errors[0]
+                print(f"Error retrieving data for {contract.symbol}: {errors[0]}")
+                dfs.append(None)
+                continue
+            df = self.bar_cache.combine("ib", keys[i], bar_size, start, end, segments[i], fetched)
+            df = canonical(df, contract.symbol, self.price_dtype) # also the empty frame when nothing was traded in the range
+            df.request_id = request_id + i
+            dfs.append(df)
+        return dfs
+
+    # function that starts one HistoryStream per (contract, start, end) range before any of them is read
+    def _start_histories(self, request_id, ranges, bar_size, timeout):
+        # the contracts download together, each keeps up to MAX_IN_FLIGHT chunks on their way and the pacer
+        # holds back what IB would reject, at most timeout seconds per chunk, a chunk it doesn't allow becomes a gap.
+        # Chunk requests count up from request_id without overlapping.
+        histories = []
+        for contract, start, end in ranges:
+            history = fetch_history(self, request_id, contract, bar_size, start=start, end=end, timeout=timeout)
+            request_id += max(len(history.chunks), 1)
+            histories.append(history.start())
+        return histories
+
+    def _wait_for_historical_data(self, request_id, future, timeout):
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if self.historical_futures.pop(request_id, None) is None: # the answer arrived just as we gave up
+                return future.result()
+            self.historical_data.pop(request_id, None)
+            if self.latency is not None:
+                self.latency.discard("historical_request", request_id)
+                self.latency.count("historical_timeouts", request_id)
+            self.cancelHistoricalData(request_id) # so IB stops working on a request nobody waits for
+            error = TimeoutError(f"No historical data for request {request_id} within {timeout:.1f} seconds")
+            future.set_exception(error) # also frees the pacer slot
+            raise error
+
+    def _historical_bars_to_frame(self, request_id, contract, bar_size, data):
+        # one array per column straight from the bar tuples, the dates are epoch seconds or yyyymmdd for daily bars
+        df = from_ib(data, contract.symbol, self.price_dtype)
+        df.request_id = request_id
+        return df # Returns our fixed up data in the Dataframe
 
 
     # Function to start and stop the streaming data
-    def get_streaming_data(self, request_id, contract):
+    def get_streaming_data(self, request_id, contract, buffer_size=None, overflow=None, batch_size=None):
+        # buffer_size is how many unread ticks this stream can hold, defaults to self.stream_buffer_size
+        # overflow is what happens when the buffer is full: BLOCK, DROP_OLDEST or DROP_NEWEST from tick_buffer.py
+        # batch_size, when given, yields TickBatch objects of up to that many ticks instead of single Ticks
+
+        buffer = TickBuffer( # a buffer of its own for this stream so no tick is overwritten by the next one
+            buffer_size or self.stream_buffer_size,
+            overflow or self.stream_overflow,
+        )
+        latency = self.latency # instrumentation is decided once per stream
+        if latency is not None:
+            self.timed_streams.add(request_id) # IBWrapper stamps these ticks with their arrival time
+        self.start_tick_stream(request_id, contract, buffer)
+        if latency is not None:
+            yield from timed_ticks(buffer, latency, request_id, batch_size)
+            return
+
+        while True: # Loop until stop_streaming_data closes the buffer
+            try:
+                if batch_size:
+                    yield TickBatch.from_tuples(buffer.get_batch(batch_size)) # every tick that arrived since the last batch
+                    continue
+                tick_data = buffer.get() # sleeps until the next tick arrives, no busy waiting
+            except BufferClosed:
+                return
+            yield Tick( # we make a Tick object from the streaming data we get (yield doesn't stop for the function unlike return)
+                *tick_data) # unpacks the data as arguments to __init__
+
+    # function to subscribe to bid/ask ticks that are put into buffer, anything with put() and close() works
+    def start_tick_stream(self, request_id, contract, buffer, tick_type="BidAsk"):
+        self.streaming_data[request_id] = buffer # registered before the request so the very first tick is kept
 
         self.reqTickByTickData( # TWS API method to request tick-by-tick data
             reqId=request_id,
             contract=contract,
-            tickType="BidAsk", # return bid and ask price updates
+            tickType=tick_type, # "BidAsk" returns bid and ask price updates
             numberOfTicks=0, # continuously stream data without limits
             ignoreSize=True 
         )
 
-        time.sleep(10) # Wait for the connection be established
-
-        while True: # Infinite loop to continously check for and process incoming data
-            if self.stream_event.is_set(): # if a new data event happens
-                yield Tick( # we make a Tick object from the streaming data we get (yield doesn't stop for the function unlike return)
-                    *self.streaming_data[request_id]) # unpacks the data as arguments to __init__
-                self.stream_event.clear() # resets the event flag after processing
-
     def stop_streaming_data(self, request_id):
-        self.cancelTickByTickData(reqId=request_id) # end the data stream
\ No newline at end of file
+        self.cancelTickByTickData(reqId=request_id) # end the data stream
+        self.timed_streams.discard(request_id)
+        buffer = self.streaming_data.pop(request_id, None)
+        if buffer is not None:
+            self.dropped_counts[request_id] = self.dropped_counts.get(request_id, 0) + getattr(buffer, "dropped", 0) # dropped_ticks stays readable
+            buffer.close() # lets the generator finish once it has yielded the remaining ticks
\ No newline at end of file
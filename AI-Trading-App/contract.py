@@ -10,7 +10,7 @@ def future(symbol, exchange, contract_month, currency="USD", multiplier=""):
     contract = Contract()
     contract.symbol = symbol
     contract.exchange = exchange
-    contract.lastTradeDateorContractMonth = contract_month
+    contract.lastTradeDateOrContractMonth = contract_month
     contract.secType = "FUT"
     contract.currency = currency
     if multiplier:
@@ -35,7 +35,7 @@ def option(symbol, exchange, contract_month, strike, right):
     contract = Contract()
     contract.symbol = symbol 
     contract.exchange = exchange 
-    contract.lastTradeDateorContractMonth = contract_month
+    contract.lastTradeDateOrContractMonth = contract_month
     contract.strike = strike
     contract.right = right
     contract.secType = "OPT"
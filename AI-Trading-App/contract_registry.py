@@ -0,0 +1,271 @@
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import date, timedelta
+from ibapi.contract import Contract
+from contract import future as future_contract
+from utils import RateLimiter
+from wrapper import ContractDetailsError
+
+# Resolves contracts once and remembers the answer. A contract built by the
+# factories in contract.py only names an instrument, so IB has to look it up
+# on every request, and ambiguous ones fail. The registry asks IB once with
+# reqContractDetails, keeps the fully specified Contract (conId, localSymbol,
+# multiplier, ...) under a normalized key of what was asked for, and writes
+# the answers to a JSON file, so after a restart nothing is looked up again:
+#
+#   contracts = ContractRegistry(app, "contracts.json")
+#   aapl = contracts.resolve(stock("AAPL", "SMART", "USD"))
+#   universe = contracts.resolve_many([stock(s, "SMART", "USD") for s in symbols])
+#   es = contracts.front_month("ES", "CME")   # rolls to the next expiry ROLL_DAYS before the last trade date
+#
+# Resolved contracts are shared between callers, treat them as read-only.
+
+RESOLVED_FIELDS = ("conId", "symbol", "secType", "lastTradeDateOrContractMonth", "strike", "right", "multiplier",
+                   "exchange", "primaryExchange", "currency", "localSymbol", "tradingClass")
+ROLL_DAYS = 5 # days before the last trade date a future stops being the front month
+MAX_MESSAGES_PER_SECOND = 40 # below IB's 50, other requests share the connection
+FILE_VERSION = 1
+
+
+class AmbiguousContractError(ValueError):
+    """IB found several contracts for a description, add the exchange, currency or month to pick one"""
+
+    def __init__(self, key, candidates):
+        super().__init__(f"{len(candidates)} contracts match {key}: " + ", ".join(
+            f"{c['localSymbol']} ({c['exchange']}, conId {c['conId']})" for c in candidates[:10]))
+        self.candidates = candidates
+
+
+def spec_key(contract):
+    """Normalized description of a contract, the same for contracts that ask for the same instrument"""
+    strike = f"{float(contract.strike):g}" if contract.strike else ""
+    right = {"CALL": "C", "PUT": "P"}.get(contract.right.upper(), contract.right.upper())
+    return "|".join([
+        contract.secType.upper(), contract.symbol.upper(), contract.exchange.upper(), contract.primaryExchange.upper(),
+        contract.currency.upper(), contract.lastTradeDateOrContractMonth, strike, right, str(contract.multiplier),
+        contract.localSymbol.upper(),
+    ])
+
+
+def _entry(details):
+    # what is kept of a ContractDetails, JSON serializable
+    entry = {field: getattr(details.contract, field) for field in RESOLVED_FIELDS}
+    entry["minTick"] = details.minTick
+    entry["longName"] = details.longName
+    return entry
+
+
+def _expiry(entry):
+    # last trade date of futures and options, None for everything that doesn't expire
+    text = entry["lastTradeDateOrContractMonth"]
+    if len(text) < 8:
+        return None
+    return date(int(text[:4]), int(text[4:6]), int(text[6:8]))
+
+
+def _to_contract(entry):
+    contract = Contract()
+    for field in RESOLVED_FIELDS:
+        setattr(contract, field, entry[field])
+    return contract
+
+
+class ContractRegistry:
+    """Resolved contracts, looked up in IB once and kept in memory and on disk
+
+    Parameters:
+    - app: Connected IBApp (or any IBClient and IBWrapper)
+    - path: JSON file the resolved contracts are kept in across restarts, None keeps them in memory only
+    - first_request_id: Request id of the first contract details request, later ones count up from it.
+      Keep the range apart from the request ids used directly on the app.
+    - roll_days: Days before its last trade date that front_month moves on to the next future
+    """
+
+    def __init__(self, app, path="contracts.json", first_request_id=80000, roll_days=ROLL_DAYS):
+        self.app = app
+        self.path = path
+        self.roll_days = roll_days
+        self.entries = {} # spec key -> entry of the resolved contract
+        self.chains = {} # chain key -> entries of every listed future, by expiry
+        self.stats = {"hits": 0, "requests": 0}
+        self._contracts = {} # conId -> the one Contract object handed out for it
+        self._pending = {} # spec key -> Future of a request in flight, so concurrent callers share it
+        self._request_ids = itertools.count(first_request_id)
+        self._limiter = RateLimiter(MAX_MESSAGES_PER_SECOND, 1.0)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("version") != FILE_VERSION:
+            return
+        today = date.today()
+        # expired futures and options are dropped, they would only be looked up again
+        self.entries = {key: entry for key, entry in data["contracts"].items() if (_expiry(entry) or today) >= today}
+        self.chains = data["chains"]
+
+    def _save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            data = {"version": FILE_VERSION, "contracts": dict(self.entries), "chains": dict(self.chains)}
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, self.path) # readers see the old or the new file, never half of one
+
+    def contract(self, entry):
+        """The interned Contract of an entry, one object per conId"""
+        with self._lock:
+            contract = self._contracts.get(entry["conId"])
+            if contract is None:
+                contract = self._contracts[entry["conId"]] = _to_contract(entry)
+            return contract
+
+    def details(self, contract):
+        """Stored details (conId, localSymbol, multiplier, minTick, longName, ...) of a resolved contract, None if unknown"""
+        entry = self.entries.get(spec_key(contract))
+        if entry is None and contract.conId:
+            entry = next((e for e in self.entries.values() if e["conId"] == contract.conId), None)
+        return entry
+
+    def resolve(self, contract, timeout=10):
+        """Fully specified Contract for a contract from contract.py, looked up in IB only the first time
+
+        Raises a ContractDetailsError when IB knows no such contract, an AmbiguousContractError when it
+        knows several, and a TimeoutError when it doesn't answer within timeout seconds.
+        """
+        if contract.conId and contract.localSymbol: # resolved already
+            return contract
+        key = spec_key(contract)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return self.contract(entry)
+        future, sent = self._request(key, contract)
+        entry = self._single(key, self._wait(key, future, timeout))
+        if sent:
+            self._save()
+        return self.contract(entry)
+
+    def resolve_many(self, contracts, timeout=30):
+        """Resolved contracts in the order given, every missing one requested at once
+
+        Contracts IB can't resolve are None in the result and their error is printed,
+        like get_historical_data_for_many does for failed requests.
+        """
+        keys = [spec_key(contract) for contract in contracts]
+        requests = {}
+        for key, contract in zip(keys, contracts):
+            if key not in self.entries and key not in requests and not (contract.conId and contract.localSymbol):
+                requests[key] = self._request(key, contract)[0]
+        deadline = time.monotonic() + timeout # one deadline for the whole universe
+        resolved = []
+        for key, contract in zip(keys, contracts):
+            if contract.conId and contract.localSymbol:
+                resolved.append(contract)
+                continue
+            try:
+                entry = self.entries.get(key) or self._single(key, self._wait(key, requests[key], max(deadline - time.monotonic(), 0)))
+            except (ContractDetailsError, AmbiguousContractError, TimeoutError) as e:
+                print(f"Error resolving {contract.symbol}: {e}")
+                resolved.append(None)
+                continue
+            resolved.append(self.contract(entry))
+        if requests:
+            self._save() # once for the whole universe
+        return resolved
+
+    def _request(self, key, contract):
+        # Future of the details of key and whether this call sent the request, a request in flight is shared
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future, False
+            future = self._pending[key] = Future()
+        self._limiter.acquire()
+        request_id = next(self._request_ids)
+        self.stats["requests"] += 1
+        answer = self.app.request_contract_details(request_id, contract)
+
+        def done(answer):
+            with self._lock:
+                self._pending.pop(key, None)
+            error = answer.exception()
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(answer.result())
+        answer.add_done_callback(done)
+        future.request_id = request_id
+        return future, True
+
+    def _wait(self, key, future, timeout):
+        # the ContractDetails of a request from _request
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(key, None)
+            self.app.contract_details_futures.pop(future.request_id, None) # a late answer is dropped
+            self.app.contract_details.pop(future.request_id, None)
+            raise TimeoutError(f"No contract details for {key} within {timeout:.1f} seconds") from None
+
+    def _single(self, key, details):
+        # stores the one contract that matched key
+        candidates = [_entry(d) for d in details]
+        if len(candidates) != 1:
+            raise AmbiguousContractError(key, candidates)
+        with self._lock: # _save copies entries from other threads
+            entry = self.entries[key] = candidates[0]
+        return entry
+
+    def chain(self, symbol, exchange, currency="USD", multiplier="", timeout=10, refresh=False):
+        """Entries of every listed future of a symbol by expiry, from disk unless all of them expired or refresh is set"""
+        spec = future_contract(symbol, exchange, "", currency, multiplier)
+        key = spec_key(spec)
+        today = date.today()
+        entries = [e for e in self.chains.get(key, []) if _expiry(e) >= today]
+        if entries and not refresh:
+            self.stats["hits"] += 1
+            return entries
+        request_key = "chain|" + key # apart from resolve's requests for the same description
+        details = self._wait(request_key, self._request(request_key, spec)[0], timeout) # without a month every listed future matches
+        entries = sorted((e for e in map(_entry, details) if _expiry(e) is not None and _expiry(e) >= today), key=_expiry)
+        with self._lock:
+            self.chains[key] = entries
+        self._save()
+        return entries
+
+    def front_month(self, symbol, exchange, currency="USD", multiplier="", timeout=10):
+        """Resolved future closest to expiry that is more than roll_days from its last trade date
+
+        Call it whenever the contract is needed, it returns the next future as soon as the current
+        one gets within roll_days of expiring, and only asks IB when every stored future has expired.
+        """
+        roll = date.today() + timedelta(days=self.roll_days)
+        for refresh in (False, True): # the stored chain may end before the roll date, IB lists new months over time
+            for entry in self.chain(symbol, exchange, currency, multiplier, timeout, refresh):
+                if _expiry(entry) > roll:
+                    return self.contract(entry)
+        raise LookupError(f"No {symbol} future on {exchange} expires after {roll}")
+
+
+if __name__ == "__main__":
+    from app import IBApp
+    from contract import stock
+
+    app = IBApp("127.0.0.1", 7497, client_id=11)
+    contracts = ContractRegistry(app)
+    universe = contracts.resolve_many([stock(symbol, "SMART", "USD") for symbol in ("AAPL", "MSFT", "NVDA", "AMZN")])
+    print([(c.symbol, c.conId, c.primaryExchange) for c in universe if c is not None])
+    es = contracts.front_month("ES", "CME")
+    print(es.localSymbol, es.lastTradeDateOrContractMonth, contracts.stats)
+    app.disconnect()
@@ -0,0 +1,156 @@
+import base64
+import gzip
+import json
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import pandas as pd
+
+# A stand-in for Alpaca's market data API that answers the multi-symbol bars
+# endpoint GET /v2/stocks/bars the way Alpaca does: bars grouped by symbol,
+# at most limit bars per page over all symbols, and a next_page_token while
+# more are left. Prices are a deterministic function of symbol and time, so
+# a range gives the same bars however it is split into requests.
+
+TIMEFRAME_UNITS = {"Min": "min", "T": "min", "Hour": "h", "H": "h", "Day": "D", "D": "D", "Week": "W", "Month": "MS"}
+SESSION_OPEN, SESSION_CLOSE = pd.Timedelta(hours=13, minutes=30), pd.Timedelta(hours=20) # regular session in UTC
+
+
+@lru_cache(maxsize=64)
+def bar_times(timeframe, start, end):
+    """Start times of the bars in [start, end], weekdays only and intraday bars in the regular session"""
+    number = int("".join(c for c in timeframe if c.isdigit()) or 1)
+    unit = TIMEFRAME_UNITS["".join(c for c in timeframe if c.isalpha())]
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if unit in ("D", "W", "MS"):
+        times = pd.date_range(start.ceil("D"), end, freq=f"{number}{unit}").normalize() + pd.Timedelta(hours=4)
+    else:
+        times = pd.date_range(start.ceil(f"{number}{unit}"), end, freq=f"{number}{unit}")
+        since_midnight = times - times.normalize()
+        times = times[(since_midnight >= SESSION_OPEN) & (since_midnight < SESSION_CLOSE)]
+    return times[(times.dayofweek < 5) & (times >= start) & (times <= end)]
+
+
+def synthetic_bars(symbol, times):
+    """Alpaca bar objects of a symbol at the given times"""
+    seed = zlib.crc32(symbol.encode())
+    hours = times.as_unit("ns").asi8 / 3.6e12
+    close = np.round(100 + 10 * np.sin(hours / 97 + seed % 1000) + (seed % 50), 2)
+    return [
+        {"t": t.strftime("%Y-%m-%dT%H:%M:%SZ"), "o": c, "h": round(c + 0.05, 2), "l": round(c - 0.05, 2),
+         "c": c, "v": 1000, "n": 10, "vw": c}
+        for t, c in zip(times, close.tolist())
+    ]
+
+
+class FakeAlpaca:
+    """Local Alpaca data API for offline runs, use url as AlpacaDataClient's data_url
+
+    Parameters:
+    - port: Port to listen on, 0 picks a free one
+    - latency: Seconds to wait before answering a request
+    - bars: Dictionary symbol -> list of Alpaca bar objects to serve, synthetic_bars are used for other symbols
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, bars=None):
+        self.latency = latency
+        self.bars = bars or {}
+        self.requests = [] # query parameters of every bars request, for inspection
+        self.connections = 0 # TCP connections accepted, shows whether clients keep them alive
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive
+
+            def setup(self):
+                super().setup()
+                fake.connections += 1
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.url = f"http://{host}:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle(self, request):
+        url = urlsplit(request.path)
+        if url.path != "/v2/stocks/bars":
+            return self._send(request, 404, {"message": "endpoint not found"})
+        if not request.headers.get("APCA-API-KEY-ID") or not request.headers.get("APCA-API-SECRET-KEY"):
+            return self._send(request, 403, {"message": "forbidden"})
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.requests.append(query)
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            symbols = sorted(set(query["symbols"].split(",")))
+            end = query.get("end") or pd.Timestamp.now(tz="UTC").floor("min").isoformat()
+            start = query.get("start") or pd.Timestamp(end).normalize().isoformat()
+            times = bar_times(query.get("timeframe", "1Day"), start, end)
+            limit = min(int(query.get("limit", 1000)), 10000)
+            offset = int(base64.b64decode(query["page_token"])) if "page_token" in query else 0
+        except (KeyError, ValueError) as e:
+            return self._send(request, 422, {"message": f"invalid request: {e}"})
+
+        # pages walk through the bars of all symbols, ordered by symbol and then time
+        page, position = {}, 0
+        for symbol in symbols:
+            first, last = max(offset - position, 0), max(offset + limit - position, 0)
+            if symbol in self.bars:
+                bars = [bar for bar in self.bars[symbol] if pd.Timestamp(start) <= pd.Timestamp(bar["t"]) <= pd.Timestamp(end)]
+                taken, n_bars = bars[first:last], len(bars)
+            else: # only the bars of the page are built
+                taken, n_bars = synthetic_bars(symbol, times[first:last]), len(times)
+            if taken:
+                page[symbol] = taken
+            position += n_bars
+        next_offset = offset + limit
+        token = base64.b64encode(str(next_offset).encode()).decode() if next_offset < position else None
+        self._send(request, 200, {"bars": page, "next_page_token": token})
+
+    @staticmethod
+    def _send(request, status, payload):
+        body = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            request.send_header("Content-Encoding", "gzip")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+if __name__ == "__main__":
+    from alpacadata import AlpacaDataClient
+
+    with FakeAlpaca() as fake:
+        client = AlpacaDataClient("fake-key", "fake-secret", data_url=fake.url) # FakeAlpaca only checks that they are sent
+        symbols = [f"S{i}" for i in range(500)]
+        started = time.perf_counter()
+        close = client.get_historical_data_for_many(0, symbols, bar_size="1Day", start="2015-01-01", end="2025-01-01")
+        print(f"{close.shape[1]} symbols x {close.shape[0]} days in {time.perf_counter() - started:.1f}s, "
+              f"{client.stats['requests']} requests over {fake.connections} connection(s)")
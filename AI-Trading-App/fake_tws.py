@@ -0,0 +1,214 @@
+import socket
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+import pandas as pd
+
+# A stand-in for TWS / IB Gateway that speaks just enough of the socket
+# protocol for IBClient: the handshake, nextValidId, historical data and
+# tick-by-tick bid/ask streams. It answers as server version 157, the
+# last version before IB changed the size fields to decimals, which every
+# ibapi release from 9.76 on still understands.
+
+SERVER_VERSION = 157
+
+# incoming message ids (client -> server)
+REQ_HISTORICAL_DATA = 20
+CANCEL_HISTORICAL_DATA = 25
+START_API = 71
+REQ_TICK_BY_TICK_DATA = 97
+CANCEL_TICK_BY_TICK_DATA = 98
+
+# outgoing message ids (server -> client)
+NEXT_VALID_ID = 9
+MANAGED_ACCTS = 15
+HISTORICAL_DATA = 17
+TICK_BY_TICK = 99
+
+DAILY_BAR_SIZES = ("day", "week", "month")
+
+
+def make_msg(*fields):
+    text = "".join(f"{field}\0" for field in fields).encode("ascii")
+    return struct.pack("!I", len(text)) + text
+
+
+def synthetic_bars(n, bar_size, end=None, seed=0, format_date=1):
+    """Random walk bars as (date string, open, high, low, close, volume), dates in IB's formatDate style
+
+    Naive end times are UTC. With format_date=2 intraday dates are seconds since the epoch.
+    """
+    rng = np.random.default_rng(seed)
+    daily = any(unit in bar_size for unit in DAILY_BAR_SIZES)
+    end = pd.Timestamp.now(tz="UTC").tz_localize(None).floor("D" if daily else "s") if end is None else pd.Timestamp(end)
+    step = pd.Timedelta(days=1) if daily else pd.Timedelta(seconds=30)
+    times = pd.date_range(end=end, periods=n, freq=step)
+    close = 100 + np.cumsum(rng.normal(0, 0.1, n))
+    if daily:
+        dates = times.strftime("%Y%m%d")
+    elif format_date == 2:
+        dates = (times.as_unit("s").asi8).astype(str)
+    else:
+        dates = times.strftime("%Y%m%d  %H:%M:%S")
+    return [
+        (date, c, c + 0.05, c - 0.05, c, 100)
+        for date, c in zip(dates, close.round(2))
+    ]
+
+
+class FakeTWS:
+    """Local TWS replacement for benchmarks and offline runs
+
+    Parameters:
+    - port: Port to listen on, 0 picks a free one (see self.port after start())
+    - bars: Dictionary symbol -> list of bar tuples to replay, synthetic_bars are used for other symbols
+    - bars_per_request: Number of synthetic bars returned for a historical request
+    - history_latency: Seconds to wait before answering a historical request
+    - ticks: List of (time, bid, ask, bid size, ask size) tuples replayed on every tick-by-tick request,
+      a synthetic stream when None
+    - n_ticks: Number of synthetic ticks per stream, None streams until cancelled
+    - tick_rate: Ticks per second, None sends them as fast as the socket takes them, 0 sends none
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, bars=None, bars_per_request=500, history_latency=0.0,
+                 ticks=None, n_ticks=None, tick_rate=None):
+        self.host = host
+        self.bars = bars or {}
+        self.bars_per_request = bars_per_request
+        self.history_latency = history_latency
+        self.ticks = ticks
+        self.n_ticks = n_ticks
+        self.tick_rate = tick_rate
+        self.requests = [] # (message id, request id) of everything received, for inspection
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self.port = self._server.getsockname()[1]
+        self._streams = {} # request id -> Event that stops its stream
+        self._closed = threading.Event()
+
+    def start(self):
+        self._server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        for stop in list(self._streams.values()):
+            stop.set()
+        self._server.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                connection, _ = self._server.accept()
+            except OSError: # the listening socket was closed
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        lock = threading.Lock() # streams and answers are written from different threads
+
+        def send(data):
+            with lock:
+                connection.sendall(data)
+
+        buffer = b""
+        handshake = True
+        try:
+            while not self._closed.is_set():
+                data = connection.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                if handshake:
+                    if len(buffer) < 8:
+                        continue
+                    (size,) = struct.unpack("!I", buffer[4:8]) # after the b"API\0" prefix
+                    if len(buffer) < 8 + size:
+                        continue
+                    versions = buffer[8:8 + size].decode().split()[0] # "v100..157"
+                    client_max = int(versions[1:].split("..")[1])
+                    buffer = buffer[8 + size:]
+                    send(make_msg(min(SERVER_VERSION, client_max), time.strftime("%Y%m%d %H:%M:%S UTC", time.gmtime())))
+                    handshake = False
+                while len(buffer) >= 4:
+                    (size,) = struct.unpack("!I", buffer[:4])
+                    if len(buffer) < 4 + size:
+                        break
+                    fields = buffer[4:4 + size].decode().split("\0")[:-1]
+                    buffer = buffer[4 + size:]
+                    self._handle(fields, send)
+        except OSError:
+            return
+        finally:
+            connection.close()
+
+    def _handle(self, fields, send):
+        message_id = int(fields[0])
+        if message_id == START_API:
+            send(make_msg(MANAGED_ACCTS, 1, "DU0000000"))
+            send(make_msg(NEXT_VALID_ID, 1, 1))
+            return
+        request_id = int(fields[1]) if message_id != CANCEL_HISTORICAL_DATA else int(fields[2])
+        self.requests.append((message_id, request_id))
+        if message_id == REQ_HISTORICAL_DATA:
+            # reqId, 13 contract fields, endDateTime, barSizeSetting, durationStr, useRTH, whatToShow, formatDate
+            symbol, end, bar_size, format_date = fields[3], fields[15], fields[16], int(fields[20])
+            if end: # "yyyymmdd-hh:mm:ss" is UTC, "yyyymmdd hh:mm:ss" is taken as UTC too, empty means now
+                end = pd.to_datetime(end.replace("-", " "), format="%Y%m%d %H:%M:%S")
+            threading.Thread(
+                target=self._send_history, args=(request_id, symbol, bar_size, end or None, format_date, send), daemon=True,
+            ).start()
+        elif message_id == REQ_TICK_BY_TICK_DATA:
+            stop = self._streams[request_id] = threading.Event()
+            threading.Thread(target=self._send_ticks, args=(request_id, stop, send), daemon=True).start()
+        elif message_id == CANCEL_TICK_BY_TICK_DATA:
+            stop = self._streams.pop(request_id, None)
+            if stop is not None:
+                stop.set()
+
+    def _send_history(self, request_id, symbol, bar_size, end, format_date, send):
+        if self.history_latency:
+            time.sleep(self.history_latency)
+        bars = self.bars.get(symbol) or synthetic_bars(
+            self.bars_per_request, bar_size, end, seed=zlib.crc32(symbol.encode()), format_date=format_date)
+        fields = [HISTORICAL_DATA, request_id, bars[0][0], bars[-1][0], len(bars)]
+        for date, open_, high, low, close, volume in bars:
+            fields += [date, open_, high, low, close, volume, close, 1] # average (WAP) and bar count follow volume
+        try:
+            send(make_msg(*fields))
+        except OSError:
+            pass
+
+    def _send_ticks(self, request_id, stop, send):
+        if self.tick_rate == 0: # idle stream, used to measure CPU use while waiting
+            stop.wait()
+            return
+        interval = 1.0 / self.tick_rate if self.tick_rate else 0.0
+        start = time.perf_counter()
+        ticks = self.ticks
+        if ticks is None:
+            now = int(time.time())
+            count = self.n_ticks if self.n_ticks is not None else 2**62
+            ticks = ((now + i // 1000, 5000.25 + (i % 4) * 0.25, 5000.5 + (i % 4) * 0.25, 10, 12) for i in range(count))
+        try:
+            for i, (tick_time, bid, ask, bid_size, ask_size) in enumerate(ticks):
+                if stop.is_set():
+                    return
+                if interval:
+                    delay = start + i * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                send(make_msg(TICK_BY_TICK, request_id, 3, tick_time, bid, ask, bid_size, ask_size, 0))
+        except OSError:
+            return
@@ -0,0 +1,78 @@
+import time
+import zlib
+from contextlib import contextmanager
+from unittest import mock
+import numpy as np
+import pandas as pd
+import yahoo_client
+
+# Offline stand-ins for yf.download and yf.Ticker(...).history, returning
+# random walk bars in the shape yfinance returns them, after an optional
+# simulated network latency.
+
+INTERVALS = {"1m": "min", "2m": "2min", "5m": "5min", "15m": "15min", "30m": "30min",
+             "60m": "h", "90m": "90min", "1h": "h", "1d": "D", "5d": "5D", "1wk": "W", "1mo": "MS"}
+
+
+def _frame(symbol, index):
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    close = 100 + np.cumsum(rng.normal(0, 0.1, len(index)))
+    return pd.DataFrame({
+        "Open": close, "High": close + 0.05, "Low": close - 0.05, "Close": close, "Volume": 1000,
+    }, index=index)
+
+
+def _index(interval, period=None, start=None, end=None):
+    freq = INTERVALS.get(interval, "D")
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.now(tz=start.tzinfo if start is not None else None).floor("min")
+    if start is None:
+        number = int("".join(c for c in (period or "1d") if c.isdigit()) or 1)
+        unit = "".join(c for c in (period or "1d") if c.isalpha())
+        start = end - pd.Timedelta(days=number * {"d": 1, "wk": 7, "mo": 31, "y": 365}.get(unit, 1))
+    index = pd.date_range(pd.Timestamp(start), end, freq=freq, inclusive="left")
+    return index.rename("Datetime" if freq not in ("D", "5D", "W", "MS") else "Date")
+
+
+class FakeYahoo:
+    """Counts calls and answers like yfinance, use install() to patch yahoo_client with it
+
+    Parameters:
+    - latency: Seconds each download or history call takes
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def download(self, tickers, period=None, interval="1d", start=None, end=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        symbols = tickers.split() if isinstance(tickers, str) else list(tickers)
+        index = _index(interval, period, start, end)
+        frames = {symbol: _frame(symbol, index) for symbol in symbols}
+        data = pd.concat(frames, axis=1) # columns (Ticker, Price)
+        data.columns = data.columns.swaplevel(0, 1).set_names(["Price", "Ticker"]) # yfinance's (Price, Ticker) order
+        return data.sort_index(axis=1, level=0)
+
+    def Ticker(self, symbol):
+        fake = self
+
+        class _Ticker:
+            def history(self, period="1mo", interval="1d", start=None, end=None, **kwargs):
+                fake.calls += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                return _frame(symbol, _index(interval, period, start, end))
+
+        return _Ticker()
+
+
+@contextmanager
+def install(latency=0.0):
+    """Patch the yfinance module used by yahoo_client, yields the FakeYahoo"""
+    fake = FakeYahoo(latency)
+    with mock.patch.object(yahoo_client.yf, "download", fake.download), \
+            mock.patch.object(yahoo_client.yf, "Ticker", fake.Ticker):
+        yield fake
@@ -0,0 +1,262 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Fama-French factor data kept on disk, and rolling factor exposures of whole
+# price panels.
+#
+# Datasets from Ken French's library are cached as one Parquet file per table
+#   <root>/<dataset>/<table>.parquet
+# next to a _meta.json with the download time, the index frequency and the
+# dataset description, so pandas_datareader is only called again once the
+# cache is older than max_age.
+#
+# The rolling regressions run for every asset and window at once: the cross
+# products x x' and x y of every bar are summed cumulatively, a window's
+# normal equations are the difference of two cumulative sums. Windows in
+# which an asset has every bar share one inverse per window, only windows
+# with gaps are solved asset by asset, in one batched np.linalg.solve.
+
+META_FILE = "_meta.json"
+THREE_FACTORS = "F-F_Research_Data_Factors" # monthly and annual tables
+THREE_FACTORS_DAILY = "F-F_Research_Data_Factors_daily"
+FACTOR_COLUMNS = ["Mkt-RF", "SMB", "HML"]
+ASSET_CHUNK = 256 # assets regressed at once, bounds memory to bars x ASSET_CHUNK x 16 floats for gappy assets
+
+
+class FactorStore:
+    """Local cache of Fama-French datasets
+
+    Parameters:
+    - root: Directory of the cache
+    - max_age: Days after which a dataset is downloaded again, Ken French updates them monthly
+    """
+
+    def __init__(self, root="factor_cache", max_age=7):
+        self.root = root
+        self.max_age = max_age
+
+    def get(self, dataset=THREE_FACTORS, table=0, refresh=False):
+        """One table of a dataset in percent like pdr.get_data_famafrench returns it, downloading only when needed
+
+        Monthly and annual tables are indexed by a PeriodIndex, daily tables by a DatetimeIndex.
+        """
+        directory = os.path.join(self.root, dataset)
+        meta = self._meta(directory)
+        if refresh or meta is None or time.time() - meta["downloaded"] > self.max_age * 86400:
+            meta = self.download(dataset)
+        if str(table) not in meta["tables"]:
+            raise KeyError(f"{dataset} has no table {table}, it has {sorted(meta['tables'])}")
+        df = pd.read_parquet(os.path.join(directory, f"{table}.parquet"))
+        freq = meta["tables"][str(table)]
+        if freq is not None: # periods are stored as their start timestamps
+            df.index = df.index.to_period(freq)
+        return df
+
+    def description(self, dataset=THREE_FACTORS):
+        meta = self._meta(os.path.join(self.root, dataset))
+        if meta is None:
+            meta = self.download(dataset)
+        return meta["description"]
+
+    def download(self, dataset):
+        """Fetch every table of a dataset from Ken French's library into the cache"""
+        import pandas_datareader as pdr # only needed when the cache is cold or stale
+
+        data = pdr.get_data_famafrench(dataset, start="1900-01-01") # the default start is only 5 years back
+        directory = os.path.join(self.root, dataset)
+        os.makedirs(directory, exist_ok=True)
+        tables = {}
+        for table, df in data.items():
+            if table == "DESCR":
+                continue
+            df = df.copy()
+            freq = None
+            if isinstance(df.index, pd.PeriodIndex):
+                freq = df.index.freqstr
+                df.index = df.index.to_timestamp()
+            tmp = os.path.join(directory, f"{table}.parquet.tmp")
+            df.to_parquet(tmp)
+            os.replace(tmp, os.path.join(directory, f"{table}.parquet"))
+            tables[str(table)] = freq
+        meta = {"downloaded": time.time(), "tables": tables, "description": data.get("DESCR", "")}
+        with open(os.path.join(directory, META_FILE), "w") as f:
+            json.dump(meta, f)
+        return meta
+
+    @staticmethod
+    def _meta(directory):
+        path = os.path.join(directory, META_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+def align_factors(factors, index):
+    """Factor returns as decimals over the periods of a price panel's index
+
+    Parameters:
+    - factors: A FactorStore table in percent
+    - index: DatetimeIndex of the panel, the factors are aligned to its frequency
+
+    Period tables (monthly, annual) are matched by period, so the panel needs one
+    row per period. Daily tables are compounded from one panel date to the next,
+    which gives the daily factors on a daily panel and weekly or monthly factors
+    on a weekly or monthly one. Dates the factors don't cover are NaN.
+    """
+    factors = factors / 100
+    index = pd.DatetimeIndex(index)
+    naive = index.tz_convert(None) if index.tz is not None else index
+    if isinstance(factors.index, pd.PeriodIndex):
+        periods = naive.to_period(factors.index.freq)
+        if periods.has_duplicates:
+            raise ValueError(f"The panel has several rows per {factors.index.freqstr} period, resample it first")
+        aligned = factors.reindex(periods)
+        aligned.index = index
+        return aligned
+
+    wealth = (1 + factors).cumprod() # compounding turns any sampling of dates into returns between them
+    dates = naive.normalize()
+    position = wealth.index.searchsorted(dates, side="right") - 1 # last factor date on or before each panel date
+    covered = (position >= 0) & (dates <= wealth.index[-1])
+    sampled = np.full((len(index), wealth.shape[1]), np.nan)
+    sampled[covered] = wealth.to_numpy()[position[covered]]
+    aligned = pd.DataFrame(sampled, index=index, columns=factors.columns).pct_change(fill_method=None)
+    if len(index) and covered[0]: # the first panel date has no previous one, use that day's factors
+        aligned.iloc[0] = factors.iloc[position[0]].to_numpy()
+    return aligned
+
+
+def rolling_ols(y, X, window, min_periods=None):
+    """Rolling least squares of every column of y on the same regressors X
+
+    Parameters:
+    - y: (bars x assets) dependent variables, NaN rows of an asset are left out of its windows
+    - X: (bars x k) regressors, include a column of ones for an intercept; bars with a NaN
+      regressor are left out for every asset
+    - window: Bars in each regression
+    - min_periods: Valid bars needed for a result, window by default
+
+    Returns coefficients of shape (bars, assets, k) and r2 of shape (bars, assets),
+    the window ending at bar t gives row t.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    X = np.asarray(X, dtype=np.float64)
+    n_bars, n_assets = y.shape
+    k = X.shape[1]
+    min_periods = window if min_periods is None else min_periods
+    rows_valid = ~np.isnan(X).any(axis=1)
+    X = np.where(rows_valid[:, None], X, 0.0)
+    xx = (X[:, :, None] * X[:, None, :]).reshape(n_bars, k * k) # x x' of every bar
+    start = np.maximum(np.arange(1, n_bars + 1) - window, 0) # first bar of every window, in cumulative sum rows
+    end = np.arange(1, n_bars + 1)
+
+    def window_sums(values):
+        cumulative = np.zeros((n_bars + 1, *values.shape[1:]))
+        np.cumsum(values, axis=0, out=cumulative[1:])
+        return cumulative[end] - cumulative[start]
+
+    # assets with a price on every bar of a window share its normal equations, one inverse serves them all
+    n_rows = window_sums(rows_valid.astype(np.float64))
+    shared_XtX = window_sums(xx).reshape(n_bars, k, k)
+    solvable = n_rows >= max(min_periods, k)
+    shared_inverse = np.full((n_bars, k, k), np.nan)
+    if solvable.any():
+        shared_inverse[solvable] = _inverse(shared_XtX[solvable])
+
+    coefficients = np.full((n_bars, n_assets, k), np.nan)
+    r2 = np.full((n_bars, n_assets), np.nan)
+    for first in range(0, n_assets, ASSET_CHUNK):
+        chunk = slice(first, first + ASSET_CHUNK)
+        valid = rows_valid[:, None] & ~np.isnan(y[:, chunk])
+        weight = valid.astype(np.float64)
+        yc = np.where(valid, y[:, chunk], 0.0)
+        n = window_sums(weight) # valid bars per window and asset
+        Xty = window_sums(yc[:, :, None] * X[:, None, :])
+        sum_y = window_sums(yc)
+        sum_yy = window_sums(yc * yc)
+
+        ok = n >= max(min_periods, k)
+        shared = ok & (n == n_rows[:, None])
+        block = np.full((*n.shape, k), np.nan)
+        block[shared] = np.einsum("nij,nj->ni", np.broadcast_to(shared_inverse[:, None], (*n.shape, k, k))[shared], Xty[shared])
+        partial = ok & ~shared
+        if partial.any(): # windows with missing prices need the cross products of their own bars
+            columns = np.flatnonzero(partial.any(axis=0))
+            XtX = window_sums(weight[:, columns, None] * xx[:, None, :]).reshape(n_bars, len(columns), k, k)
+            cells = partial[:, columns]
+            rows, positions = np.nonzero(cells)
+            block[rows, columns[positions]] = _solve(XtX[cells], Xty[rows, columns[positions]])
+        coefficients[:, chunk] = block
+
+        # r2 = 1 - SSR / SST with SSR = y'y - b'X'y for the least squares b
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ssr = sum_yy - np.einsum("tak,tak->ta", block, Xty)
+            sst = sum_yy - sum_y ** 2 / n
+            r2[:, chunk] = np.where(ok, 1 - ssr / sst, np.nan)
+    return coefficients, r2
+
+
+def _inverse(A):
+    # batched inverse, singular normal equations get the pseudo inverse (the minimum norm least squares fit)
+    try:
+        return np.linalg.inv(A)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(A)
+
+
+def _solve(A, b):
+    # batched solve of A x = b, windows with singular normal equations get the least squares pseudo inverse
+    try:
+        return np.linalg.solve(A, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum("nij,nj->ni", np.linalg.pinv(A), b)
+
+
+def factor_exposures(prices, factors, window=60, min_periods=None, factor_columns=FACTOR_COLUMNS):
+    """Rolling Fama-French alphas and betas of every asset of a price panel
+
+    Parameters:
+    - prices: (time x asset) closes, e.g. PricePanel.frame("close"), resampled to the
+      frequency of the regression (e.g. month ends for monthly factors)
+    - factors: FactorStore table in percent with the factor columns and RF
+    - window, min_periods: See rolling_ols, 60 months or 252 days are usual
+
+    Returns a dictionary of (time x asset) DataFrames: alpha (per period), one beta per
+    factor column and r2.
+    """
+    returns = prices.pct_change(fill_method=None)
+    aligned = align_factors(factors, prices.index)
+    excess = returns.to_numpy() - aligned["RF"].to_numpy()[:, None]
+    X = np.column_stack([np.ones(len(aligned)), aligned[factor_columns].to_numpy()])
+    coefficients, r2 = rolling_ols(excess, X, window, min_periods)
+    exposures = {"alpha": pd.DataFrame(coefficients[:, :, 0], prices.index, prices.columns)}
+    for i, column in enumerate(factor_columns, start=1):
+        exposures[column] = pd.DataFrame(coefficients[:, :, i], prices.index, prices.columns)
+    exposures["r2"] = pd.DataFrame(r2, prices.index, prices.columns)
+    return exposures
+
+
+def latest_exposures(exposures, date=None):
+    """(asset x statistic) cross-section of factor_exposures at a date, the last one by default"""
+    row = -1 if date is None else exposures["alpha"].index.get_indexer([pd.Timestamp(date)], method="ffill")[0]
+    return pd.DataFrame({name: df.iloc[row] for name, df in exposures.items()})
+
+
+if __name__ == "__main__":
+    store = FactorStore()
+    monthly = store.get(THREE_FACTORS)
+    print(monthly.tail())
+
+    # a universe of random walks regressed on the daily factors of the last ten years
+    daily = store.get(THREE_FACTORS_DAILY)
+    dates = daily.index[-2520:]
+    rng = np.random.default_rng(0)
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(dates), 3000)), axis=0)), dates)
+    started = time.perf_counter()
+    exposures = factor_exposures(prices, daily, window=252)
+    print(f"{prices.shape[1]} assets x {prices.shape[0]} days in {time.perf_counter() - started:.1f}s")
+    print(latest_exposures(exposures).describe())
@@ -0,0 +1,304 @@
+import math
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import pandas as pd
+from bar_cache import to_timedelta
+from ohlcv import empty_bars
+from utils import RateLimiter
+
+# Splits long historical data requests into chunks the provider accepts,
+# keeps a few of them in flight at once and hands the merged bars back in
+# time order, chunk by chunk:
+#
+#   history = fetch_history(app, 200, contract, "1 min", start="2024-01-01")
+#   for df in history:          # a few chunks in memory at a time
+#       ...
+#   history.gaps                # ranges that came back empty or failed
+#
+# or history.to_frame() for everything in one DataFrame.
+
+# Longest duration IB answers in one request, by bar size (IB's "historical data limitations")
+IB_MAX_SPANS = [
+    (pd.Timedelta(seconds=1), pd.Timedelta(seconds=1800)),
+    (pd.Timedelta(seconds=5), pd.Timedelta(hours=2)),
+    (pd.Timedelta(seconds=15), pd.Timedelta(hours=4)),
+    (pd.Timedelta(seconds=30), pd.Timedelta(hours=8)),
+    (pd.Timedelta(minutes=1), pd.Timedelta(days=1)),
+    (pd.Timedelta(minutes=2), pd.Timedelta(days=2)),
+    (pd.Timedelta(minutes=5), pd.Timedelta(weeks=1)),
+    (pd.Timedelta(minutes=15), pd.Timedelta(weeks=2)),
+    (pd.Timedelta(hours=1), pd.Timedelta(days=31)), # "1 M"
+]
+
+# Yahoo's longest range per request and how far back it keeps bars, by bar size
+YAHOO_LIMITS = {
+    pd.Timedelta(minutes=1): (pd.Timedelta(days=7), pd.Timedelta(days=30)),
+    pd.Timedelta(hours=1): (pd.Timedelta(days=730), pd.Timedelta(days=730)),
+}
+YAHOO_INTRADAY_LIMITS = (pd.Timedelta(days=60), pd.Timedelta(days=60)) # every other bar size below a day
+
+MAX_IN_FLIGHT = 4 # chunks requested ahead of the one being consumed
+YAHOO_REQUESTS_PER_SECOND = 2
+
+
+# converts a Timedelta into the shortest IB duration string that covers it
+def ib_duration(delta):
+    seconds = math.ceil(delta.total_seconds())
+    if seconds <= 86400:
+        return f"{max(seconds, 30)} S" # IB's smallest duration is 30 seconds
+    days = math.ceil(seconds / 86400)
+    if days <= 365:
+        return f"{days} D"
+    return f"{math.ceil(days / 365)} Y" # IB wants years for anything longer than a year
+
+
+# formats a Timestamp as an IB end date time, "yyyymmdd-hh:mm:ss" is UTC whatever the TWS time zone
+def ib_end_datetime(timestamp):
+    return _utc(timestamp).strftime("%Y%m%d-%H:%M:%S")
+
+
+def _utc(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+
+
+def _yahoo_limits(bar_size):
+    # (longest range per request, oldest bar Yahoo keeps), None for daily and longer bars
+    size = to_timedelta(bar_size)
+    if size >= pd.Timedelta(days=1):
+        return None
+    return YAHOO_LIMITS.get(size, YAHOO_INTRADAY_LIMITS)
+
+
+def max_request_span(provider, bar_size):
+    """Longest range of bar_size bars one request may cover, None when there is no limit"""
+    if provider == "ib":
+        size = to_timedelta(bar_size)
+        for largest_bar, span in IB_MAX_SPANS:
+            if size <= largest_bar:
+                return span
+        return None # daily and longer bars, IB sends years of them at once
+    if provider == "yahoo":
+        limits = _yahoo_limits(bar_size)
+        return limits[0] if limits is not None else None
+    raise ValueError(f"Unknown provider {provider!r}")
+
+
+def earliest_available(provider, bar_size, now):
+    """Oldest bar start the provider still has for bar_size, None when it keeps everything"""
+    limits = _yahoo_limits(bar_size) if provider == "yahoo" else None
+    return now - limits[1] if limits is not None else None
+
+
+def plan_chunks(provider, bar_size, start, end, now=None):
+    """Consecutive (start, end) chunks covering [start, end) that the provider accepts in one request each
+
+    Returns (chunks, unavailable), unavailable is the part of the range older than the
+    provider keeps (start, end), or None.
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    unavailable = None
+    earliest = earliest_available(provider, bar_size, now if now is not None else pd.Timestamp.now(tz=start.tzinfo))
+    if earliest is not None and start < earliest:
+        unavailable = (start, min(earliest, end))
+        start = min(earliest, end)
+    span = max_request_span(provider, bar_size)
+    if span is None or end - start <= span:
+        return ([(start, end)] if start < end else []), unavailable
+    edges = list(pd.date_range(start, end, freq=span))
+    if edges[-1] < end:
+        edges.append(end)
+    return list(zip(edges[:-1], edges[1:])), unavailable
+
+
+class HistoryStream:
+    """Bars of a long range, fetched chunk by chunk and yielded in time order
+
+    Iterating yields one DataFrame per chunk. The chunks together form one
+    contiguous frame, with no bar twice. Chunks that failed or returned nothing
+    are listed in gaps as {"start", "end", "reason"} once the iteration passed them,
+    failed ones with their exception under "error".
+
+    Parameters:
+    - source: _IBSource or _YahooSource that requests a chunk and turns its answer into a DataFrame
+    - chunks: List of (start, end) ranges from plan_chunks
+    - max_in_flight: Chunks requested ahead of the one being consumed, bounds memory
+    """
+
+    def __init__(self, source, chunks, max_in_flight=MAX_IN_FLIGHT):
+        self.source = source
+        self.chunks = chunks
+        self.max_in_flight = max_in_flight
+        self.gaps = []
+        self._chunks = None # (i, (start, end)) of the chunks not requested yet
+        self._pending = None # (start, end, handle) of the chunks on their way, None until start()
+
+    def start(self):
+        """Request the first max_in_flight chunks without waiting for them, returns the stream
+
+        Iterating starts the stream as well. Starting several streams before reading
+        the first one lets them download together.
+        """
+        if self._pending is None:
+            self._chunks = iter(enumerate(self.chunks))
+            self._pending = deque()
+            for _ in range(self.max_in_flight):
+                self._request_next()
+        return self
+
+    def _request_next(self):
+        for i, (start, end) in self._chunks:
+            self._pending.append((start, end, self.source.request(i, start, end)))
+            return
+
+    def __iter__(self):
+        pending = self.start()._pending
+        last = None # time of the last bar yielded, later chunks start after it
+        try:
+            while pending:
+                start, end, handle = pending.popleft()
+                self._request_next() # keeps max_in_flight chunks on their way while this one is consumed
+                try:
+                    df = self.source.result(handle)
+                except Exception as e:
+                    self.gaps.append({"start": start, "end": end, "reason": f"{type(e).__name__}: {e}", "error": e})
+                    continue
+                df = df[(df.index >= start) & (df.index < end)] # providers round ranges to whole days or sessions
+                if last is not None:
+                    df = df[df.index > last] # the boundary bar of the previous chunk
+                df = df[~df.index.duplicated(keep="last")]
+                if not len(df):
+                    self.gaps.append({"start": start, "end": end, "reason": "no bars"})
+                    continue
+                last = df.index[-1]
+                yield df
+        finally:
+            for _, _, handle in pending: # the consumer stopped early
+                self.source.cancel(handle)
+            self._pending = None # iterating again requests every chunk again
+            self.source.close()
+
+    def to_frame(self):
+        """Every chunk in one DataFrame"""
+        frames = list(self)
+        if not frames:
+            return self.source.empty()
+        return pd.concat(frames)
+
+
+class _IBSource:
+    # chunks of an IBClient, requested with request_historical_data so the HistoricalPacer spaces them out
+
+    def __init__(self, client, request_id, contract, bar_size, timeout):
+        self.client = client
+        self.request_id = request_id
+        self.contract = contract
+        self.bar_size = bar_size
+        self.timeout = timeout
+
+    def request(self, i, start, end):
+        request_id = self.request_id + i
+        try: # waits for the pacer at most timeout seconds, so unanswered requests can't hold up the stream for ever
+            future = self.client.request_historical_data(
+                request_id, self.contract, ib_duration(end - start), self.bar_size,
+                end_datetime=ib_end_datetime(end), timeout=self.timeout)
+        except TimeoutError as e:
+            future = Future()
+            future.set_exception(e) # reported as a gap when the chunk's turn comes
+        return request_id, future
+
+    def result(self, handle):
+        request_id, future = handle
+        data = self.client._wait_for_historical_data(request_id, future, self.timeout)
+        return self.client._historical_bars_to_frame(request_id, self.contract, self.bar_size, data)
+
+    def cancel(self, handle):
+        request_id, future = handle
+        if not future.done() and self.client.historical_futures.pop(request_id, None) is not None:
+            self.client.historical_data.pop(request_id, None)
+            if self.client.latency is not None:
+                self.client.latency.discard("historical_request", request_id)
+            self.client.cancelHistoricalData(request_id)
+            future.cancel() # frees the pacer slot
+
+    def empty(self):
+        return self.client._historical_bars_to_frame(self.request_id, self.contract, self.bar_size, [])
+
+    def close(self):
+        pass
+
+
+class _YahooSource:
+    # chunks of a YahooFinanceClient, downloaded on a few threads within a request rate
+
+    def __init__(self, client, request_id, symbol, interval, max_in_flight):
+        self.client = client
+        self.request_id = request_id
+        self.symbol = symbol
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_in_flight)
+        self._limiter = RateLimiter(YAHOO_REQUESTS_PER_SECOND, 1.0)
+
+    def request(self, i, start, end):
+        return self._executor.submit(self._download, self.request_id + i, start, end)
+
+    def _download(self, request_id, start, end):
+        self._limiter.acquire()
+        return self.client._download(request_id, self.symbol, self.interval, start=start, end=end)
+
+    def result(self, handle):
+        return handle.result()
+
+    def cancel(self, handle):
+        handle.cancel()
+
+    def empty(self):
+        return empty_bars(self.symbol, self.client.price_dtype)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def fetch_history(client, request_id, instrument, bar_size, duration=None, start=None, end=None,
+                  max_in_flight=MAX_IN_FLIGHT, timeout=60):
+    """HistoryStream over the bars of any range, split into requests the provider accepts
+
+    Parameters:
+    - client: IBClient (IBApp) or YahooFinanceClient
+    - request_id: Request id of the first chunk, chunk i uses request_id + i
+    - instrument: IB contract, or ticker symbol for Yahoo
+    - bar_size: Bar size as the client spells it ("1 min" for IB, "1m" for Yahoo)
+    - duration: Length of the range before end, e.g. "1 Y", used when start isn't given
+    - start, end: Range of bar start times, end defaults to now, naive times are taken as UTC
+    - max_in_flight: Chunks requested ahead, IB's HistoricalPacer and a Yahoo rate limit apply on top
+    - timeout: Seconds to wait for each IB chunk, and for the pacer to allow its request
+    """
+    yahoo = hasattr(client, "start_polling")
+    end = _utc(end) if end is not None else pd.Timestamp.now(tz="UTC") # the bars of every client are indexed by UTC time
+    start = _utc(start) if start is not None else end - to_timedelta(duration)
+    if yahoo:
+        source = _YahooSource(client, request_id, instrument, bar_size, max_in_flight)
+        chunks, unavailable = plan_chunks("yahoo", bar_size, start, end, now=pd.Timestamp.now(tz="UTC"))
+    else:
+        source = _IBSource(client, request_id, instrument, bar_size, timeout)
+        chunks, unavailable = plan_chunks("ib", bar_size, start, end)
+    history = HistoryStream(source, chunks, max_in_flight)
+    if unavailable is not None:
+        history.gaps.append({"start": unavailable[0], "end": unavailable[1], "reason": f"Yahoo doesn't keep {bar_size} bars that old"})
+    return history
+
+
+if __name__ == "__main__":
+    import time
+    from benchmark import BenchApp
+    from contract import stock
+    from fake_tws import FakeTWS
+
+    # a year of 1 minute bars from FakeTWS, 366 requests of one day each (FakeTWS sends 30 second bars)
+    with FakeTWS(bars_per_request=2880, history_latency=0.05) as tws:
+        app = BenchApp(tws.port)
+        started = time.perf_counter()
+        history = fetch_history(app, 1000, stock("AAPL", "SMART", "USD"), "1 min", duration="1 Y", max_in_flight=20)
+        n_bars = sum(len(df) for df in history)
+        print(f"{len(history.chunks)} chunks, {n_bars} bars, {len(history.gaps)} gaps in {time.perf_counter() - started:.1f}s")
+        app.disconnect()
@@ -0,0 +1,154 @@
+from collections import namedtuple
+import numpy as np
+
+# Signal kinds, entries on golden crosses and exits on death crosses like the crossover notebook
+ENTRY = "ENTRY"
+EXIT = "EXIT"
+
+Signal = namedtuple("Signal", ["symbol", "time", "short_window", "long_window", "kind"])
+
+
+class CrossoverEngine:
+    """Moving averages and crossover signals for many symbols and window pairs, updated bar by bar
+
+    Every update costs O(1) per symbol and window: the SMA is the difference of
+    two running sums kept in a ring buffer (the same arithmetic as vectorbt's
+    rolling_mean_nb, so ties come out identical), the EMA updates the previous
+    average. The crossover state machine mirrors vectorbt's crossed_above_nb,
+    so the signals match vbt.MA.run(...).ma_crossed_above(...) on the same bars.
+
+    Parameters:
+    - symbols: Symbols the engine follows, their order is the row order of every array
+    - pairs: (short window, long window) pairs to watch
+    - ewm: Use exponential instead of simple moving averages, like vbt.MA.run(ewm=True)
+    """
+
+    def __init__(self, symbols, pairs, ewm=False):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.ewm = ewm
+        self.windows, inverse = np.unique(self.pairs, return_inverse=True) # every window is computed once
+        inverse = inverse.reshape(self.pairs.shape)
+        self._short, self._long = inverse[:, 0], inverse[:, 1] # window columns of each pair
+        self._max_window = int(self.windows.max())
+        self._alpha = 2.0 / (self.windows + 1.0)
+
+        n_symbols, n_windows, n_pairs = len(self.symbols), len(self.windows), len(self.pairs)
+        self._cumsum = np.zeros(n_symbols) # running sum of every price seen
+        self._cumsums = np.zeros((n_symbols, self._max_window)) # ring buffer of the last max window running sums
+        self._position = np.zeros(n_symbols, dtype=np.int64) # next slot to write in the ring buffer
+        self._count = np.zeros(n_symbols, dtype=np.int64) # prices seen so far
+        self._ema = np.full((n_symbols, n_windows), np.nan)
+        self.ma = np.full((n_symbols, n_windows), np.nan) # current average of every symbol and window
+        self._was_below = np.zeros((n_symbols, n_pairs), dtype=bool) # crossed_above state, short vs long
+        self._above_since = np.full((n_symbols, n_pairs), -1, dtype=np.int64)
+        self._was_above = np.zeros((n_symbols, n_pairs), dtype=bool) # crossed_below state
+        self._below_since = np.full((n_symbols, n_pairs), -1, dtype=np.int64)
+
+    def update_many(self, prices, symbols=None):
+        """Add one bar for several symbols at once
+
+        Parameters:
+        - prices: New closing prices, aligned with symbols
+        - symbols: Symbols the prices belong to (each at most once), all symbols in order by default
+
+        Returns the boolean (symbols x pairs) arrays entries and exits for this bar.
+        """
+        symbols = self.symbols if symbols is None else list(symbols)
+        prices = np.asarray(prices, dtype=np.float64)
+        missing = np.isnan(prices)
+        if missing.any(): # symbols without a price this bar keep their state, they can't signal
+            entries = np.zeros((len(symbols), len(self.pairs)), dtype=bool)
+            exits = entries.copy()
+            valid = ~missing
+            if valid.any():
+                entries[valid], exits[valid] = self.update_many(prices[valid], [s for s, v in zip(symbols, valid) if v])
+            return entries, exits
+
+        rows = np.array([self.index[s] for s in symbols], dtype=np.int64)
+        windows = self.windows
+        position = self._position[rows]
+        count = self._count[rows] + 1
+
+        if self.ewm:
+            ema = self._ema[rows]
+            alpha = self._alpha
+            ema = np.where(np.isnan(ema), prices[:, None], (1 - alpha) * ema + alpha * prices[:, None])
+            self._ema[rows] = ema
+            ma = np.where(count[:, None] >= windows, ema, np.nan)
+        else:
+            cumsum = self._cumsum[rows] + prices
+            # running sum from just before each window, read before this bar overwrites its slot
+            before = self._cumsums[rows[:, None], (position[:, None] - windows) % self._max_window]
+            sums = cumsum[:, None] - np.where(count[:, None] > windows, before, 0.0)
+            ma = np.where(count[:, None] >= windows, sums / windows, np.nan)
+            self._cumsum[rows] = cumsum
+            self._cumsums[rows, position] = cumsum
+        self._position[rows] = (position + 1) % self._max_window
+        self._count[rows] = count
+        self.ma[rows] = ma
+
+        short, long = ma[:, self._short], ma[:, self._long]
+        entries = self._cross(rows, short, long, self._was_below, self._above_since)
+        exits = self._cross(rows, long, short, self._was_above, self._below_since)
+        return entries, exits
+
+    @staticmethod
+    def _cross(rows, a, b, was_below, since):
+        # vectorbt's crossed_above_1d_nb (wait=0) for one bar of every row and pair
+        below = was_below[rows]
+        ago = since[rows]
+        above = a > b
+        undefined = np.isnan(a) | np.isnan(b)
+        crossed = below & above & (ago == -1)
+        ago = np.where(below & above, ago + 1, -1)
+        below = np.where(below, ~(undefined & ~above), a < b)
+        was_below[rows] = below
+        since[rows] = ago
+        return crossed
+
+    def update(self, symbol, price, time=None):
+        """Add one bar of a single symbol, returns the Signals it triggered"""
+        entries, exits = self.update_many([price], [symbol])
+        signals = []
+        for kind, mask in ((ENTRY, entries[0]), (EXIT, exits[0])):
+            for pair in np.flatnonzero(mask):
+                short_window, long_window = self.pairs[pair]
+                signals.append(Signal(symbol, time, int(short_window), int(long_window), kind))
+        return signals
+
+    def on_bars(self, symbol, bars):
+        """Generator over the Signals of a bar stream, e.g. the closed bars of a BarAggregator"""
+        for bar in bars:
+            yield from self.update(symbol, bar.close, bar.time)
+
+
+def vectorbt_parity(prices, pairs, ewm=False):
+    """Compare the engine with vectorbt on a time x symbol DataFrame of closes
+
+    Returns the number of bars where entries or exits differ, 0 means identical signals.
+    """
+    import vectorbt as vbt # only needed for this check
+
+    short_ma = vbt.MA.run(prices, window=[s for s, _ in pairs], ewm=ewm, short_name="short")
+    long_ma = vbt.MA.run(prices, window=[l for _, l in pairs], ewm=ewm, short_name="long")
+    n_bars, n_symbols = prices.shape
+    # vectorbt's columns are (pair, symbol) with the symbol changing fastest
+    expected_entries = short_ma.ma_crossed_above(long_ma).values.reshape(n_bars, len(pairs), n_symbols)
+    expected_exits = short_ma.ma_crossed_below(long_ma).values.reshape(n_bars, len(pairs), n_symbols)
+
+    engine = CrossoverEngine(prices.columns, pairs, ewm=ewm)
+    mismatches = 0
+    for t, row in enumerate(prices.to_numpy()):
+        entries, exits = engine.update_many(row)
+        mismatches += int((entries.T != expected_entries[t]).any() or (exits.T != expected_exits[t]).any())
+    return mismatches
+
+
+if __name__ == "__main__":
+    import vectorbt as vbt
+
+    closes = vbt.YFData.download(["META", "AAPL", "AMZN", "NFLX", "GOOG"], start="2020-01-01 UTC", end="2024-01-01 UTC").get("Close")
+    for use_ewm in (False, True):
+        print(f"ewm={use_ewm}: {vectorbt_parity(closes, [(10, 30), (20, 50)], ewm=use_ewm)} mismatching bars")
@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+from ticks import Tick, TickBatch
+from tick_buffer import BufferClosed
+
+# Latency instrumentation for the hot paths. It is off unless a LatencyRecorder
+# is assigned to app.latency (or YahooFinanceClient.latency), so production
+# code pays one "is None" check per tick and nothing else.
+#
+# Stages recorded for every tick of a timed stream, in nanoseconds:
+#   tick_callback  arrival in IBWrapper -> queued in the stream's buffer (includes waiting on a full BLOCK buffer)
+#   tick_queue     arrival -> taken out of the buffer by the consumer
+#   tick_build     taken out of the buffer -> Tick (or TickBatch) built
+#   tick_total     arrival -> yielded to the strategy
+#   tick_consumer  time the strategy spent between two yields, its own loop body
+# and for every historical request:
+#   historical_request  reqHistoricalData sent -> historicalDataEnd
+#   yahoo_poll     one batched yfinance download of the Yahoo poller
+
+SUB_BUCKET_BITS = 6 # 32 buckets per power of two, every value is kept within about 3%
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+MAX_VALUE_NS = (1 << 40) - 1 # about 18 minutes, longer values are counted as this
+N_BUCKETS = (MAX_VALUE_NS.bit_length() - SUB_BUCKET_BITS + 1) * HALF_SUB_BUCKETS + HALF_SUB_BUCKETS
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket(value):
+    # HDR style log-linear bucket: exact below SUB_BUCKETS, then 32 linear steps per power of two
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * HALF_SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_value(index):
+    # middle of the range of values that fall into bucket index
+    if index < SUB_BUCKETS:
+        return index
+    shift, top = divmod(index - HALF_SUB_BUCKETS, HALF_SUB_BUCKETS)
+    top += HALF_SUB_BUCKETS
+    return (top << shift) + ((1 << shift) >> 1)
+
+
+class LatencyHistogram:
+    """Fixed memory histogram of nanosecond latencies with HDR style log-linear buckets
+
+    Recording is one bucket computation and a list increment, percentiles are
+    accurate to about 3% of the value. Each histogram should be written by one
+    thread, which is how LatencyRecorder uses them.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        value = min(max(int(value), 0), MAX_VALUE_NS)
+        self.counts[_bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Latency in nanoseconds below which percent of the recorded values lie"""
+        if not self.count:
+            return None
+        rank = max(1, int(self.count * percent / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(_bucket_value(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Count and latencies in microseconds"""
+        if not self.count:
+            return {"count": 0}
+        stats = {"count": self.count, "mean_us": self.total / self.count / 1000, "min_us": self.min / 1000}
+        for percent in PERCENTILES:
+            stats[f"p{percent:g}_us"] = self.percentile(percent) / 1000
+        stats["max_us"] = self.max / 1000
+        return stats
+
+
+class LatencyRecorder:
+    """Latency histograms and counters per metric and request id
+
+    Parameters:
+    - prefix: Prefix of every metric name in the Prometheus dump
+    """
+
+    def __init__(self, prefix="trading"):
+        self.prefix = prefix
+        self.histograms = {} # (metric, request id) -> LatencyHistogram
+        self.counters = {} # (name, request id) -> int
+        self._started = {} # (metric, request id) -> perf_counter_ns() of start()
+        self._lock = threading.Lock() # the EReader, poller and consumer threads record and count at once
+        self._dumper = None
+        self._stop_dumping = threading.Event()
+
+    def record(self, metric, request_id, nanoseconds):
+        with self._lock:
+            histogram = self.histograms.get((metric, request_id))
+            if histogram is None:
+                histogram = self.histograms[(metric, request_id)] = LatencyHistogram()
+            histogram.record(nanoseconds)
+
+    def count(self, name, request_id, n=1):
+        key = (name, request_id)
+        with self._lock: # the read and the write of the counter are one step
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def start(self, metric, request_id):
+        """Start timing something that ends in another thread, e.g. a request and its answer"""
+        self._started[(metric, request_id)] = time.perf_counter_ns()
+
+    def stop(self, metric, request_id):
+        """Record the time since start(), returns it in nanoseconds or None if it wasn't started"""
+        started = self._started.pop((metric, request_id), None)
+        if started is None:
+            return None
+        elapsed = time.perf_counter_ns() - started
+        self.record(metric, request_id, elapsed)
+        return elapsed
+
+    def discard(self, metric, request_id):
+        """Forget a start() that will never stop, e.g. a request that failed"""
+        self._started.pop((metric, request_id), None)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """Copy of everything recorded so far
+
+        Returns {"latency": {metric: {request_id: summary}}, "counters": {name: {request_id: value}}}
+        with the summaries of LatencyHistogram.summary, in microseconds.
+        """
+        latency, counters = {}, {}
+        for (metric, request_id), histogram in list(self.histograms.items()):
+            latency.setdefault(metric, {})[request_id] = histogram.summary()
+        for (name, request_id), value in list(self.counters.items()):
+            counters.setdefault(name, {})[request_id] = value
+        return {"latency": latency, "counters": counters}
+
+    def to_prometheus(self):
+        """Everything recorded in the Prometheus text exposition format, latencies as summaries in seconds"""
+        lines = []
+        by_metric = {}
+        for (metric, request_id), histogram in list(self.histograms.items()):
+            by_metric.setdefault(metric, []).append((request_id, histogram))
+        for metric, histograms in sorted(by_metric.items()):
+            name = f"{self.prefix}_{metric}_seconds"
+            lines.append(f"# TYPE {name} summary")
+            for request_id, histogram in histograms:
+                if not histogram.count:
+                    continue
+                for percent in PERCENTILES:
+                    lines.append(f'{name}{{request_id="{request_id}",quantile="{percent / 100:g}"}} {histogram.percentile(percent) / 1e9:.9f}')
+                lines.append(f'{name}_sum{{request_id="{request_id}"}} {histogram.total / 1e9:.9f}')
+                lines.append(f'{name}_count{{request_id="{request_id}"}} {histogram.count}')
+        by_name = {}
+        for (counter, request_id), value in list(self.counters.items()):
+            by_name.setdefault(counter, []).append((request_id, value))
+        for counter, values in sorted(by_name.items()):
+            name = f"{self.prefix}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f'{name}{{request_id="{request_id}"}} {value}' for request_id, value in values)
+        return "\n".join(lines) + "\n"
+
+    def dump_prometheus(self, path):
+        """Write to_prometheus() to path, replacing the file in one step so scrapers never read half of it"""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+    def dump_every(self, path, interval=15):
+        """Keep path up to date from a background thread, e.g. for node_exporter's textfile collector"""
+        def dump():
+            while not self._stop_dumping.wait(interval):
+                self.dump_prometheus(path)
+
+        self._stop_dumping.clear()
+        self._dumper = threading.Thread(target=dump, daemon=True)
+        self._dumper.start()
+
+    def stop_dumping(self):
+        self._stop_dumping.set()
+        if self._dumper is not None:
+            self._dumper.join()
+            self._dumper = None
+
+
+def timed_ticks(buffer, latency, request_id, batch_size=None):
+    """Generator over the Ticks (or TickBatches) of a buffer whose items carry their arrival time
+
+    The producer appends time.perf_counter_ns() at arrival as a sixth element,
+    items without it (put before timing was switched on) are passed through untimed.
+    """
+    now = time.perf_counter_ns
+    while True:
+        try:
+            if batch_size:
+                items = buffer.get_batch(batch_size)
+            else:
+                items = (buffer.get(),)
+        except BufferClosed:
+            return
+        dequeued = now()
+        arrivals = [item[5] for item in items if len(item) == 6]
+        for arrival in arrivals:
+            latency.record("tick_queue", request_id, dequeued - arrival)
+        if batch_size:
+            tick = TickBatch.from_tuples([item[:5] for item in items])
+        else:
+            tick = Tick(*items[0][:5])
+        built = now()
+        latency.record("tick_build", request_id, built - dequeued)
+        for arrival in arrivals:
+            latency.record("tick_total", request_id, built - arrival)
+        latency.count("ticks_yielded", request_id, len(items))
+        yield tick
+        latency.record("tick_consumer", request_id, now() - built) # the strategy's work on this tick
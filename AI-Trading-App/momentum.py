@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+# The momentum pipeline of Backtesting-With-Zipline-Reloaded.ipynb without
+# Zipline: every factor is computed for all dates and assets at once from a
+# (dates x assets) price panel, and the long/short selections use
+# np.argpartition instead of sorting every day.
+
+N_LONGS = N_SHORTS = 50
+UNIVERSE_SIZE = 100 # the AverageDollarVolume top(100) screen
+MOMENTUM_WINDOW = 252 # MomentumFactor.window_length, one year of trading days
+RECENT_WINDOW = 21 # the last month, left out of the long term momentum
+RETURNS_WINDOW = 126 # Returns(window_length=126) whose volatility normalises the momentum
+DOLLAR_VOLUME_WINDOW = 30 # AverageDollarVolume(window_length=30)
+
+
+def price_panel(bars):
+    """close and volume DataFrames (dates x symbols) from the clients' historical data
+
+    Parameters:
+    - bars: One DataFrame, or a list of them, in the clients' format: indexed by
+      time with close, volume and symbol columns
+    """
+    if not isinstance(bars, pd.DataFrame):
+        bars = pd.concat(bars)
+    bars = bars.reset_index(names="time") if "time" not in bars.columns else bars
+    close = bars.pivot(index="time", columns="symbol", values="close").sort_index()
+    volume = bars.pivot(index="time", columns="symbol", values="volume").reindex(close.index)
+    return close, volume
+
+
+def _shift(values, periods):
+    # values[t - periods] on row t, NaN where that row doesn't exist
+    shifted = np.full_like(values, np.nan)
+    shifted[periods:] = values[:-periods]
+    return shifted
+
+
+def _rolling_nanstd(values, window):
+    # np.nanstd over the last window rows of every row (ddof=0), from running sums of the valid values
+    valid = ~np.isnan(values)
+    centred = np.where(valid, values - np.nanmean(values, axis=0), 0.0) # centring keeps the sums small and exact
+    zeros = np.zeros((1, values.shape[1]))
+    count = np.vstack([zeros, np.cumsum(valid, axis=0)])
+    total = np.vstack([zeros, np.cumsum(centred, axis=0)])
+    squares = np.vstack([zeros, np.cumsum(centred * centred, axis=0)])
+    start = np.maximum(np.arange(1, len(values) + 1) - window, 0) # first row of every window
+    end = np.arange(1, len(values) + 1)
+    n = count[end] - count[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = (total[end] - total[start]) / n
+        variance = (squares[end] - squares[start]) / n - mean * mean
+    variance[np.arange(len(values)) < window - 1] = np.nan # Zipline only computes complete windows
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
+def momentum_factor(close):
+    """MomentumFactor.compute for every date: 12-1 month momentum over the volatility of 126 day returns
+
+    close is a (dates x assets) array, row t of the result uses the closes up to
+    and including row t, NaN until a full window is available.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    month_ago = _shift(close, RECENT_WINDOW - 1) # prices[-21]
+    year_ago = _shift(close, MOMENTUM_WINDOW - 1) # prices[-252]
+    returns = close / _shift(close, RETURNS_WINDOW - 1) - 1 # Returns(window_length=126)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (
+            (month_ago - year_ago) / year_ago
+            - (close - month_ago) / month_ago
+        ) / _rolling_nanstd(returns, MOMENTUM_WINDOW)
+
+
+def average_dollar_volume(close, volume, window=DOLLAR_VOLUME_WINDOW):
+    """AverageDollarVolume: sum of close * volume over window rows divided by window, missing days count as 0"""
+    dollar_volume = np.asarray(close, dtype=np.float64) * np.asarray(volume, dtype=np.float64)
+    valid = ~np.isnan(dollar_volume)
+    zeros = np.zeros((1, dollar_volume.shape[1]))
+    total = np.vstack([zeros, np.cumsum(np.where(valid, dollar_volume, 0.0), axis=0)])
+    count = np.vstack([zeros, np.cumsum(valid, axis=0)])
+    average = (total[window:] - total[:-window]) / window
+    average[(count[window:] - count[:-window]) == 0] = np.nan # the asset didn't trade, it isn't in the universe
+    return np.vstack([np.full((window - 1, dollar_volume.shape[1]), np.nan), average])
+
+
+def top_mask(values, n):
+    """Boolean mask of the n largest values of every row, NaN never selected
+
+    np.argpartition finds them in linear time per row, unlike a full sort.
+    Exact ties at the cut are broken arbitrarily rather than by asset order.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = min(n, values.shape[1])
+    mask = np.zeros(values.shape, dtype=bool)
+    if n <= 0:
+        return mask
+    scores = np.where(np.isnan(values), np.inf, -values) # ascending order of -values, NaN last
+    chosen = np.argpartition(scores, n - 1, axis=1)[:, :n]
+    np.put_along_axis(mask, chosen, True, axis=1)
+    return mask & ~np.isnan(values)
+
+
+def bottom_mask(values, n):
+    """Boolean mask of the n smallest values of every row, NaN never selected"""
+    return top_mask(-np.asarray(values, dtype=np.float64), n)
+
+
+def rank(values):
+    """Ordinal rank (1 = smallest) of every value within its row like Factor.rank(), NaN stays NaN"""
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, axis=1, kind="stable") # NaN sorts last, ties keep asset order
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, np.arange(1, values.shape[1] + 1, dtype=np.float64)[None, :], axis=1)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+
+def run_pipeline(close, volume, start=None, end=None, n_longs=N_LONGS, n_shorts=N_SHORTS,
+                 universe_size=UNIVERSE_SIZE, within_universe=False):
+    """The notebook's make_pipeline() for every date between start and end
+
+    Parameters:
+    - close, volume: (dates x assets) DataFrames, e.g. from price_panel; give at least
+      MOMENTUM_WINDOW + RETURNS_WINDOW dates before start for complete factors
+    - n_longs, n_shorts: Assets in the longs and shorts selections
+    - universe_size: Assets kept by the dollar volume screen
+    - within_universe: Pick longs and shorts among the screened assets only. Zipline's
+      momentum.top(N_LONGS) ranks the whole asset universe before the screen, so
+      by default a date can have fewer than n_longs longs, as in the notebook.
+
+    Returns a DataFrame indexed by (date, asset) with factor, longs, shorts and
+    ranking columns, like Zipline's run_pipeline. As in Zipline, the row of a
+    date holds what was known at the close of the previous trading day.
+    """
+    volume = volume.reindex(index=close.index, columns=close.columns)
+    prices = close.to_numpy(dtype=np.float64)
+    factor = momentum_factor(prices)
+    screen = top_mask(average_dollar_volume(prices, volume.to_numpy(dtype=np.float64)), universe_size)
+    candidates = np.where(screen, factor, np.nan) if within_universe else factor
+    longs = top_mask(candidates, n_longs)
+    shorts = bottom_mask(candidates, n_shorts)
+    ranking = rank(factor)
+
+    # the output for a date is computed from the data up to the previous date
+    dates = close.index[1:]
+    rows = np.arange(len(dates))
+    selected = (dates >= pd.Timestamp(start)) if start is not None else np.ones(len(dates), dtype=bool)
+    if end is not None:
+        selected &= dates <= pd.Timestamp(end)
+    rows = rows[selected]
+    date_rows, assets = np.nonzero(screen[rows])
+    source = rows[date_rows]
+    return pd.DataFrame(
+        {
+            "factor": factor[source, assets],
+            "longs": longs[source, assets],
+            "shorts": shorts[source, assets],
+            "ranking": ranking[source, assets],
+        },
+        index=pd.MultiIndex.from_arrays([dates[source], close.columns[assets]], names=["date", "asset"]),
+    )
+
+
+if __name__ == "__main__":
+    import time
+
+    # a synthetic universe the size of a full US equities bundle
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2004-01-01", periods=252 * 20)
+    assets = [f"A{i}" for i in range(3000)]
+    close = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(dates), len(assets))), axis=0)), dates, assets)
+    volume = pd.DataFrame(rng.integers(1_000, 1_000_000, close.shape), dates, assets)
+    started = time.perf_counter()
+    output = run_pipeline(close, volume)
+    print(f"{len(dates)} dates x {len(assets)} assets in {time.perf_counter() - started:.1f}s")
+    print(output.loc[dates[-1]].sort_values("ranking", ascending=False).head())
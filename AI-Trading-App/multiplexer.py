@@ -0,0 +1,195 @@
+import itertools
+import threading
+from latency import timed_ticks
+from tick_buffer import TickBuffer, BufferClosed, DEFAULT_BUFFER_SIZE, DROP_OLDEST
+from ticks import Tick, TickBatch
+
+# Shares one upstream market data subscription per (contract, tick type)
+# between any number of consumers. IB limits how many tick-by-tick streams
+# can be open at once, so strategies watching the same contract subscribe
+# here instead of calling get_streaming_data themselves:
+#
+#   multiplexer = StreamMultiplexer(app)
+#   for tick in multiplexer.stream(es):  # in every strategy thread
+#       ...
+#
+# The upstream stream puts its ticks into a FanOut, which hands every tick to
+# each subscriber's own TickBuffer, so every consumer has its own capacity and
+# overflow policy. The first subscriber starts the upstream request, the last
+# one to leave cancels it with cancelTickByTickData (or stops the Yahoo poll).
+
+TICK_TYPES = ("BidAsk",) # the tick types IBWrapper turns into ticks
+
+
+class FanOut:
+    """Upstream sink with the put/close interface of TickBuffer that copies every tick to its subscribers' buffers"""
+
+    def __init__(self):
+        self.buffers = () # replaced, never changed in place, so put() iterates without a lock
+
+    def put(self, item):
+        """Give the tick to every subscriber, returns False if any of them dropped a tick"""
+        accepted = True
+        for buffer in self.buffers:
+            if buffer.put(item) is False:
+                accepted = False
+        return accepted
+
+    def close(self):
+        for buffer in self.buffers:
+            buffer.close()
+
+    @property
+    def dropped(self):
+        return sum(buffer.dropped for buffer in self.buffers)
+
+
+class Subscription:
+    """One consumer of a shared stream, iterate over it for its Ticks and close it when done
+
+    Parameters:
+    - multiplexer: The StreamMultiplexer that created it
+    - key: (instrument key, tick type) of the upstream stream
+    - subscriber_id: Identifier of this consumer, used as its request id in the latency metrics
+    - buffer: TickBuffer holding the ticks this consumer hasn't read yet
+    """
+
+    def __init__(self, multiplexer, key, subscriber_id, buffer):
+        self.multiplexer = multiplexer
+        self.key = key
+        self.subscriber_id = subscriber_id
+        self.buffer = buffer
+        self.latency = None # LatencyRecorder when the upstream stream stamps its ticks, set by the multiplexer
+
+    @property
+    def dropped(self):
+        """Number of ticks this consumer lost because it fell behind"""
+        return self.buffer.dropped
+
+    def ticks(self, batch_size=None):
+        """Generator of Ticks, or TickBatches of up to batch_size ticks, until the subscription is closed"""
+        if self.latency is not None:
+            yield from timed_ticks(self.buffer, self.latency, self.subscriber_id, batch_size)
+            return
+        while True:
+            try:
+                if batch_size:
+                    yield TickBatch.from_tuples(self.buffer.get_batch(batch_size))
+                else:
+                    yield Tick(*self.buffer.get())
+            except BufferClosed:
+                return
+
+    def __iter__(self):
+        return self.ticks()
+
+    def close(self):
+        self.multiplexer.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def instrument_key(instrument):
+    """Hashable identity of a contract or Yahoo symbol, equal for contracts that describe the same instrument"""
+    if isinstance(instrument, str):
+        return instrument
+    if getattr(instrument, "conId", 0): # IB's own id, set on contracts that were resolved
+        return instrument.conId
+    return tuple(getattr(instrument, field, None) for field in (
+        "symbol", "secType", "exchange", "currency", "lastTradeDateOrContractMonth", "localSymbol", "strike", "right",
+    ))
+
+
+class StreamMultiplexer:
+    """Reference counted upstream subscriptions shared by any number of consumers
+
+    Parameters:
+    - client: IBApp (or any IBClient and IBWrapper) or YahooFinanceClient
+    - first_request_id: Request id of the first upstream subscription, later ones count up from it.
+      Keep the range apart from the request ids used directly on the client.
+    - polling_interval: Seconds between polls of a Yahoo stream
+    """
+
+    def __init__(self, client, first_request_id=90000, polling_interval=5):
+        self.client = client
+        self.polling_interval = polling_interval
+        self.upstreams = {} # (instrument key, tick type) -> {"request_id", "fanout", "latency", "subscribers"}
+        self._request_ids = itertools.count(first_request_id)
+        self._subscriber_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._polling = hasattr(client, "start_polling") # YahooFinanceClient polls instead of subscribing
+
+    def subscribe(self, instrument, tick_type="BidAsk", maxsize=DEFAULT_BUFFER_SIZE, overflow=DROP_OLDEST):
+        """Add a consumer of an instrument's ticks, starting the upstream stream if it is the first one
+
+        Parameters:
+        - instrument: IB contract, or ticker symbol for a YahooFinanceClient
+        - tick_type: Tick-by-tick type of the IB stream
+        - maxsize: Unread ticks this consumer can fall behind by
+        - overflow: Overflow policy of this consumer's buffer. DROP_OLDEST by default, because with
+          BLOCK a full buffer holds up the upstream stream and so every other consumer of it.
+        """
+        if tick_type not in TICK_TYPES:
+            raise ValueError(f"Unsupported tick type {tick_type!r}, expected one of {TICK_TYPES}")
+        key = (instrument_key(instrument), tick_type)
+        buffer = TickBuffer(maxsize, overflow)
+        with self._lock:
+            upstream = self.upstreams.get(key)
+            if upstream is None:
+                upstream = self._start(key, instrument, tick_type)
+            upstream["fanout"].buffers += (buffer,)
+            upstream["subscribers"] += 1
+        subscription = Subscription(self, key, next(self._subscriber_ids), buffer)
+        subscription.latency = upstream["latency"]
+        return subscription
+
+    def _start(self, key, instrument, tick_type):
+        request_id = next(self._request_ids)
+        fanout = FanOut()
+        latency = self.client.latency # instrumentation is decided once per upstream stream
+        if latency is not None:
+            self.client.timed_streams.add(request_id) # its ticks carry their arrival time
+        upstream = self.upstreams[key] = {"request_id": request_id, "fanout": fanout, "latency": latency, "subscribers": 0}
+        if self._polling:
+            self.client.start_polling(request_id, instrument, self.polling_interval, fanout)
+        else:
+            self.client.start_tick_stream(request_id, instrument, fanout, tick_type)
+        return upstream
+
+    def unsubscribe(self, subscription):
+        """Remove a consumer and end its iteration, the last one to leave cancels the upstream stream"""
+        with self._lock:
+            upstream = self.upstreams.get(subscription.key)
+            if upstream is None or subscription.buffer not in upstream["fanout"].buffers: # already unsubscribed
+                return
+            upstream["fanout"].buffers = tuple(b for b in upstream["fanout"].buffers if b is not subscription.buffer)
+            upstream["subscribers"] -= 1
+            if not upstream["subscribers"]:
+                del self.upstreams[subscription.key]
+                self.client.stop_streaming_data(upstream["request_id"]) # cancelTickByTickData, or stops the poll
+        subscription.buffer.close()
+
+    def stream(self, instrument, tick_type="BidAsk", batch_size=None, maxsize=DEFAULT_BUFFER_SIZE, overflow=DROP_OLDEST):
+        """Generator over the ticks of a shared stream, like get_streaming_data, that unsubscribes when it is closed"""
+        subscription = self.subscribe(instrument, tick_type, maxsize, overflow)
+        try:
+            yield from subscription.ticks(batch_size)
+        finally:
+            subscription.close()
+
+    def subscribers(self, instrument, tick_type="BidAsk"):
+        """Number of consumers of an instrument's stream"""
+        upstream = self.upstreams.get((instrument_key(instrument), tick_type))
+        return upstream["subscribers"] if upstream is not None else 0
+
+    def close(self):
+        """Cancel every upstream stream and end the iteration of all consumers"""
+        with self._lock:
+            upstreams = list(self.upstreams.values())
+            self.upstreams.clear()
+        for upstream in upstreams:
+            self.client.stop_streaming_data(upstream["request_id"]) # also closes the consumers' buffers
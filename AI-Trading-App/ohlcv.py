@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+# The one bar format every client returns. Whatever the provider sends, the
+# bars end up as
+#
+#   index   "time", datetime64[ns, UTC], the start of the bar
+#   open, high, low, close   float64, or float32 when the client's price_dtype says so
+#   volume  int64 (IB sends -1 for MIDPOINT bars, which have no volume)
+#   symbol  categorical with the one symbol of the frame
+#
+# The frame is put together from one NumPy array per column, built straight
+# from what the provider sent (IB's bar tuples, yfinance's frame, Alpaca's
+# JSON), and the DataFrame wraps those arrays instead of copying them. No
+# frame of Python objects or row by row date parsing in between.
+
+OHLCV_COLUMNS = ["open", "high", "low", "close", "volume"]
+PRICE_COLUMNS = OHLCV_COLUMNS[:4]
+PRICE_DTYPE = np.float64
+
+YAHOO_COLUMNS = ["Open", "High", "Low", "Close", "Volume"] # yfinance's column names in OHLCV_COLUMNS order
+ALPACA_FIELDS = ["o", "h", "l", "c", "v"] # Alpaca's bar keys in OHLCV_COLUMNS order
+
+
+def bars_frame(time_ns, open_, high, low, close, volume, symbol, price_dtype=PRICE_DTYPE):
+    """Canonical bar frame around the given arrays, copied only where their dtype differs
+
+    Parameters:
+    - time_ns: Bar start times as int64 nanoseconds since the epoch, UTC
+    - open_, high, low, close, volume: Arrays (or sequences) aligned with time_ns
+    - symbol: Symbol of every bar
+    - price_dtype: np.float64, or np.float32 for half the memory
+    """
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    index = pd.DatetimeIndex(time_ns.view("M8[ns]"), tz="UTC", name="time")
+    columns = {name: np.asarray(values, dtype=price_dtype) for name, values in zip(PRICE_COLUMNS, (open_, high, low, close))}
+    volume = np.asarray(volume)
+    if volume.dtype != np.int64: # fractional and missing volumes of some providers
+        volume = np.nan_to_num(volume.astype(np.float64, copy=False), nan=0.0).astype(np.int64)
+    columns["volume"] = volume
+    columns["symbol"] = pd.Categorical.from_codes(np.zeros(len(time_ns), dtype=np.int8), categories=[symbol])
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def empty_bars(symbol, price_dtype=PRICE_DTYPE):
+    return bars_frame([], [], [], [], [], np.empty(0, dtype=np.int64), symbol, price_dtype)
+
+
+def from_ib(data, symbol, price_dtype=PRICE_DTYPE):
+    """Canonical frame of the (date, open, high, low, close, volume) tuples IBWrapper collects
+
+    Dates are what IB sends with formatDate=2: seconds since the epoch for intraday
+    bars and "yyyymmdd" for daily and longer bars, taken as midnight UTC.
+    """
+    if not data:
+        return empty_bars(symbol, price_dtype)
+    dates, open_, high, low, close, volume = zip(*data) # columns of the tuples, no per row work in Python
+    if len(dates[0]) == 8: # yyyymmdd
+        time_ns = pd.to_datetime(dates, format="%Y%m%d").as_unit("ns").asi8
+    else:
+        time_ns = np.array(dates, dtype=np.int64) * 1_000_000_000
+    return bars_frame(time_ns, open_, high, low, close, np.array(volume, dtype=np.float64), symbol, price_dtype) # volume is a Decimal in newer ibapi
+
+
+def from_yahoo(data, symbol, price_dtype=PRICE_DTYPE):
+    """Canonical frame of a yf.download or Ticker.history frame
+
+    Intraday bars come in the exchange's time zone and are converted, daily bars are
+    naive dates and taken as midnight UTC.
+    """
+    if data is None or not len(data):
+        return empty_bars(symbol, price_dtype)
+    index = data.index
+    index = index.tz_convert("UTC") if index.tz is not None else index.tz_localize("UTC")
+    columns = []
+    for name in YAHOO_COLUMNS:
+        column = data[name]
+        if isinstance(column, pd.DataFrame): # yf.download's (Price, Ticker) columns
+            column = column.iloc[:, 0]
+        columns.append(column.to_numpy())
+    return bars_frame(index.as_unit("ns").asi8, *columns, symbol, price_dtype)
+
+
+def from_alpaca(bars, symbol, price_dtype=PRICE_DTYPE):
+    """Canonical frame of the bar objects {"t", "o", "h", "l", "c", "v", ...} of one symbol in Alpaca's JSON"""
+    if not bars:
+        return empty_bars(symbol, price_dtype)
+    time_ns = pd.to_datetime([bar["t"] for bar in bars], utc=True, format="ISO8601").as_unit("ns").asi8
+    open_, high, low, close, volume = ([bar[key] for bar in bars] for key in ALPACA_FIELDS)
+    return bars_frame(time_ns, open_, high, low, close, np.array(volume, dtype=np.float64), symbol, price_dtype)
+
+
+def pivot_bars(dfs, col_to_use):
+    """One column of several symbols' bar frames side by side, time x symbol
+
+    None in dfs stands for a symbol whose request failed. When no frame is left the
+    result is an empty frame with the same index and column names.
+    """
+    dfs = [df for df in dfs if df is not None and len(df)]
+    if not dfs: # every request failed or came back empty, pd.concat would raise
+        return pd.DataFrame(index=pd.DatetimeIndex([], dtype="datetime64[ns, UTC]", name="time"),
+                            columns=pd.Index([], name="symbol"), dtype=float)
+    return (
+        pd.concat(dfs) # Groups together all our dataframes into 1
+        .reset_index() # time becomes a column again
+        .pivot( # Reshapes data
+            index="time", columns="symbol", values=col_to_use
+        )
+    )
+
+
+def canonical(df, symbol, price_dtype=PRICE_DTYPE):
+    """Any time indexed OHLCV frame (e.g. read from a BarCache) in the canonical format, naive times taken as UTC"""
+    if df is None or not len(df):
+        return empty_bars(symbol, price_dtype)
+    index = df.index
+    index = index.tz_convert("UTC") if index.tz is not None else index.tz_localize("UTC")
+    return bars_frame(index.as_unit("ns").asi8, *(df[name].to_numpy() for name in OHLCV_COLUMNS), symbol, price_dtype)
@@ -0,0 +1,165 @@
+import threading
+import time
+from dataclasses import dataclass, field
+import numpy as np
+from utils import RateLimiter
+
+# IB disconnects clients that send more than 50 messages per second
+MAX_MESSAGES_PER_SECOND = 50
+
+# Order statuses after which IB won't send more updates for an order
+DONE_STATUSES = ("Filled", "Cancelled", "ApiCancelled", "Inactive")
+
+
+@dataclass
+class OrderRecord:
+    """Everything we know about one submitted order, times are time.perf_counter() values"""
+    order_id: int
+    symbol: str
+    contract: object
+    order: object
+    status: str = "PendingSubmit"
+    filled: float = 0.0
+    remaining: float = 0.0
+    avg_fill_price: float = 0.0
+    queued_at: float = 0.0 # submit() was called
+    submitted_at: float = 0.0 # placeOrder was sent, after waiting for the rate limiter
+    acked_at: float = None # first orderStatus or openOrder from TWS
+    filled_at: float = None # order completely filled
+    error: str = None
+    executions: list = field(default_factory=list)
+
+    @property
+    def done(self):
+        return self.status in DONE_STATUSES or self.error is not None
+
+    @property
+    def ack_latency(self):
+        return None if self.acked_at is None else self.acked_at - self.submitted_at
+
+    @property
+    def fill_latency(self):
+        return None if self.filled_at is None else self.filled_at - self.submitted_at
+
+
+class OrderRouter:
+    """Sends orders through an IBApp and keeps track of them
+
+    Order ids are handed out locally from nextValidId, so submitting never waits
+    for TWS, and placeOrder calls are throttled to IB's message rate limit.
+
+    Parameters:
+    - app: The connected IBApp (IBWrapper + IBClient) orders are sent through
+    - max_per_second: placeOrder messages allowed per second
+    """
+
+    def __init__(self, app, max_per_second=MAX_MESSAGES_PER_SECOND):
+        self.app = app
+        self.orders = {} # order id -> OrderRecord
+        self.by_symbol = {} # symbol -> list of order ids
+        self.portfolio = None # Portfolio from portfolio.py that the fills of our orders are booked in
+        self._limiter = RateLimiter(max_per_second, 1.0)
+        self._next_id = None
+        self._lock = threading.Lock()
+
+    def next_order_id(self):
+        """Reserve the next order id without asking TWS"""
+        with self._lock:
+            if self.app.next_valid_id is None:
+                raise RuntimeError("No order id yet, wait for nextValidId after connecting")
+            if self._next_id is None or self._next_id < self.app.next_valid_id: # TWS may hand out a higher id after reqIds
+                self._next_id = self.app.next_valid_id
+            order_id = self._next_id
+            self._next_id += 1
+            return order_id
+
+    def submit(self, contract, order):
+        """Send one order, returns its OrderRecord"""
+        queued_at = time.perf_counter()
+        order_id = self.next_order_id()
+        record = OrderRecord(order_id, contract.symbol, contract, order, remaining=float(order.totalQuantity), queued_at=queued_at)
+        with self._lock:
+            self.orders[order_id] = record
+            self.by_symbol.setdefault(contract.symbol, []).append(order_id)
+        self._limiter.acquire() # waits only when we are above the allowed message rate
+        record.submitted_at = time.perf_counter()
+        self.app.placeOrder(order_id, contract, order)
+        return record
+
+    def submit_many(self, orders):
+        """Send a batch of (contract, order) pairs as fast as the rate limit allows"""
+        return [self.submit(contract, order) for contract, order in orders]
+
+    def cancel(self, order_id):
+        self._limiter.acquire()
+        self.app.cancelOrder(order_id)
+
+    def orders_for(self, symbol):
+        return [self.orders[order_id] for order_id in self.by_symbol.get(symbol, [])]
+
+    def open_orders(self):
+        return [record for record in self.orders.values() if not record.done]
+
+    # The methods below are called by IBWrapper from the EReader thread
+
+    def on_order_status(self, order_id, status, filled, remaining, avg_fill_price):
+        record = self.orders.get(order_id)
+        if record is None: # an order placed by another client or before we started
+            return
+        now = time.perf_counter()
+        with self._lock:
+            if record.acked_at is None:
+                record.acked_at = now
+            record.status = status
+            record.filled = float(filled)
+            record.remaining = float(remaining)
+            record.avg_fill_price = avg_fill_price
+            if status == "Filled" and record.filled_at is None:
+                record.filled_at = now
+
+    def on_open_order(self, order_id):
+        record = self.orders.get(order_id)
+        if record is not None and record.acked_at is None:
+            record.acked_at = time.perf_counter()
+
+    def on_execution(self, order_id, execution):
+        record = self.orders.get(order_id)
+        if record is not None:
+            with self._lock:
+                record.executions.append(execution)
+            if self.portfolio is not None:
+                self.portfolio.on_execution(record.symbol, execution)
+
+    def on_commission(self, exec_id, commission):
+        if self.portfolio is not None:
+            self.portfolio.on_commission(exec_id, commission)
+
+    def on_error(self, order_id, code, message):
+        """Returns True when the error belonged to one of our orders"""
+        record = self.orders.get(order_id)
+        if record is None:
+            return False
+        with self._lock:
+            record.error = f"{code}: {message}"
+            if record.acked_at is None:
+                record.acked_at = time.perf_counter() # a rejection is TWS's answer too
+        return True
+
+    def latency_stats(self):
+        """Percentiles in milliseconds of queue wait, submit->ack and submit->fill over all orders"""
+        with self._lock:
+            records = list(self.orders.values())
+        samples = {
+            "queue_wait": [r.submitted_at - r.queued_at for r in records if r.submitted_at],
+            "ack": [r.ack_latency for r in records if r.ack_latency is not None],
+            "fill": [r.fill_latency for r in records if r.fill_latency is not None],
+        }
+        stats = {}
+        for name, values in samples.items():
+            if not values:
+                stats[name] = {"count": 0}
+                continue
+            ms = np.asarray(values) * 1000
+            p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+            stats[name] = {"count": len(ms), "mean": ms.mean(), "p50": p50, "p90": p90, "p99": p99, "max": ms.max()}
+        return stats
@@ -0,0 +1,312 @@
+import threading
+import time
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from ticks import TickBatch
+
+# Live valuation of a book of positions. Positions, average costs and last
+# prices are NumPy arrays, one slot per symbol, and the book's totals are
+# kept up to date by difference: a tick only changes its own symbol's value,
+# so re-marking costs the same for 10 positions as for 10000.
+#
+#   portfolio = Portfolio()
+#   app.order_router.portfolio = portfolio        # fills arrive through execDetails, commissions through commissionReport
+#   for tick in portfolio.marked(app.get_streaming_data(1, es), "ES"):
+#       ...
+#   portfolio.unrealized, portfolio.gross_exposure   # O(1), any thread
+#   portfolio.snapshot().to_frame()                  # consistent copy of every position
+#
+# Writers (the streaming and EReader threads) serialize on a lock and bump a
+# version counter before and after every change. Readers never take the lock,
+# they copy the arrays and start over if the version moved meanwhile, so a
+# slow reader never holds up the stream.
+
+INITIAL_CAPACITY = 64
+
+
+@dataclass
+class PortfolioSnapshot:
+    """Consistent copy of a Portfolio at one moment, arrays are aligned with symbols"""
+    version: int # Portfolio.version when the copy was taken
+    symbols: list
+    quantity: np.ndarray # signed position, negative for shorts
+    avg_cost: np.ndarray # average price paid for the open position
+    price: np.ndarray # last mid price, NaN before the first tick
+    multiplier: np.ndarray # contract multiplier, 1 for stocks
+    exposure: np.ndarray # signed market value, quantity * price * multiplier
+    unrealized: np.ndarray # P&L of the open position at the last price
+    realized: np.ndarray # P&L of closed quantities less commissions
+
+    @property
+    def net_exposure(self):
+        return float(self.exposure.sum())
+
+    @property
+    def gross_exposure(self):
+        return float(np.abs(self.exposure).sum())
+
+    @property
+    def total_pnl(self):
+        return float(self.unrealized.sum() + self.realized.sum())
+
+    def to_frame(self):
+        gross = self.gross_exposure
+        return pd.DataFrame({
+            "quantity": self.quantity, "avg_cost": self.avg_cost, "price": self.price,
+            "exposure": self.exposure, "weight": self.exposure / gross if gross else 0.0, # share of the gross exposure
+            "unrealized": self.unrealized, "realized": self.realized,
+        }, index=pd.Index(self.symbols, name="symbol"))
+
+
+class Portfolio:
+    """Positions marked to market tick by tick
+
+    Parameters:
+    - multipliers: Dictionary symbol -> contract multiplier for futures and options, 1 for any other symbol
+    - capacity: Number of symbols the arrays hold before they are grown
+    """
+
+    def __init__(self, multipliers=None, capacity=INITIAL_CAPACITY):
+        self.index = {} # symbol -> slot in the arrays
+        self.symbols = []
+        self.quantity = np.zeros(capacity)
+        self.avg_cost = np.zeros(capacity)
+        self.price = np.full(capacity, np.nan)
+        self.multiplier = np.ones(capacity)
+        self.value = np.zeros(capacity) # quantity * price * multiplier, at avg_cost until the first tick
+        self.cost = np.zeros(capacity) # quantity * avg_cost * multiplier
+        self.realized_pnl = np.zeros(capacity)
+        self.net_exposure = 0.0 # sum of value
+        self.gross_exposure = 0.0 # sum of abs(value)
+        self.cost_basis = 0.0 # sum of cost
+        self.realized = 0.0 # sum of realized_pnl
+        self.version = 0 # odd while a writer is changing the arrays
+        self.multipliers = dict(multipliers or {})
+        self._executions = {} # execId -> symbol of the executions already applied, IB sends them again after a reconnect
+        self._commissions = set() # execIds whose commission was booked
+        self._early_commissions = {} # execId -> commission that arrived before its execution
+        self._lock = threading.Lock() # between writers only
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def unrealized(self):
+        return self.net_exposure - self.cost_basis
+
+    @property
+    def total_pnl(self):
+        return self.unrealized + self.realized
+
+    def slot(self, symbol):
+        """Slot of a symbol in the arrays, added on first use"""
+        i = self.index.get(symbol)
+        if i is not None:
+            return i
+        with self._lock:
+            if symbol in self.index: # another writer added it meanwhile
+                return self.index[symbol]
+            self.version += 1
+            i = len(self.symbols)
+            if i == len(self.quantity):
+                self._grow()
+            self.multiplier[i] = self.multipliers.get(symbol, 1.0)
+            self.symbols.append(symbol)
+            self.index[symbol] = i
+            self.version += 1
+            return i
+
+    def _grow(self):
+        # twice the slots, the new arrays replace the old ones so readers see either the old or the new
+        for name, fill in (("quantity", 0.0), ("avg_cost", 0.0), ("price", np.nan), ("multiplier", 1.0),
+                           ("value", 0.0), ("cost", 0.0), ("realized_pnl", 0.0)):
+            old = getattr(self, name)
+            new = np.full(2 * len(old), fill)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def mark(self, symbol, price):
+        """Re-mark one symbol at a new price, updates its value and the totals"""
+        if not price > 0: # NaN and the zero or negative prices IB sends for missing quotes
+            return
+        i = self.slot(symbol)
+        with self._lock:
+            self.version += 1
+            self.price[i] = price
+            self._revalue(i)
+            self.version += 1
+
+    def _revalue(self, i):
+        # moves slot i's value to the current price and adjusts the totals by the difference
+        old = self.value[i]
+        price = self.price[i]
+        new = self.quantity[i] * (price if price == price else self.avg_cost[i]) * self.multiplier[i] # avg_cost until priced
+        self.value[i] = new
+        self.net_exposure += new - old
+        self.gross_exposure += abs(new) - abs(old)
+
+    def on_tick(self, symbol, tick):
+        """Mark a symbol at the mid of a Tick, or of the last tick of a TickBatch"""
+        if isinstance(tick, TickBatch):
+            if not len(tick):
+                return
+            bid, ask = tick.data["bid_price"][-1], tick.data["ask_price"][-1]
+        else:
+            bid, ask = tick.bid_price, tick.ask_price
+        if bid > 0 and ask > 0:
+            self.mark(symbol, (bid + ask) / 2)
+        else: # one sided quote
+            self.mark(symbol, max(bid, ask))
+
+    def marked(self, ticks, symbol):
+        """Pass a get_streaming_data or Subscription generator through, marking symbol at every Tick or TickBatch"""
+        for tick in ticks:
+            self.on_tick(symbol, tick)
+            yield tick
+
+    def sink(self, symbol):
+        """Object with the put/close interface of TickBuffer that marks symbol at the tick tuples put into it
+
+        Give it to IBClient.start_tick_stream or YahooFinanceClient.start_polling to
+        keep the portfolio marked without a consumer thread.
+        """
+        return _MarkSink(self, symbol)
+
+    def apply_fill(self, symbol, quantity, price, commission=0.0):
+        """Book a fill of signed quantity (negative sells) at price, realizing P&L on any quantity it closes"""
+        if not quantity:
+            return
+        i = self.slot(symbol)
+        with self._lock:
+            self.version += 1
+            position, avg_cost, multiplier = self.quantity[i], self.avg_cost[i], self.multiplier[i]
+            new_position = position + quantity
+            realized = -commission
+            if position == 0 or (position > 0) == (quantity > 0): # opens or adds to the position
+                avg_cost = (position * avg_cost + quantity * price) / new_position
+            else:
+                closed = min(abs(quantity), abs(position)) * np.sign(position)
+                realized += closed * (price - avg_cost) * multiplier
+                if new_position == 0:
+                    avg_cost = 0.0
+                elif (new_position > 0) != (position > 0): # the fill flipped the position, the rest opens at price
+                    avg_cost = price
+            self.quantity[i] = new_position
+            self.avg_cost[i] = avg_cost
+            self.realized_pnl[i] += realized
+            self.realized += realized
+            cost = new_position * avg_cost * multiplier
+            self.cost_basis += cost - self.cost[i]
+            self.cost[i] = cost
+            if self.price[i] != self.price[i]: # no tick yet, the fill is the best price we know
+                self.price[i] = price
+            self._revalue(i)
+            self.version += 1
+
+    def on_execution(self, symbol, execution):
+        """Book an ibapi Execution from execDetails, each execId only once"""
+        if execution.execId in self._executions:
+            return
+        self._executions[execution.execId] = symbol
+        shares = float(execution.shares)
+        self.apply_fill(symbol, shares if execution.side == "BOT" else -shares, execution.price)
+        commission = self._early_commissions.pop(execution.execId, None)
+        if commission is not None:
+            self.on_commission(execution.execId, commission)
+
+    def on_commission(self, exec_id, commission):
+        """Book the commission of an execution from commissionReport, each execId only once"""
+        if commission != commission or abs(commission) > 1e300: # IB sends the largest double while it's unknown
+            return
+        symbol = self._executions.get(exec_id)
+        if symbol is None: # booked once its execution arrives
+            self._early_commissions[exec_id] = commission
+            return
+        if exec_id in self._commissions:
+            return
+        self._commissions.add(exec_id)
+        self.charge(symbol, commission)
+
+    def charge(self, symbol, amount):
+        """Take a commission or fee off a symbol's realized P&L"""
+        i = self.slot(symbol)
+        with self._lock:
+            self.version += 1
+            self.realized_pnl[i] -= amount
+            self.realized -= amount
+            self.version += 1
+
+    def set_position(self, symbol, quantity, avg_cost):
+        """Replace a position, e.g. with what reqPositions reports at startup"""
+        i = self.slot(symbol)
+        with self._lock:
+            self.version += 1
+            self.quantity[i] = quantity
+            self.avg_cost[i] = avg_cost
+            cost = quantity * avg_cost * self.multiplier[i]
+            self.cost_basis += cost - self.cost[i]
+            self.cost[i] = cost
+            self._revalue(i)
+            self.version += 1
+
+    def snapshot(self):
+        """PortfolioSnapshot of every position, taken without blocking the writers"""
+        while True:
+            version = self.version
+            if version % 2: # a writer is halfway through a change
+                time.sleep(0) # lets the writer finish instead of spinning through our time slice
+                continue
+            n = len(self.symbols)
+            symbols = self.symbols[:n]
+            quantity, avg_cost, price = self.quantity[:n].copy(), self.avg_cost[:n].copy(), self.price[:n].copy()
+            multiplier, value = self.multiplier[:n].copy(), self.value[:n].copy()
+            cost, realized = self.cost[:n].copy(), self.realized_pnl[:n].copy()
+            if self.version == version:
+                break
+        return PortfolioSnapshot(version, symbols, quantity, avg_cost, price, multiplier, value, value - cost, realized)
+
+    def refresh(self):
+        """Recompute the totals from the arrays, clearing the rounding error of many incremental updates"""
+        with self._lock:
+            self.version += 1
+            n = len(self.symbols)
+            self.net_exposure = float(self.value[:n].sum())
+            self.gross_exposure = float(np.abs(self.value[:n]).sum())
+            self.cost_basis = float(self.cost[:n].sum())
+            self.realized = float(self.realized_pnl[:n].sum())
+            self.version += 1
+
+
+class _MarkSink:
+    def __init__(self, portfolio, symbol):
+        self.portfolio = portfolio
+        self.symbol = symbol
+        self.dropped = 0
+
+    def put(self, item):
+        _, bid, ask = item[:3] # (time, bid, ask, bid size, ask size), maybe followed by a latency stamp
+        self.portfolio.mark(self.symbol, (bid + ask) / 2 if bid > 0 and ask > 0 else max(bid, ask))
+        return True
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    # 5000 positions re-marked by a million quotes
+    rng = np.random.default_rng(0)
+    portfolio = Portfolio()
+    names = [f"S{i}" for i in range(5000)]
+    for name in names:
+        portfolio.apply_fill(name, int(rng.integers(-500, 500)), float(rng.uniform(10, 500)))
+    slots = rng.integers(0, len(names), 1_000_000)
+    prices = portfolio.avg_cost[slots] * rng.uniform(0.95, 1.05, len(slots))
+    started = time.perf_counter()
+    for i, price in zip(slots.tolist(), prices.tolist()):
+        portfolio.mark(names[i], price)
+    elapsed = time.perf_counter() - started
+    print(f"{len(slots) / elapsed:,.0f} marks/s, unrealized {portfolio.unrealized:,.2f}")
+    started = time.perf_counter()
+    snapshot = portfolio.snapshot()
+    print(f"snapshot in {(time.perf_counter() - started) * 1000:.2f} ms, total P&L {snapshot.total_pnl:,.2f}")
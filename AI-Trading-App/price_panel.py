@@ -0,0 +1,216 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# On-disk wide price panels: one contiguous (time x symbol) matrix per field
+# in a raw binary file, with the timestamps in a file of their own and the
+# symbols, dtype and length in meta.json. Readers map the files with
+# np.memmap, so opening is instant and every process that reads the same
+# panel shares the page cache instead of holding a copy.
+#
+#   panel_dir/
+#     meta.json        fields, symbols, dtype, length (rows written) and capacity (rows allocated)
+#     time.bin         int64 nanoseconds since the epoch, UTC
+#     close.bin ...    capacity x len(symbols) values of one field, row after row
+#
+# New dates are appended in place, the files grow by doubling their capacity
+# and meta.json is replaced last, so readers never see a half written row.
+
+FIELDS = ["open", "high", "low", "close", "volume"]
+INITIAL_CAPACITY = 256 # rows allocated for a new panel
+
+
+class PricePanel:
+    """A panel directory opened for reading, or for appending with mode="r+"
+
+    Use PricePanel.create or PricePanel.write to make a new one.
+
+    Parameters:
+    - path: Directory of the panel
+    - mode: "r" to read, "r+" to also append
+    """
+
+    def __init__(self, path, mode="r"):
+        if mode not in ("r", "r+"):
+            raise ValueError(f"mode must be 'r' or 'r+', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.refresh()
+
+    @classmethod
+    def create(cls, path, symbols, fields=FIELDS, dtype="float64", capacity=INITIAL_CAPACITY):
+        """Make an empty panel and open it for appending"""
+        if os.path.exists(os.path.join(path, "meta.json")):
+            raise FileExistsError(f"{path} already holds a panel")
+        os.makedirs(path, exist_ok=True)
+        symbols = [str(symbol) for symbol in symbols]
+        if len(set(symbols)) != len(symbols):
+            raise ValueError("symbols must be unique")
+        meta = {"fields": list(fields), "symbols": symbols, "dtype": np.dtype(dtype).name, "length": 0, "capacity": capacity}
+        row_bytes = {"time": 8} | {field: len(symbols) * np.dtype(dtype).itemsize for field in fields}
+        for name, size in row_bytes.items():
+            with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+                f.truncate(size * capacity) # sparse, disk is only used once rows are written
+        _write_meta(path, meta)
+        return cls(path, mode="r+")
+
+    @classmethod
+    def write(cls, path, frames, dtype="float64"):
+        """Make a panel from wide DataFrames and open it for appending
+
+        Parameters:
+        - frames: Dictionary field -> (time x symbol) DataFrame, e.g. the output of
+          get_historical_data_for_many for every field
+        """
+        first = next(iter(frames.values()))
+        panel = cls.create(path, first.columns, fields=list(frames), dtype=dtype, capacity=max(len(first), INITIAL_CAPACITY))
+        panel.append(frames)
+        return panel
+
+    def refresh(self):
+        """Re-read meta.json and map the files again, to see rows appended by another process"""
+        with open(os.path.join(self.path, "meta.json")) as f:
+            meta = json.load(f)
+        self.fields = meta["fields"]
+        self.symbols = pd.Index(meta["symbols"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.length = meta["length"]
+        self.capacity = meta["capacity"]
+        # the writer maps the allocated capacity, readers only the rows that are written
+        rows = self.capacity if self.mode == "r+" else self.length
+        self._time = self._map("time", np.int64, (rows,))
+        self._data = {field: self._map(field, self.dtype, (rows, len(self.symbols))) for field in self.fields}
+
+    def _map(self, name, dtype, shape):
+        if shape[0] == 0: # np.memmap can't map zero bytes
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype, mode=self.mode, shape=shape)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def index(self):
+        """Timestamps of the rows as a UTC DatetimeIndex"""
+        return pd.DatetimeIndex(self._time[:self.length].view("datetime64[ns]"), tz="UTC", name="time")
+
+    def array(self, field, start=None, end=None):
+        """Memory-mapped (time x symbol) values of a field between start and end inclusive, no copy"""
+        rows = self._rows(start, end)
+        return self._data[field][rows]
+
+    def frame(self, field, start=None, end=None, symbols=None):
+        """DataFrame view of a field, only a selection of symbols copies their columns"""
+        rows = self._rows(start, end)
+        values = self._data[field][rows]
+        columns = self.symbols
+        if symbols is not None:
+            positions = self.symbols.get_indexer(symbols)
+            if (positions < 0).any():
+                raise KeyError(f"Symbols not in the panel: {list(np.asarray(symbols)[positions < 0])}")
+            values, columns = values[:, positions], self.symbols[positions]
+        return pd.DataFrame(values, index=self.index[rows], columns=columns, copy=False)
+
+    def _rows(self, start, end):
+        times = self._time[:self.length]
+        first = 0 if start is None else int(np.searchsorted(times, _nanoseconds(start), side="left"))
+        last = self.length if end is None else int(np.searchsorted(times, _nanoseconds(end), side="right"))
+        return slice(first, last)
+
+    def append(self, frames):
+        """Append rows after the last one, frames is a dictionary field -> (time x symbol) DataFrame
+
+        Every frame needs the same timestamps, later than the last row of the panel.
+        Missing fields and symbols are stored as NaN, unknown symbols raise a KeyError.
+        """
+        if self.mode != "r+":
+            raise PermissionError("The panel was opened read only, open it with mode='r+' to append")
+        unknown = set(frames) - set(self.fields)
+        if unknown:
+            raise KeyError(f"Fields not in the panel: {sorted(unknown)}")
+        first = next(iter(frames.values()))
+        times = _nanoseconds(first.index)
+        if len(times) == 0:
+            return
+        if np.any(np.diff(times) <= 0):
+            raise ValueError("Timestamps must be unique and increasing")
+        if self.length and times[0] <= self._time[self.length - 1]:
+            raise ValueError("Appended rows must come after the last row of the panel")
+        for frame in frames.values():
+            extra = frame.columns.difference(self.symbols)
+            if len(extra):
+                raise KeyError(f"Symbols not in the panel: {list(extra)}")
+            if len(frame) != len(times) or not np.array_equal(_nanoseconds(frame.index), times):
+                raise ValueError("Every field must have the same timestamps")
+
+        end = self.length + len(times)
+        if end > self.capacity:
+            self._grow(end)
+        self._time[self.length:end] = times
+        for field in self.fields:
+            frame = frames.get(field)
+            values = self._data[field][self.length:end]
+            if frame is None:
+                values[:] = np.nan
+            else:
+                values[:] = frame.reindex(columns=self.symbols).to_numpy(dtype=self.dtype, na_value=np.nan)
+        self.flush()
+        self.length = end
+        _write_meta(self.path, self._meta()) # the rows become visible to readers only now
+
+    def _grow(self, rows):
+        capacity = self.capacity
+        while capacity < rows:
+            capacity *= 2
+        self.flush()
+        self._time = self._data = None # unmap before resizing the files
+        row_bytes = {"time": 8} | {field: len(self.symbols) * self.dtype.itemsize for field in self.fields}
+        for name, size in row_bytes.items():
+            with open(os.path.join(self.path, f"{name}.bin"), "r+b") as f:
+                f.truncate(size * capacity)
+        self.capacity = capacity
+        _write_meta(self.path, self._meta())
+        self._time = self._map("time", np.int64, (capacity,))
+        self._data = {field: self._map(field, self.dtype, (capacity, len(self.symbols))) for field in self.fields}
+
+    def flush(self):
+        for array in [self._time, *self._data.values()]:
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def _meta(self):
+        return {"fields": self.fields, "symbols": list(self.symbols), "dtype": self.dtype.name,
+                "length": self.length, "capacity": self.capacity}
+
+
+def _nanoseconds(times):
+    # int64 nanoseconds since the epoch of a timestamp or DatetimeIndex, naive times are taken as UTC
+    if isinstance(times, pd.DatetimeIndex):
+        times = times.tz_localize("UTC") if times.tz is None else times.tz_convert("UTC")
+        return times.as_unit("ns").asi8
+    timestamp = pd.Timestamp(times)
+    timestamp = timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+    return timestamp.as_unit("ns").value
+
+
+def _write_meta(path, meta):
+    temporary = os.path.join(path, "meta.json.tmp")
+    with open(temporary, "w") as f:
+        json.dump(meta, f)
+    os.replace(temporary, os.path.join(path, "meta.json"))
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2015-01-01", periods=2520)
+    symbols = [f"S{i}" for i in range(5000)]
+    close = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (len(dates), len(symbols))), axis=0)), dates, symbols)
+    with tempfile.TemporaryDirectory() as directory:
+        PricePanel.write(os.path.join(directory, "daily"), {"close": close})
+        started = time.perf_counter()
+        df = PricePanel(os.path.join(directory, "daily")).frame("close")
+        print(f"opened {df.shape[0]} x {df.shape[1]} closes in {(time.perf_counter() - started) * 1000:.1f} ms")
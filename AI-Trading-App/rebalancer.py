@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# Target weight rebalancing for whole books in one step. The Zipline
+# notebook's rebalance() calls order_target_percent asset by asset, for the
+# divested, long and short assets in turn; here the targets of every asset
+# are one weight vector, so an asset that is held, sold and bought again in
+# the same rebalance gets a single net order, and the order quantities of
+# the whole book are a few array operations:
+#
+#   assets, positions, prices, weights = align(held, latest_prices, long_short_weights(longs, shorts))
+#   batch = rebalance(assets, positions, prices, weights, portfolio_value, min_notional=100)
+#   router.submit_many(batch.to_orders(contracts))     # live, through OrderRouter
+#   for asset, quantity in batch.items(): order(asset, quantity)  # in a backtest
+
+
+@dataclass
+class OrderBatch:
+    """Net orders of one rebalance as aligned arrays, sells first so their proceeds fund the buys"""
+    assets: np.ndarray # asset labels
+    quantity: np.ndarray # signed quantity to trade, positive buys and negative sells
+    price: np.ndarray # price the quantities were computed with
+    current: np.ndarray # position before the orders
+    target: np.ndarray # position after the orders
+
+    def __len__(self):
+        return len(self.assets)
+
+    @property
+    def notional(self):
+        """Signed value of every order"""
+        return self.quantity * self.price
+
+    def items(self):
+        """(asset, quantity) pairs, e.g. for Zipline's order(asset, quantity)"""
+        return zip(self.assets.tolist(), self.quantity.tolist())
+
+    def to_frame(self):
+        return pd.DataFrame(
+            {"quantity": self.quantity, "price": self.price, "current": self.current, "target": self.target},
+            index=pd.Index(self.assets, name="asset"),
+        )
+
+    def to_orders(self, contracts, limit_prices=None):
+        """(contract, Order) pairs built with order.py, ready for OrderRouter.submit_many
+
+        Parameters:
+        - contracts: Dictionary asset -> IB contract, or a function asset -> contract
+        - limit_prices: Limit price per order aligned with the batch, market orders when None
+        """
+        from order import BUY, SELL, limit, market # ibapi is only needed when orders go to IB
+
+        contract_for = contracts if callable(contracts) else contracts.__getitem__
+        orders = []
+        for i, (asset, quantity) in enumerate(self.items()):
+            action = BUY if quantity > 0 else SELL
+            if limit_prices is None:
+                order = market(action, abs(quantity))
+            else:
+                order = limit(action, abs(quantity), float(limit_prices[i]))
+            orders.append((contract_for(asset), order))
+        return orders
+
+    def submit(self, router, contracts, limit_prices=None):
+        """Send the batch through an OrderRouter, returns the OrderRecords"""
+        return router.submit_many(self.to_orders(contracts, limit_prices))
+
+
+def long_short_weights(longs, shorts, long_exposure=1.0, short_exposure=1.0):
+    """Equal weights for the longs and shorts of a pipeline row, netted when an asset is in both
+
+    Parameters:
+    - longs, shorts: Boolean Series indexed by asset, e.g. the longs and shorts columns of run_pipeline for one date
+    - long_exposure, short_exposure: Total weight of each side, 1 and 1 are the notebook's 100% long and 100% short
+    """
+    longs = longs.astype(bool)
+    shorts = shorts.reindex(longs.index.union(shorts.index), fill_value=False).astype(bool)
+    longs = longs.reindex(shorts.index, fill_value=False)
+    n_longs, n_shorts = int(longs.sum()), int(shorts.sum())
+    weights = np.zeros(len(longs))
+    if n_longs:
+        weights += np.where(longs.to_numpy(), long_exposure / n_longs, 0.0)
+    if n_shorts:
+        weights -= np.where(shorts.to_numpy(), short_exposure / n_shorts, 0.0)
+    return pd.Series(weights, index=longs.index)
+
+
+def align(positions, prices, weights):
+    """Aligned (assets, positions, prices, weights) arrays over every asset that is held or has a weight
+
+    positions, prices and weights are Series or dictionaries keyed by asset. Held assets
+    without a weight get weight 0, which divests them, and missing prices are NaN.
+    """
+    positions, prices, weights = (pd.Series(x, dtype="float64") if isinstance(x, dict) else x
+                                  for x in (positions, prices, weights))
+    assets = positions.index[positions.to_numpy() != 0].union(weights.index)
+    return (
+        assets.to_numpy(),
+        positions.reindex(assets, fill_value=0.0).to_numpy(dtype=np.float64),
+        prices.reindex(assets).to_numpy(dtype=np.float64),
+        weights.reindex(assets, fill_value=0.0).to_numpy(dtype=np.float64),
+    )
+
+
+def rebalance(assets, positions, prices, weights, portfolio_value, lot_size=1, min_notional=0.0,
+              tradable=None, pending=None):
+    """Orders that move every position to its target weight of the portfolio, like order_target_percent for all assets at once
+
+    Parameters:
+    - assets, positions, prices, weights: Aligned arrays (see align), weights are fractions of portfolio_value
+      and negative for shorts
+    - portfolio_value: Cash plus the value of all positions
+    - lot_size: Tradable unit, one number or one per asset. Targets are rounded towards zero to whole
+      lots, so no position ends up larger than its weight.
+    - min_notional: Orders worth less are skipped, except those that close a position completely
+    - tradable: Boolean mask of assets that can be traded now (data.can_trade), all by default
+    - pending: Boolean mask of assets that still have open orders (get_open_orders), skipped like in the notebook
+
+    Assets without a valid price are never traded. Returns an OrderBatch of the non-zero orders.
+    """
+    assets = np.asarray(assets)
+    positions = np.asarray(positions, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    lot_size = np.broadcast_to(np.asarray(lot_size, dtype=np.float64), prices.shape)
+
+    valid = np.isfinite(prices) & (prices > 0)
+    if tradable is not None:
+        valid &= np.asarray(tradable, dtype=bool)
+    if pending is not None:
+        valid &= ~np.asarray(pending, dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        target = np.trunc(weights * portfolio_value / (prices * lot_size)) * lot_size
+    target = np.where(valid, target, positions) # untradable assets keep their position
+    quantity = target - positions
+    closing = (target == 0) & (positions != 0)
+    keep = (quantity != 0) & ((np.abs(quantity) * np.where(valid, prices, 0.0) >= min_notional) | closing)
+
+    selected = np.flatnonzero(keep)
+    selected = selected[np.argsort(quantity[selected] > 0, kind="stable")] # sells, then buys
+    return OrderBatch(assets[selected], quantity[selected], prices[selected], positions[selected], target[selected])
+
+
+if __name__ == "__main__":
+    import time
+
+    # a 1000 name book moving to new long and short selections
+    rng = np.random.default_rng(0)
+    names = pd.Index([f"A{i}" for i in range(1000)])
+    prices = pd.Series(rng.uniform(5, 500, len(names)), names)
+    held = pd.Series(rng.integers(-500, 500, len(names)).astype(float), names)
+    scores = pd.Series(rng.normal(size=len(names)), names)
+    longs, shorts = scores >= scores.nlargest(50).min(), scores <= scores.nsmallest(50).max()
+    started = time.perf_counter()
+    batch = rebalance(*align(held, prices, long_short_weights(longs, shorts)), portfolio_value=1_000_000, min_notional=100)
+    print(f"{len(batch)} orders in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(batch.to_frame().head())
@@ -0,0 +1,402 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from ticks import Tick, TickBatch, TICK_DTYPE, NS_PER_SECOND
+from ohlcv import bars_frame
+
+# Recording of live ticks and bars, and deterministic replay of them.
+#
+# A tape is a directory of append-only files of fixed size records:
+#
+#   tape_dir/
+#     meta.json    the recorded streams (id, symbol, kind)
+#     ticks.bin    TAPE_TICK_DTYPE records, in the order they were recorded
+#     ticks.idx    (record, recorded_ns) checkpoint every checkpoint_every ticks
+#     bars.bin     TAPE_BAR_DTYPE records
+#     bars.idx     the same checkpoints for bars
+#
+# Every record carries recorded_ns, the wall clock in nanoseconds since the
+# epoch when it was recorded. Replays are paced by it, and seeks search it:
+# the checkpoints narrow a seek down to one block, then a binary search runs
+# over the memory-mapped records of that block. The writer buffers records
+# and appends them in blocks, so readers see whole records only, and a tape
+# can be replayed while it is still being recorded. A background thread
+# writes the buffer every flush_interval, also when a stream goes quiet.
+
+TAPE_TICK_DTYPE = np.dtype(TICK_DTYPE.descr + [("recorded_ns", "i8"), ("stream", "i4")]) # 52 bytes per tick
+TAPE_BAR_DTYPE = np.dtype([
+    ("time_ns", "i8"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("volume", "f8"),
+    ("recorded_ns", "i8"),
+    ("stream", "i4"),
+])
+INDEX_DTYPE = np.dtype([("record", "i8"), ("recorded_ns", "i8")])
+DTYPES = {"ticks": TAPE_TICK_DTYPE, "bars": TAPE_BAR_DTYPE}
+BAR_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+CHECKPOINT_EVERY = 65536 # records between two index checkpoints
+FLUSH_EVERY = 4096 # records buffered before they are written
+FLUSH_INTERVAL = 1.0 # seconds between two writes of the buffered records by the flusher thread
+REPLAY_CHUNK = 65536 # records converted at once during a replay
+
+
+class TapeRecorder:
+    """Appends ticks and bars of any number of streams to a tape directory
+
+    Parameters:
+    - path: Directory of the tape, created if needed, an existing tape is appended to
+    - checkpoint_every: Records between two index checkpoints
+    - flush_every: Records buffered before they are written
+    - flush_interval: Seconds between two writes of the buffer by a background thread, so live readers keep
+      up with quiet streams too, None writes only every flush_every records and on close
+    """
+
+    def __init__(self, path, checkpoint_every=CHECKPOINT_EVERY, flush_every=FLUSH_EVERY, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_every = flush_every
+        os.makedirs(path, exist_ok=True)
+        meta = _read_meta(path)
+        if meta is None:
+            meta = {"version": 1, "checkpoint_every": checkpoint_every, "streams": []}
+            _write_meta(path, meta)
+        self.meta = meta
+        self.checkpoint_every = meta["checkpoint_every"]
+        self._pending = {kind: [] for kind in DTYPES} # record tuples and arrays not written yet
+        self._pending_count = 0
+        self._written = {kind: os.path.getsize(_file(path, kind, "bin")) // dtype.itemsize if os.path.exists(_file(path, kind, "bin")) else 0
+                         for kind, dtype in DTYPES.items()}
+        self._files = {kind: open(_file(path, kind, "bin"), "ab") for kind in DTYPES}
+        self._indexes = {kind: open(_file(path, kind, "idx"), "ab") for kind in DTYPES}
+        self._lock = threading.Lock() # sinks record from the EReader thread, consumers from theirs
+        self._closing = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._flush_every, args=(flush_interval,), daemon=True)
+            self._flusher.start()
+
+    def add_stream(self, symbol, kind="ticks"):
+        """Register a stream and return its id, the same id again for a symbol that is already recorded"""
+        with self._lock:
+            for stream in self.meta["streams"]:
+                if stream["symbol"] == symbol and stream["kind"] == kind:
+                    return stream["id"]
+            stream_id = len(self.meta["streams"])
+            self.meta["streams"].append({"id": stream_id, "symbol": symbol, "kind": kind})
+            _write_meta(self.path, self.meta)
+            return stream_id
+
+    def record_tick(self, stream, time, bid_price, ask_price, bid_size, ask_size):
+        """Append one tick, time in seconds since the epoch like Tick.time"""
+        now = _now_ns()
+        self._append("ticks", (round(time * NS_PER_SECOND), bid_price, ask_price, bid_size, ask_size, now, stream))
+
+    def record_batch(self, stream, batch):
+        """Append every tick of a TickBatch"""
+        now = _now_ns()
+        rows = np.empty(len(batch), dtype=TAPE_TICK_DTYPE)
+        for name in TICK_DTYPE.names:
+            rows[name] = batch.data[name]
+        rows["recorded_ns"] = now
+        rows["stream"] = stream
+        self._append("ticks", rows)
+
+    def record_bar(self, stream, time, open, high, low, close, volume):
+        """Append one bar, time in seconds since the epoch like bar_aggregator.Bar.time"""
+        now = _now_ns()
+        self._append("bars", (round(time * NS_PER_SECOND), open, high, low, close, volume, now, stream))
+
+    def record_bars(self, symbol, df):
+        """Append historical bars of a symbol, a time indexed DataFrame with open, high, low, close and volume"""
+        stream = self.add_stream(symbol, "bars")
+        index = pd.DatetimeIndex(df.index)
+        index = index.tz_convert("UTC") if index.tz is not None else index
+        rows = np.empty(len(df), dtype=TAPE_BAR_DTYPE)
+        rows["time_ns"] = index.as_unit("ns").asi8
+        for column in BAR_COLUMNS:
+            rows[column] = df[column].to_numpy(dtype=np.float64)
+        now = _now_ns()
+        rows["recorded_ns"] = now
+        rows["stream"] = stream
+        self._append("bars", rows)
+
+    def _append(self, kind, rows):
+        with self._lock:
+            self._pending[kind].append(rows)
+            self._pending_count += len(rows) if isinstance(rows, np.ndarray) else 1
+            if self._pending_count >= self.flush_every:
+                self._flush()
+
+    def _flush_every(self, interval):
+        # the flusher thread, appends alone only check the buffer size
+        while not self._closing.wait(interval):
+            self.flush()
+
+    def record(self, ticks, symbol):
+        """Pass a get_streaming_data generator through, recording every Tick or TickBatch it yields"""
+        stream = self.add_stream(symbol)
+        for tick in ticks:
+            if isinstance(tick, TickBatch):
+                self.record_batch(stream, tick)
+            else:
+                self.record_tick(stream, tick.time, tick.bid_price, tick.ask_price, tick.bid_size, tick.ask_size)
+            yield tick
+
+    def sink(self, symbol):
+        """Object with the put/close interface of TickBuffer that records the tick tuples put into it
+
+        Give it to IBClient.start_tick_stream or YahooFinanceClient.start_polling to record
+        a stream on arrival, without a consumer.
+        """
+        return _TickSink(self, self.add_stream(symbol))
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._pending_count = 0
+        for kind, pending in self._pending.items():
+            if not pending:
+                continue
+            rows = _rows(pending, DTYPES[kind])
+            pending.clear()
+            self._files[kind].write(rows.tobytes())
+            self._files[kind].flush()
+            # a checkpoint for every multiple of checkpoint_every among the new records
+            first = self._written[kind]
+            checkpoints = np.arange(-(-first // self.checkpoint_every) * self.checkpoint_every, first + len(rows), self.checkpoint_every)
+            if len(checkpoints):
+                index = np.empty(len(checkpoints), dtype=INDEX_DTYPE)
+                index["record"] = checkpoints
+                index["recorded_ns"] = rows["recorded_ns"][checkpoints - first]
+                self._indexes[kind].write(index.tobytes())
+                self._indexes[kind].flush()
+            self._written[kind] += len(rows)
+
+    def close(self):
+        self._closing.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        for f in [*self._files.values(), *self._indexes.values()]:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _TickSink:
+    def __init__(self, recorder, stream):
+        self.recorder = recorder
+        self.stream = stream
+        self.dropped = 0
+
+    def put(self, item):
+        self.recorder.record_tick(self.stream, *item[:5]) # a sixth element is a latency stamp, not recorded
+        return True
+
+    def close(self):
+        self.recorder.flush()
+
+
+def _rows(pending, dtype):
+    # one structured array from buffered tuples and arrays, in the order they were recorded
+    if all(isinstance(item, tuple) for item in pending):
+        return np.array(pending, dtype=dtype)
+    parts, tuples = [], []
+    for item in pending:
+        if isinstance(item, tuple):
+            tuples.append(item)
+            continue
+        if tuples:
+            parts.append(np.array(tuples, dtype=dtype))
+            tuples = []
+        parts.append(item)
+    if tuples:
+        parts.append(np.array(tuples, dtype=dtype))
+    return np.concatenate(parts)
+
+
+class TapeReader:
+    """A recorded tape, replayed with the streaming interface of the clients
+
+    Parameters:
+    - path: Directory of the tape
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.refresh()
+
+    def refresh(self):
+        """Map the files again, to see records flushed since the tape was opened"""
+        meta = _read_meta(self.path)
+        if meta is None:
+            raise FileNotFoundError(f"{self.path} is not a tape")
+        self.streams = meta["streams"]
+        self.records = {kind: _map(_file(self.path, kind, "bin"), dtype) for kind, dtype in DTYPES.items()}
+        self.indexes = {kind: _map(_file(self.path, kind, "idx"), INDEX_DTYPE) for kind in DTYPES}
+
+    @property
+    def ticks(self):
+        """Memory-mapped TAPE_TICK_DTYPE records of every stream"""
+        return self.records["ticks"]
+
+    @property
+    def bars(self):
+        return self.records["bars"]
+
+    def stream_ids(self, symbols=None, kind="ticks"):
+        """Ids of the streams of the given symbols, of all streams of that kind when symbols is None"""
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        ids = [s["id"] for s in self.streams if s["kind"] == kind and (symbols is None or s["symbol"] in symbols)]
+        if symbols is not None and not ids:
+            raise KeyError(f"No {kind} recorded for {symbols}")
+        return ids
+
+    def seek(self, timestamp, kind="ticks"):
+        """Number of the first record recorded at or after timestamp (UTC when naive)"""
+        target = _timestamp_ns(timestamp)
+        index, records = self.indexes[kind], self.records[kind]
+        block = int(np.searchsorted(index["recorded_ns"], target, side="right")) - 1 # last checkpoint before target
+        first = int(index["record"][block]) if block >= 0 else 0
+        last = int(index["record"][block + 1]) if block + 1 < len(index) else len(records)
+        return first + int(np.searchsorted(records["recorded_ns"][first:last], target, side="left"))
+
+    def replay(self, symbols=None, start=None, end=None, speed=None, batch_size=None):
+        """Generator of the recorded Ticks, or TickBatches of up to batch_size ticks, in recording order
+
+        Parameters:
+        - symbols: Symbol or list of symbols to replay, every tick stream by default
+        - start, end: Replay only ticks recorded in [start, end)
+        - speed: None replays as fast as possible, 1 at the recorded pace, 10 ten times faster
+        """
+        records = self.ticks
+        first = self.seek(start) if start is not None else 0
+        last = self.seek(end) if end is not None else len(records)
+        wanted = None if symbols is None else np.array(self.stream_ids(symbols))
+        if wanted is not None and len(wanted) == len(self.stream_ids()):
+            wanted = None # every tick stream, no filtering needed
+        origin = None # (recorded_ns, perf_counter_ns) of the first replayed tick
+        for chunk_start in range(first, last, REPLAY_CHUNK):
+            chunk = records[chunk_start:min(chunk_start + REPLAY_CHUNK, last)]
+            if wanted is not None:
+                chunk = chunk[np.isin(chunk["stream"], wanted)]
+            if not len(chunk):
+                continue
+            if speed is None:
+                yield from _emit(chunk, batch_size)
+                continue
+            if origin is None:
+                origin = (int(chunk["recorded_ns"][0]), time.perf_counter_ns())
+            due = origin[1] + ((chunk["recorded_ns"] - origin[0]) / speed).astype(np.int64) # perf_counter_ns when each tick is due
+            position = 0
+            while position < len(chunk):
+                wait = (due[position] - time.perf_counter_ns()) / NS_PER_SECOND
+                if wait > 0:
+                    time.sleep(wait)
+                if batch_size: # everything due by now, up to batch_size ticks
+                    ready = int(np.searchsorted(due, time.perf_counter_ns(), side="right"))
+                    ready = max(min(ready, position + batch_size), position + 1)
+                else:
+                    ready = position + 1
+                yield from _emit(chunk[position:ready], batch_size)
+                position = ready
+
+    def get_streaming_data(self, request_id, symbol, batch_size=None, speed=None, start=None, end=None):
+        """Replay one symbol like the clients' get_streaming_data, see replay"""
+        return self.replay(symbol, start, end, speed, batch_size)
+
+    def get_historical_data(self, request_id, symbol, start=None, end=None):
+        """Recorded bars of a symbol in the clients' format (see ohlcv.py)"""
+        records = self.bars
+        first = self.seek(start, "bars") if start is not None else 0
+        last = self.seek(end, "bars") if end is not None else len(records)
+        rows = records[first:last]
+        rows = rows[np.isin(rows["stream"], self.stream_ids(symbol, "bars"))]
+        rows = rows[np.argsort(rows["time_ns"], kind="stable")]
+        rows = rows[np.append(rows["time_ns"][1:] != rows["time_ns"][:-1], True)] # a bar recorded again later replaces the earlier one
+        df = bars_frame(rows["time_ns"], *(rows[column] for column in BAR_COLUMNS), symbol)
+        df.request_id = request_id
+        return df
+
+
+def _emit(rows, batch_size):
+    # Ticks or TickBatches of a block of tape records
+    if batch_size:
+        ticks = rows[list(TICK_DTYPE.names)] # a view without recorded_ns and stream
+        for first in range(0, len(rows), batch_size):
+            yield TickBatch(ticks[first:first + batch_size])
+        return
+    times = (rows["time_ns"] // NS_PER_SECOND).tolist()
+    yield from map(Tick, times, rows["bid_price"].tolist(), rows["ask_price"].tolist(),
+                   rows["bid_size"].tolist(), rows["ask_size"].tolist())
+
+
+def _map(path, dtype):
+    size = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if size == 0: # np.memmap can't map zero bytes
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(size,)) # whole records only, a block being written is left out
+
+
+def _now_ns():
+    return time.time_ns()
+
+
+def _timestamp_ns(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    timestamp = timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp.tz_convert("UTC")
+    return timestamp.as_unit("ns").value
+
+
+def _file(path, kind, extension):
+    return os.path.join(path, f"{kind}.{extension}")
+
+
+def _read_meta(path):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def _write_meta(path, meta):
+    temporary = os.path.join(path, "meta.json.tmp")
+    with open(temporary, "w") as f:
+        json.dump(meta, f)
+    os.replace(temporary, os.path.join(path, "meta.json"))
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # a busy futures session, 5 million ticks, recorded and replayed at full speed
+    n = 5_000_000
+    batch = TickBatch.from_tuples([(1_700_000_000 + i // 200, 5000.25 + (i % 4) * 0.25, 5000.5 + (i % 4) * 0.25, 10, 12) for i in range(n)])
+    with tempfile.TemporaryDirectory() as directory:
+        with TapeRecorder(directory) as recorder:
+            stream = recorder.add_stream("ES")
+            for first in range(0, n, 100_000):
+                recorder.record_batch(stream, batch[first:first + 100_000])
+        tape = TapeReader(directory)
+        for label, batch_size in (("Ticks", None), ("TickBatches of 10000", 10_000)):
+            started = time.perf_counter()
+            count = 0
+            for item in tape.replay("ES", batch_size=batch_size):
+                count += len(item) if batch_size else 1
+            elapsed = time.perf_counter() - started
+            print(f"{label}: {count} ticks in {elapsed:.2f}s, {count / elapsed / 1e6:.1f} million ticks/s")
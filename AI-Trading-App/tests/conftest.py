@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the app import each other by their plain names (from client import IBClient)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
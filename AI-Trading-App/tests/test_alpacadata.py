@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+import alpacadata
+from alpacadata import AlpacaDataClient, AlpacaDataError
+from bar_cache import BarCache
+from fake_alpaca import FakeAlpaca, bar_times, synthetic_bars
+
+START, END = pd.Timestamp("2024-01-02 14:00", tz="UTC"), pd.Timestamp("2024-01-02 15:00", tz="UTC")
+
+
+@pytest.fixture
+def fake():
+    with FakeAlpaca() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(fake):
+    client = AlpacaDataClient("fake-key", "fake-secret", data_url=fake.url)
+    yield client
+    client.close()
+
+
+def test_bars_follow_the_page_tokens(fake, client, monkeypatch):
+    monkeypatch.setattr(alpacadata, "PAGE_LIMIT", 25)
+    bars = client.get_bars(["BBB", "AAA"], "1 min", START, END)
+    # the fake sends the 61 bars of [START, END] per symbol, 25 a page over both symbols
+    assert client.stats["requests"] == len(fake.requests) == 5
+    assert "page_token" not in fake.requests[0] and all("page_token" in query for query in fake.requests[1:])
+    assert fake.connections == 1 # one kept-alive connection for all pages
+    times = bar_times("1Min", START.isoformat(), END.isoformat())
+    for symbol, df in bars.items():
+        assert len(df) == 60 and df.index[-1] == END - pd.Timedelta(minutes=1) # END itself is left out
+        assert df.index.is_monotonic_increasing and str(df.index.tz) == "UTC"
+        expected = [bar["c"] for bar in synthetic_bars(symbol, times[:-1])]
+        np.testing.assert_allclose(df["close"].to_numpy(), expected)
+        assert (df["symbol"] == symbol).all()
+
+
+def test_many_symbols_are_split_over_requests(fake, client, monkeypatch):
+    monkeypatch.setattr(alpacadata, "SYMBOLS_PER_REQUEST", 2)
+    close = client.get_historical_data_for_many(7, ["AAA", "BBB", "CCC"], bar_size="1Day", start="2024-01-01", end="2024-02-01")
+    assert [query["symbols"] for query in fake.requests] == ["AAA,BBB", "CCC"]
+    assert list(close.columns) == ["AAA", "BBB", "CCC"] and close.request_id == 7
+    assert len(close) == 23 and close.index[-1] < pd.Timestamp("2024-02-01", tz="UTC") # weekdays of January
+    assert not close.isna().any().any()
+
+
+def test_cached_bars_are_not_downloaded_again(fake, tmp_path):
+    client = AlpacaDataClient("fake-key", "fake-secret", data_url=fake.url, bar_cache=BarCache(str(tmp_path)))
+    first = client.get_bars(["AAA"], "1 min", START, END)["AAA"]
+    requests = len(fake.requests)
+    second = client.get_bars(["AAA"], "1 min", START, END)["AAA"]
+    assert len(fake.requests) == requests
+    pd.testing.assert_frame_equal(first, second, check_freq=False)
+
+
+def test_errors_and_credentials(fake, monkeypatch):
+    client = AlpacaDataClient("fake-key", "fake-secret", data_url=fake.url + "/nowhere")
+    with pytest.raises(AlpacaDataError) as error:
+        client.get_bars(["AAA"], "1 day", START, END)
+    assert error.value.status == 404
+    monkeypatch.delenv("APCA_API_KEY_ID", raising=False)
+    monkeypatch.delenv("APCA_API_SECRET_KEY", raising=False)
+    with pytest.raises(ValueError):
+        AlpacaDataClient(data_url=fake.url)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from bar_cache import BarCache, contract_key
+from ohlcv import bars_frame
+
+START = pd.Timestamp("2024-01-01", tz="UTC")
+
+
+def minute_bars(n):
+    times = pd.date_range(START, periods=n, freq="1min").as_unit("ns")
+    close = np.arange(n, dtype=np.float64)
+    return bars_frame(times.asi8, close, close, close, close, np.ones(n, dtype=np.int64), "X").drop(columns="symbol")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = BarCache(str(tmp_path))
+    cache.store("ib", "X", "1 min", minute_bars(3000), START, START + pd.Timedelta(minutes=3000)) # three daily partitions
+    return cache
+
+
+@pytest.mark.parametrize("since", [
+    pd.Timestamp("2024-01-02 01:00"), # naive, taken as UTC
+    pd.Timestamp("2024-01-02 01:00", tz="UTC"),
+    pd.Timestamp("2024-01-01 20:00", tz="America/New_York"),
+])
+def test_invalidate_since(cache, since):
+    end = START + pd.Timedelta(minutes=3000)
+    cache.invalidate("ib", "X", "1 min", since=since)
+    cutoff = pd.Timestamp("2024-01-02 01:00", tz="UTC")
+    assert cache.missing("ib", "X", "1 min", START, end) == [(cutoff, end)]
+    df = cache.read("ib", "X", "1 min", START, end)
+    assert len(df) == 1500 and df.index[-1] < cutoff
+
+
+def test_invalidate_everything(cache):
+    cache.invalidate("ib", "X", "1 min")
+    assert cache.read("ib", "X", "1 min", START, START + pd.Timedelta(days=3)) is None
+
+
+def test_contract_key_tells_contracts_apart():
+    pytest.importorskip("ibapi")
+    from contract import future, stock
+    keys = {contract_key(c) for c in (stock("ES", "SMART", "USD"), future("ES", "CME", "202412"),
+                                      future("ES", "CME", "202503"), stock("ES", "SMART", "CAD"))}
+    assert len(keys) == 4
+    assert contract_key(stock("aapl", "SMART", "USD")) == contract_key(stock("AAPL", "SMART", "USD")) == "STK_AAPL_SMART_USD"
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pytest
+from history_planner import HistoryStream, ib_duration, plan_chunks
+from ohlcv import bars_frame, empty_bars
+
+NOW = pd.Timestamp("2024-06-01", tz="UTC")
+
+
+def bars(start, end, freq="1min"):
+    times = pd.date_range(start, end, freq=freq, inclusive="left").as_unit("ns")
+    close = np.arange(len(times), dtype=np.float64)
+    return bars_frame(times.asi8, close, close, close, close, np.ones(len(times), dtype=np.int64), "X")
+
+
+class FakeSource:
+    # answers chunk i with answers[i], a DataFrame or an exception to raise
+    def __init__(self, answers):
+        self.answers = answers
+        self.requested = []
+        self.cancelled = []
+        self.closed = False
+
+    def request(self, i, start, end):
+        self.requested.append(i)
+        return i
+
+    def result(self, handle):
+        answer = self.answers[handle]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def cancel(self, handle):
+        self.cancelled.append(handle)
+
+    def empty(self):
+        return empty_bars("X")
+
+    def close(self):
+        self.closed = True
+
+
+def test_chunks_cover_the_range_without_overlap():
+    start, end = NOW - pd.Timedelta(days=3, hours=5), NOW
+    chunks, unavailable = plan_chunks("ib", "1 min", start, end)
+    assert unavailable is None
+    assert chunks[0][0] == start and chunks[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    assert all(e - s <= pd.Timedelta(days=1) for s, e in chunks) # IB's longest request for 1 min bars
+    assert len(chunks) == 4 and chunks[-1][1] - chunks[-1][0] == pd.Timedelta(hours=5)
+
+
+def test_short_and_empty_ranges():
+    assert plan_chunks("ib", "1 min", NOW - pd.Timedelta(hours=2), NOW) == ([(NOW - pd.Timedelta(hours=2), NOW)], None)
+    assert plan_chunks("ib", "1 day", NOW - pd.Timedelta(days=3000), NOW)[0] == [(NOW - pd.Timedelta(days=3000), NOW)]
+    assert plan_chunks("ib", "1 min", NOW, NOW) == ([], None)
+
+
+def test_yahoo_lookback_cutoff():
+    start = NOW - pd.Timedelta(days=40)
+    chunks, unavailable = plan_chunks("yahoo", "1m", start, NOW, now=NOW)
+    assert unavailable == (start, NOW - pd.Timedelta(days=30)) # Yahoo keeps 1 minute bars for 30 days
+    assert chunks[0][0] == NOW - pd.Timedelta(days=30) and chunks[-1][1] == NOW
+    assert all(e - s <= pd.Timedelta(days=7) for s, e in chunks)
+
+
+def test_yahoo_range_older_than_kept():
+    start, end = NOW - pd.Timedelta(days=100), NOW - pd.Timedelta(days=90)
+    assert plan_chunks("yahoo", "5m", start, end, now=NOW) == ([], (start, end))
+
+
+def test_ib_duration():
+    assert ib_duration(pd.Timedelta(seconds=10)) == "30 S"
+    assert ib_duration(pd.Timedelta(hours=5)) == "18000 S"
+    assert ib_duration(pd.Timedelta(days=3, hours=1)) == "4 D"
+    assert ib_duration(pd.Timedelta(days=400)) == "2 Y"
+
+
+def test_stream_joins_chunks_without_duplicates():
+    t = pd.date_range(NOW, periods=4, freq="10min")
+    chunks = [(t[0], t[2]), (t[1], t[3])] # overlapping chunks, the second repeats bars of the first
+    source = FakeSource([bars(t[0], t[2]), bars(t[0], t[3])]) # sources send more than asked for
+    df = HistoryStream(source, chunks).to_frame()
+    assert df.index.is_unique and df.index.is_monotonic_increasing
+    assert df.index[0] == t[0] and df.index[-1] == t[3] - pd.Timedelta(minutes=1)
+    assert len(df) == 30
+    assert source.closed
+
+
+def test_stream_reports_gaps():
+    t = pd.date_range(NOW, periods=4, freq="1h")
+    chunks = list(zip(t[:-1], t[1:]))
+    source = FakeSource([bars(t[0], t[1]), empty_bars("X"), RuntimeError("pacing violation")])
+    history = HistoryStream(source, chunks)
+    df = history.to_frame()
+    assert len(df) == 60
+    assert [(gap["start"], gap["reason"]) for gap in history.gaps] == [
+        (t[1], "no bars"), (t[2], "RuntimeError: pacing violation")]
+    assert isinstance(history.gaps[1]["error"], RuntimeError) and "error" not in history.gaps[0]
+
+
+def test_stream_keeps_max_in_flight_and_cancels_when_stopped():
+    t = pd.date_range(NOW, periods=11, freq="1h")
+    chunks = list(zip(t[:-1], t[1:]))
+    source = FakeSource([bars(a, b) for a, b in chunks])
+    history = HistoryStream(source, chunks, max_in_flight=3).start()
+    assert source.requested == [0, 1, 2] # requested before the first read
+    for i, _ in enumerate(history):
+        assert len(source.requested) <= i + 1 + 3
+        if i == 4:
+            break
+    assert source.cancelled == [5, 6, 7]
+    assert source.closed
+
+
+def test_empty_stream():
+    history = HistoryStream(FakeSource([]), [])
+    assert list(history) == [] and len(history.to_frame()) == 0 and history.gaps == []
+
+
+@pytest.mark.parametrize("provider, bar_size", [("ib", "nonsense"), ("tradier", "1 min")])
+def test_unknown_bar_sizes_and_providers(provider, bar_size):
+    with pytest.raises(ValueError):
+        plan_chunks(provider, bar_size, NOW - pd.Timedelta(days=1), NOW)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from indicators import CrossoverEngine, ENTRY, EXIT, Signal, vectorbt_parity
+
+PAIRS = [(3, 7), (5, 12)]
+
+
+@pytest.fixture
+def prices():
+    # random walks of three symbols, no two moving averages tie on them
+    rng = np.random.default_rng(42)
+    closes = 100 + np.cumsum(rng.normal(0, 1, (300, 3)), axis=0)
+    return pd.DataFrame(closes, index=pd.date_range("2024-01-01", periods=300, freq="D"), columns=["AAA", "BBB", "CCC"])
+
+
+def run_engine(prices, pairs, ewm):
+    # the engine's averages (time x symbol x window) and signals (time x symbol x pair), bar by bar
+    engine = CrossoverEngine(prices.columns, pairs, ewm=ewm)
+    mas, entries, exits = [], [], []
+    for row in prices.to_numpy():
+        entry, exit_ = engine.update_many(row)
+        mas.append(engine.ma.copy())
+        entries.append(entry)
+        exits.append(exit_)
+    return engine, np.array(mas), np.array(entries), np.array(exits)
+
+
+def reference_ma(prices, window, ewm):
+    if ewm:
+        return prices.ewm(span=window, adjust=False, min_periods=window).mean()
+    return prices.rolling(window).mean()
+
+
+def reference_crossings(short, long):
+    # entries where the short average moves from below to above the long one, exits the other way round
+    entries = (short > long) & (short.shift() < long.shift())
+    exits = (short < long) & (short.shift() > long.shift())
+    return entries.to_numpy(), exits.to_numpy()
+
+
+@pytest.mark.parametrize("ewm", [False, True])
+def test_moving_averages_match_pandas(prices, ewm):
+    engine, mas, _, _ = run_engine(prices, PAIRS, ewm)
+    for column, window in enumerate(engine.windows):
+        np.testing.assert_allclose(mas[:, :, column], reference_ma(prices, window, ewm).to_numpy(), rtol=1e-10)
+
+
+@pytest.mark.parametrize("ewm", [False, True])
+def test_crossovers_match_pandas(prices, ewm):
+    _, _, entries, exits = run_engine(prices, PAIRS, ewm)
+    for pair, (short_window, long_window) in enumerate(PAIRS):
+        expected_entries, expected_exits = reference_crossings(
+            reference_ma(prices, short_window, ewm), reference_ma(prices, long_window, ewm))
+        assert expected_entries.any() and expected_exits.any()
+        np.testing.assert_array_equal(entries[:, :, pair], expected_entries)
+        np.testing.assert_array_equal(exits[:, :, pair], expected_exits)
+
+
+def test_sma_crossover_by_hand():
+    # SMA(2) - SMA(4) is -1, -1, -0.5, 0.5, 1, 1, 0.5, -0.5, -1, -1 from bar 3 on
+    engine = CrossoverEngine(["X"], [(2, 4)])
+    signals = [engine.update("X", price, time) for time, price in enumerate([5, 4, 3, 2, 1, 2, 3, 4, 5, 4, 3, 2, 1])]
+    assert signals[6] == [Signal("X", 6, 2, 4, ENTRY)]
+    assert signals[10] == [Signal("X", 10, 2, 4, EXIT)]
+    assert sum(map(len, signals)) == 2
+    assert engine.ma[0].tolist() == [1.5, 2.5]
+
+
+def test_missing_price_keeps_state():
+    engine = CrossoverEngine(["X", "Y"], [(2, 4)])
+    for price in [5, 4, 3, 2, 1]:
+        engine.update_many([price, price])
+    entries, exits = engine.update_many([2, np.nan])
+    assert not entries.any() and not exits.any()
+    assert engine.ma[1].tolist() == [1.5, 2.5] # Y's averages are those of the bar before
+    entries, _ = engine.update_many([3, 2])
+    assert entries[:, 0].tolist() == [True, False] # Y is a bar behind X from here on
+    entries, _ = engine.update_many([4, 3])
+    assert entries[:, 0].tolist() == [False, True]
+
+
+@pytest.mark.parametrize("ewm", [False, True])
+def test_vectorbt_parity(prices, ewm):
+    pytest.importorskip("vectorbt")
+    assert vectorbt_parity(prices, PAIRS, ewm=ewm) == 0
@@ -0,0 +1,109 @@
+import threading # gives us the Condition we use so consumers can sleep until a tick arrives
+from collections import deque # double ended queue, appending and popping from either end is O(1)
+
+# What to do when a stream produces ticks faster than the consumer reads them
+BLOCK = "block" # the producer (EReader thread) waits until the consumer makes room, nothing is lost
+DROP_OLDEST = "drop_oldest" # throw away the oldest buffered tick to make room for the new one
+DROP_NEWEST = "drop_newest" # keep what is buffered and throw away (but count) the new tick
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+DEFAULT_BUFFER_SIZE = 65536 # enough for several seconds of a busy futures contract
+
+
+class BufferClosed(Exception):
+    """Raised by TickBuffer.get when the buffer has been closed and fully drained"""
+
+
+class TickBuffer:
+    """Bounded, thread-safe ring buffer holding the ticks of a single stream
+
+    Parameters:
+    - maxsize: Maximum number of ticks held before the overflow policy applies
+    - overflow: One of BLOCK, DROP_OLDEST or DROP_NEWEST
+    """
+
+    def __init__(self, maxsize=DEFAULT_BUFFER_SIZE, overflow=BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0 # number of ticks lost because the buffer was full
+        self.closed = False
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock) # consumers wait on this
+        self._not_full = threading.Condition(self._lock) # a blocked producer waits on this
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def put(self, item):
+        """Add a tick, returns False if the tick (or an older one) was dropped"""
+        with self._lock:
+            if self.closed: # stream was stopped, late ticks from TWS are ignored
+                return False
+            accepted = True
+            if len(self._items) >= self.maxsize:
+                if self.overflow == BLOCK:
+                    while len(self._items) >= self.maxsize and not self.closed:
+                        self._not_full.wait()
+                    if self.closed:
+                        return False
+                elif self.overflow == DROP_OLDEST:
+                    self._items.popleft() # make room by forgetting the oldest tick
+                    self.dropped += 1
+                    accepted = False
+                else: # DROP_NEWEST
+                    self.dropped += 1
+                    return False
+            self._items.append(item)
+            self._not_empty.notify()
+            return accepted
+
+    def get(self, timeout=None):
+        """Remove and return the oldest tick, blocking until one is available
+
+        Raises BufferClosed once the buffer is closed and empty, and
+        TimeoutError if no tick arrives within timeout seconds.
+        """
+        with self._lock:
+            if not self._items:
+                if self.closed:
+                    raise BufferClosed()
+                # sleeps without using any CPU until put() or close() wakes us up
+                if not self._not_empty.wait_for(lambda: self._items or self.closed, timeout):
+                    raise TimeoutError("No tick received within timeout")
+                if not self._items:
+                    raise BufferClosed()
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_batch(self, max_items, timeout=None):
+        """Remove and return up to max_items ticks, blocking only until the first one is available
+
+        Raises BufferClosed and TimeoutError like get.
+        """
+        with self._lock:
+            if not self._items:
+                if self.closed:
+                    raise BufferClosed()
+                if not self._not_empty.wait_for(lambda: self._items or self.closed, timeout):
+                    raise TimeoutError("No tick received within timeout")
+                if not self._items:
+                    raise BufferClosed()
+            count = min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)] # everything that piled up, in one lock round trip
+            self._not_full.notify_all()
+            return batch
+
+    def close(self):
+        """Stop accepting ticks and wake up every waiting producer and consumer"""
+        with self._lock:
+            self.closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Column layout of a TickBatch, 40 bytes per tick with the time as int64 nanoseconds since the epoch
+TICK_DTYPE = np.dtype([
+    ("time_ns", "i8"),
+    ("bid_price", "f8"),
+    ("ask_price", "f8"),
+    ("bid_size", "i8"),
+    ("ask_size", "i8"),
+])
+
+NS_PER_SECOND = 1_000_000_000
+
+
+# This represents each price tick
+class Tick:
+    """A single bid/ask tick, time is in seconds since the epoch as sent by the provider
+
+    __slots__ keeps every tick free of a per-object __dict__, and timestamp_ is
+    only turned into a pandas Timestamp when someone actually reads it.
+    """
+
+    __slots__ = ("time", "bid_price", "ask_price", "bid_size", "ask_size")
+
+    def __init__(self, time, bid_price, ask_price, bid_size, ask_size):
+        self.time = time
+        self.bid_price = float(bid_price) # makes sure they are float values
+        self.ask_price = float(ask_price)
+        self.bid_size = int(bid_size) # converts from floats to integers
+        self.ask_size = int(ask_size)
+
+    @property
+    def timestamp_(self):
+        return pd.Timestamp(self.time, unit="s") # makes time a pandas Timestamp, only when asked for
+
+    def __repr__(self):
+        return (
+            f"Tick(time={self.time!r}, bid_price={self.bid_price!r}, ask_price={self.ask_price!r}, "
+            f"bid_size={self.bid_size!r}, ask_size={self.ask_size!r})"
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, Tick):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+
+class TickBatch:
+    """Many ticks held column by column in one NumPy structured array
+
+    Parameters:
+    - data: Structured array with dtype TICK_DTYPE
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def from_tuples(cls, ticks):
+        """Build a batch from (time, bid_price, ask_price, bid_size, ask_size) tuples with time in seconds"""
+        data = np.array(ticks, dtype=TICK_DTYPE)
+        data["time_ns"] *= NS_PER_SECOND # seconds to nanoseconds for the whole batch at once
+        return cls(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        row = self.data[index]
+        if isinstance(index, slice):
+            return TickBatch(row)
+        return Tick(int(row["time_ns"]) // NS_PER_SECOND, row["bid_price"], row["ask_price"], row["bid_size"], row["ask_size"])
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield self[i]
+
+    @property
+    def timestamps(self):
+        """All tick times as a DatetimeIndex, converted in one vectorized step"""
+        return pd.DatetimeIndex(self.data["time_ns"].view("M8[ns]"))
+
+    def to_frame(self):
+        """DataFrame whose columns are views on the batch, no tick data is copied"""
+        columns = {"time": self.data["time_ns"].view("M8[ns]")}
+        for name in TICK_DTYPE.names[1:]:
+            columns[name] = self.data[name]
+        return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """Sliding window rate limiter, allows at most max_calls in any period seconds
+
+    Parameters:
+    - max_calls: Number of calls allowed inside one window
+    - period: Length of the window in seconds
+    """
+
+    def __init__(self, max_calls, period):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque() # monotonic timestamps of the calls inside the current window
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Block until one more call is allowed, then record it
+
+        Returns True, or False when no call was allowed within timeout seconds (None waits forever).
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period: # forget calls that left the window
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return True
+                wait = self._calls[0] + self.period - now # time until the oldest call leaves the window
+            if deadline is not None:
+                if now + wait > deadline: # the window doesn't open in time
+                    return False
+            time.sleep(wait) # sleep outside the lock so other threads can check too
+
+
+def _remaining(deadline):
+    # seconds left until a time.monotonic() deadline, None for no deadline
+    return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+
+class HistoricalPacer:
+    """Keeps historical data requests inside IB's pacing rules
+
+    IB counts a pacing violation when there are more than 60 requests in 10
+    minutes or six requests for the same contract in 2 seconds (both only for
+    bars of 30 secs or smaller), and never allows more than 50 open requests.
+
+    Parameters:
+    - max_requests: Requests allowed in one period for small bars
+    - period: Window of max_requests in seconds
+    - max_per_contract: Requests for the same contract allowed in contract_period
+    - contract_period: Window of max_per_contract in seconds
+    - max_in_flight: Maximum number of requests waiting for an answer at once
+    """
+
+    def __init__(self, max_requests=60, period=600, max_per_contract=5, contract_period=2, max_in_flight=50):
+        self._global = RateLimiter(max_requests, period)
+        self._max_per_contract = max_per_contract
+        self._contract_period = contract_period
+        self._per_contract = {} # contract key -> RateLimiter
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, small_bars=True, timeout=None):
+        """Block until a request for contract key can be sent
+
+        Returns True, or False when IB wouldn't allow the request within timeout seconds
+        (None waits forever). Every acquire that returned True must be matched with a
+        release once the request finished.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        if small_bars:
+            with self._lock:
+                limiter = self._per_contract.setdefault(
+                    key, RateLimiter(self._max_per_contract, self._contract_period))
+            if not limiter.acquire(_remaining(deadline)) or not self._global.acquire(_remaining(deadline)):
+                self._slots.release() # nothing was sent
+                return False
+        return True
+
+    def release(self):
+        """Free the in-flight slot of a finished, failed or cancelled request"""
+        self._slots.release()
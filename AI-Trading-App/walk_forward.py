@@ -0,0 +1,277 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import combinations
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# Walk-forward optimisation of moving average crossovers, the
+# VectorBT-Walk-Forward-Optimization notebook as a module that scales to
+# large grids:
+# - every window's rolling mean is computed once over the whole history
+#   (running sum differences, like vectorbt's rolling_mean_nb) and sliced per
+#   split, instead of vbt.MA.run_combs recomputing it for every split and pair
+# - signals, positions, returns and Sharpe ratios of all window pairs are
+#   evaluated with NumPy, a chunk of pairs at a time to bound memory
+# - the splits are spread over a process pool that reads prices and averages
+#   from shared memory, so nothing big is pickled per task
+#
+# The portfolio arithmetic is that of vbt.Portfolio.from_signals(direction="both")
+# without fees: all cash goes long on a golden cross and short on a death cross,
+# trades happen at the close of the signal bar.
+
+ANN_FACTOR = 365 # vectorbt's default year_freq of 365 days for freq="d"
+MAX_CHUNK_ELEMENTS = 2_000_000 # pairs x bars x symbols evaluated at once, about 16 MB per temporary array
+
+
+def window_pairs(windows):
+    """Every (short, long) combination of windows, like vbt.MA.run_combs(windows, r=2)"""
+    return np.array(list(combinations(sorted(windows), 2)), dtype=np.int64).reshape(-1, 2)
+
+
+def rolling_splits(n_bars, n, window_len, test_len):
+    """Start and end bars of n rolling splits, like prices.vbt.rolling_split(n, window_len, set_lens=(test_len,), left_to_right=False)
+
+    Returns an (n, 3) array of [in-sample start, out-of-sample start, out-of-sample end),
+    the last test_len bars of every window are its out-of-sample part.
+    """
+    if window_len > n_bars:
+        raise ValueError(f"window_len {window_len} is longer than the {n_bars} bars of data")
+    if not 0 < test_len < window_len:
+        raise ValueError("test_len must be between 0 and window_len")
+    starts = np.round(np.linspace(0, n_bars - window_len, n)).astype(np.int64)
+    return np.column_stack([starts, starts + window_len - test_len, starts + window_len])
+
+
+def rolling_means(prices, windows):
+    """Simple moving averages of a (bars x symbols) array for every window, shape (windows, bars, symbols)
+
+    Bars with a missing price count as missing for every window that contains
+    them, the average is NaN until a window is full, like vectorbt's rolling_mean_nb.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    valid = ~np.isnan(prices)
+    cumsum = np.vstack([np.zeros((1, prices.shape[1])), np.cumsum(np.where(valid, prices, 0.0), axis=0)])
+    count = np.vstack([np.zeros((1, prices.shape[1]), dtype=np.int64), np.cumsum(valid, axis=0)])
+    means = np.full((len(windows), *prices.shape), np.nan)
+    for i, window in enumerate(windows):
+        window = int(window)
+        if window > len(prices):
+            continue
+        sums = cumsum[window:] - cumsum[:-window]
+        full = (count[window:] - count[:-window]) == window
+        means[i, window - 1:] = np.where(full, sums / window, np.nan)
+    return means
+
+
+def crossover_signals(short_ma, long_ma):
+    """Entries (short crosses above long) and exits (short crosses below long) along axis 1
+
+    Same result as vectorbt's ma_crossed_above / ma_crossed_below: a cross
+    counts only once the short average has been on the other side first.
+    """
+    diff = short_ma - long_ma
+    above, below = diff > 0, diff < 0 # both False where an average is still NaN
+    entries = above.copy()
+    entries[:, 0] = False
+    entries[:, 1:] &= ~above[:, :-1] & np.logical_or.accumulate(below, axis=1)[:, :-1]
+    exits = below.copy()
+    exits[:, 0] = False
+    exits[:, 1:] &= ~below[:, :-1] & np.logical_or.accumulate(above, axis=1)[:, :-1]
+    return entries, exits
+
+
+def signal_returns(prices, entries, exits):
+    """Bar returns of going all in long on entries and short on exits, shape (pairs, bars, symbols)
+
+    prices is (bars, symbols) without missing values, the signals (pairs, bars, symbols).
+    The first bar's return is 0 like a vectorbt portfolio that trades at its first close.
+    """
+    n_pairs, n_bars, n_symbols = entries.shape
+    bars = np.arange(n_bars, dtype=np.int32)[None, :, None]
+    last_entry = np.where(entries, bars, np.int32(-1))
+    np.maximum.accumulate(last_entry, axis=1, out=last_entry)
+    last_exit = np.where(exits, bars, np.int32(-1))
+    np.maximum.accumulate(last_exit, axis=1, out=last_exit)
+    held = np.sign(last_entry[:, :-1] - last_exit[:, :-1]) # position from the previous close to this one
+
+    # only the first exit after an entry opens a short, an exit repeated after a tie of the averages is ignored
+    # like vectorbt ignores it, a long's return doesn't depend on its entry price
+    opens_short = exits.copy()
+    opens_short[:, 1:] &= last_exit[:, :-1] <= last_entry[:, :-1]
+    short_start = np.where(opens_short, bars, np.int32(0))
+    np.maximum.accumulate(short_start, axis=1, out=short_start)
+    entry_price = prices[short_start[:, :-1], np.arange(n_symbols)] # price the short was opened at
+
+    # a long of all cash is worth value * price / entry price, a short 2 * value - value * price / entry price,
+    # so both returns are held * price change / (entry price + held * (previous price - entry price))
+    previous = prices[:-1]
+    returns = np.zeros((n_pairs, n_bars, n_symbols))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(held * np.diff(prices, axis=0), entry_price + held * (previous - entry_price), out=returns[:, 1:])
+    return returns
+
+
+def sharpe_ratio(returns, ann_factor=ANN_FACTOR):
+    """Annualised Sharpe ratio along axis 1 with a zero risk free rate, as vectorbt computes it"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return returns.mean(axis=1) / returns.std(axis=1, ddof=1) * np.sqrt(ann_factor)
+
+
+def evaluate_pairs(prices, means, window_index, pairs, ann_factor=ANN_FACTOR):
+    """Sharpe ratio of every window pair on one stretch of bars, shape (pairs, symbols)
+
+    Parameters:
+    - prices: (bars, symbols) prices of the stretch
+    - means: (windows, bars, symbols) rolling means of the same stretch
+    - window_index: Dictionary window -> position in means
+    - pairs: (short, long) window pairs to evaluate
+    """
+    n_bars, n_symbols = prices.shape
+    chunk = max(1, MAX_CHUNK_ELEMENTS // max(n_bars * n_symbols, 1))
+    sharpe = np.empty((len(pairs), n_symbols))
+    for start in range(0, len(pairs), chunk):
+        block = pairs[start:start + chunk]
+        short_ma = means[[window_index[w] for w in block[:, 0]]]
+        long_ma = means[[window_index[w] for w in block[:, 1]]]
+        entries, exits = crossover_signals(short_ma, long_ma)
+        sharpe[start:start + len(block)] = sharpe_ratio(signal_returns(prices, entries, exits), ann_factor)
+    return sharpe
+
+
+@dataclass
+class WalkForwardResult:
+    """Sharpe ratios of every split, window pair and symbol, in and out of sample"""
+    symbols: list
+    pairs: np.ndarray # (pairs, 2) short and long windows
+    splits: np.ndarray # (splits, 3) bars of rolling_splits
+    in_sharpe: np.ndarray # (splits, pairs, symbols)
+    out_sharpe: np.ndarray # (splits, pairs, symbols)
+
+    @property
+    def best_index(self):
+        """(splits, symbols) index of the pair with the best in-sample Sharpe, like the notebook's get_best_index"""
+        scores = np.where(np.isnan(self.in_sharpe), -np.inf, self.in_sharpe)
+        return scores.argmax(axis=1)
+
+    @property
+    def in_sample_best(self):
+        """(splits, symbols) in-sample Sharpe of the best pair"""
+        return np.take_along_axis(self.in_sharpe, self.best_index[:, None, :], axis=1)[:, 0]
+
+    @property
+    def out_sample_test(self):
+        """(splits, symbols) out-of-sample Sharpe of the pair chosen in sample"""
+        return np.take_along_axis(self.out_sharpe, self.best_index[:, None, :], axis=1)[:, 0]
+
+    def best_params(self):
+        """One row per split and symbol with the chosen windows and both Sharpe ratios"""
+        best = self.best_index
+        n_splits, n_symbols = best.shape
+        return pd.DataFrame({
+            "split_idx": np.repeat(np.arange(n_splits), n_symbols),
+            "symbol": np.tile(np.asarray(self.symbols, dtype=object), n_splits),
+            "short_window": self.pairs[best.ravel(), 0],
+            "long_window": self.pairs[best.ravel(), 1],
+            "in_sharpe": self.in_sample_best.ravel(),
+            "out_sharpe": self.out_sample_test.ravel(),
+        })
+
+
+# Arrays of the parent process, attached from shared memory in every worker
+_shared = {}
+
+
+def _attach(specs, windows, pairs, splits, ann_factor):
+    blocks = []
+    for name, (shm_name, shape) in specs.items():
+        block = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(block) # keeps the mapping alive as long as the worker
+        _shared[name] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+    _shared.update(blocks=blocks, window_index={int(w): i for i, w in enumerate(windows)},
+                   pairs=pairs, splits=splits, ann_factor=ann_factor)
+
+
+def _evaluate_split(split):
+    prices, means = _shared["prices"], _shared["means"]
+    in_start, out_start, out_end = _shared["splits"][split]
+    args = (_shared["window_index"], _shared["pairs"], _shared["ann_factor"])
+    in_sharpe = evaluate_pairs(prices[in_start:out_start], means[:, in_start:out_start], *args)
+    out_sharpe = evaluate_pairs(prices[out_start:out_end], means[:, out_start:out_end], *args)
+    return in_sharpe, out_sharpe
+
+
+def walk_forward(prices, windows, n_splits=20, window_len=365 * 2, test_len=180, processes=None, ann_factor=ANN_FACTOR):
+    """Walk-forward optimisation of SMA crossovers over every pair of windows
+
+    Parameters:
+    - prices: Closing prices, a DataFrame (time x symbol) or a Series
+    - windows: Window lengths, every combination of two is tried
+    - n_splits, window_len, test_len: The rolling splits, see rolling_splits
+    - processes: Worker processes, None uses every core and 1 runs in this process
+    - ann_factor: Bars per year for the Sharpe ratio
+
+    Unlike the notebook the averages of a split use the bars before it, so the
+    first long window bars of every split have signals too.
+    """
+    if isinstance(prices, pd.Series):
+        prices = prices.to_frame()
+    symbols = list(prices.columns)
+    values = np.ascontiguousarray(prices.to_numpy(dtype=np.float64))
+    # returns need a price on every bar, the averages (and so the signals) stay NaN where prices are missing
+    filled = np.ascontiguousarray(prices.ffill().bfill().to_numpy(dtype=np.float64))
+    windows = np.unique(np.asarray(windows, dtype=np.int64))
+    pairs = window_pairs(windows)
+    splits = rolling_splits(len(values), n_splits, window_len, test_len)
+    means = rolling_means(values, windows)
+    values = filled
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or n_splits == 1:
+        _shared.update(prices=values, means=means, window_index={int(w): i for i, w in enumerate(windows)},
+                       pairs=pairs, splits=splits, ann_factor=ann_factor)
+        try:
+            results = [_evaluate_split(split) for split in range(n_splits)]
+        finally:
+            _shared.clear()
+    else:
+        blocks, specs = [], {}
+        try:
+            for name, array in (("prices", values), ("means", means)):
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks.append(block)
+                np.ndarray(array.shape, dtype=np.float64, buffer=block.buf)[...] = array
+                specs[name] = (block.name, array.shape)
+            del means # the workers read the shared copy
+            with ProcessPoolExecutor(min(processes, n_splits), initializer=_attach,
+                                     initargs=(specs, windows, pairs, splits, ann_factor)) as pool:
+                results = list(pool.map(_evaluate_split, range(n_splits)))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    return WalkForwardResult(
+        symbols=symbols,
+        pairs=pairs,
+        splits=splits,
+        in_sharpe=np.stack([in_sharpe for in_sharpe, _ in results]),
+        out_sharpe=np.stack([out_sharpe for _, out_sharpe in results]),
+    )
+
+
+if __name__ == "__main__":
+    import time
+    import scipy.stats as stats
+    import yfinance as yf
+
+    closes = yf.download(["AAPL", "MSFT", "AMZN", "META", "GOOG"], start="2015-01-01", end="2024-01-01", progress=False)["Close"]
+    started = time.perf_counter()
+    result = walk_forward(closes, np.arange(10, 40))
+    print(f"{len(result.pairs)} pairs x {len(result.symbols)} symbols x {len(result.splits)} splits in {time.perf_counter() - started:.1f}s")
+    print(result.best_params())
+    t, p = stats.ttest_ind(result.out_sample_test.ravel(), result.in_sample_best.ravel(), alternative="greater")
+    print("In-sample Sharpe:", result.in_sample_best.mean())
+    print("Out-sample Sharpe:", result.out_sample_test.mean())
+    print("p-value:", p)
@@ -1,15 +1,53 @@
 import threading # module with tools for concurrent exectuon, async 
+from time import perf_counter_ns # nanosecond clock for the latency instrumentation
 from ibapi.wrapper import EWrapper # a component that defines callback methods that get triggered in response to events from the IB servers
+from tick_buffer import DROP_OLDEST, DEFAULT_BUFFER_SIZE # per-stream ring buffer that consumers block on
+
+WARNING_CODES = range(2100, 2200) # IB's informational messages, such as "market data farm connection is OK"
+ORDER_NOTICE_CODES = (202, 399) # "order cancelled" and order warnings, the order itself is still fine
+
+class HistoricalDataError(Exception):
+    """Raised for a historical data request that IB answered with an error"""
+
+    def __init__(self, request_id, code, message):
+        super().__init__(f"Request {request_id} failed with error {code}: {message}")
+        self.request_id = request_id
+        self.code = code
+        self.message = message
+
+class ContractDetailsError(Exception):
+    """Raised for a contract details request that IB answered with an error, e.g. 200 "No security definition" """
+
+    def __init__(self, request_id, code, message):
+        super().__init__(f"Contract details request {request_id} failed with error {code}: {message}")
+        self.request_id = request_id
+        self.code = code
+        self.message = message
 
 class IBWrapper(EWrapper): # define a custom class that inherits from Ewrapper
 
     def __init__(self): 
         EWrapper.__init__(self) # Initilizes the IBWrapper class using the parent EWrapper class, so that any custom initializations we set later are also applied to our parent class
         self.historical_data = {} # Dictionary to store retrieved market data
-        self.streaming_data = {} # Dictionary to store the streaming data
-        self.stream_event = threading.Event() # Allows for threads to talk to each other
+        self.historical_futures = {} # Dictionary of request_id -> Future completed by historicalDataEnd
+        self.contract_details = {} # Dictionary of request_id -> ContractDetails received so far
+        self.contract_details_futures = {} # Dictionary of request_id -> Future completed by contractDetailsEnd
+        self.streaming_data = {} # Dictionary of request_id -> TickBuffer holding every tick of that stream
+        self.stream_buffer_size = DEFAULT_BUFFER_SIZE # default capacity of a stream's buffer
+        self.stream_overflow = DROP_OLDEST # default overflow policy, see tick_buffer.py. BLOCK would stall the EReader thread and every other callback
+        self.dropped_counts = {} # Dictionary of request_id -> ticks lost without a buffer or on a stopped stream
+        self.next_valid_id = None # first order id we may use, sent by TWS once the connection is ready
+        self.ready = threading.Event() # set when nextValidId arrives, the point from which requests are accepted
+        self.order_router = None # OrderRouter that receives the order callbacks, set by IBApp
+        self.latency = None # LatencyRecorder from latency.py, None switches the instrumentation off
+        self.timed_streams = set() # request ids whose ticks carry their arrival time, see get_streaming_data
 
     
+    # Callback function that TWS calls right after connecting, and again whenever we ask for a new id
+    def nextValidId(self, order_id):
+        self.next_valid_id = order_id
+        self.ready.set() # the connection is ready for requests
+
     # A function to store historical data
     def historicalData(self, request_id, bar):
         # request id our unique identifier
@@ -30,6 +68,82 @@ class IBWrapper(EWrapper): # define a custom class that inherits from Ewrapper
             self.historical_data[request_id] = [] # if yes then makes a new empty list for this request ID
         self.historical_data[request_id].append(bar_data) # attachtes the bar data to right requests
 
+    # Callback function that is triggered once every bar of a request has been sent
+    def historicalDataEnd(self, request_id, start, end):
+        future = self.historical_futures.pop(request_id, None)
+        data = self.historical_data.pop(request_id, [])
+        if self.latency is not None:
+            self.latency.stop("historical_request", request_id)
+            self.latency.count("historical_bars", request_id, len(data))
+        if future is not None: # None when the request already timed out
+            future.set_result(data) # wakes up whoever waits for this request
+
+    # Callback function for each contract that matches a reqContractDetails request, several for ambiguous ones
+    def contractDetails(self, request_id, details):
+        received = self.contract_details.get(request_id) if request_id in self.contract_details_futures else None
+        if received is not None: # answers of requests that timed out or were never sent are dropped
+            received.append(details)
+
+    # Callback function that is triggered once every match of a contract details request has been sent
+    def contractDetailsEnd(self, request_id):
+        future = self.contract_details_futures.pop(request_id, None)
+        details = self.contract_details.pop(request_id, [])
+        if future is not None: # None when the request already timed out
+            future.set_result(details)
+
+    # Callback function for errors and notices, the arguments between request_id and the
+    # message differ between ibapi versions (newer ones send the error time first)
+    def error(self, request_id, *args):
+        position = next((i for i, arg in enumerate(args) if isinstance(arg, str)), None) # the message is the first string
+        if position is None: # an argument layout we don't know, print what came
+            print(f"Error for request {request_id}: {args}")
+            return
+        message = args[position]
+        code = args[position - 1]
+        if code not in WARNING_CODES:
+            future = self.historical_futures.pop(request_id, None)
+            if future is not None: # the error belongs to a pending historical request
+                self.historical_data.pop(request_id, None)
+                if self.latency is not None:
+                    self.latency.discard("historical_request", request_id)
+                    self.latency.count("historical_errors", request_id)
+                future.set_exception(HistoricalDataError(request_id, code, message)) # fails only this request
+                return
+            future = self.contract_details_futures.pop(request_id, None)
+            if future is not None: # no contract matched
+                self.contract_details.pop(request_id, None)
+                future.set_exception(ContractDetailsError(request_id, code, message))
+                return
+            if self.order_router is not None and code not in ORDER_NOTICE_CODES and self.order_router.on_error(request_id, code, message):
+                return # for orders the request id is the order id
+        print(f"Error {code} for request {request_id}: {message}")
+
+    # Callback function for every change in the state of an order
+    def orderStatus(self, order_id, status, filled, remaining, avg_fill_price, perm_id,
+                    parent_id, last_fill_price, client_id, why_held, mkt_cap_price):
+        if self.order_router is not None:
+            self.order_router.on_order_status(order_id, status, filled, remaining, avg_fill_price)
+
+    # Callback function that TWS sends once it accepted an order
+    def openOrder(self, order_id, contract, order, order_state):
+        if self.order_router is not None:
+            self.order_router.on_open_order(order_id)
+
+    # Callback function for every (partial) fill
+    def execDetails(self, request_id, contract, execution):
+        if self.order_router is not None:
+            self.order_router.on_execution(execution.orderId, execution)
+
+    # Callback function with the commission of an execution, sent after its execDetails
+    def commissionReport(self, commission_report):
+        if self.order_router is not None:
+            self.order_router.on_commission(commission_report.execId, commission_report.commission)
+
+    # the same callback in newer ibapi versions
+    def commissionAndFeesReport(self, report):
+        if self.order_router is not None:
+            self.order_router.on_commission(report.execId, report.commissionAndFees)
+
     # Callback function that is triggered when new bid/ask data comes 
     def tickByTickBidAsk(
             self,
@@ -41,6 +155,9 @@ class IBWrapper(EWrapper): # define a custom class that inherits from Ewrapper
             ask_size,
             tick_atrrib_last
     ):
+        latency = self.latency
+        if latency is not None:
+            arrival = perf_counter_ns()
         tick_data = ( # Puts our data into a tuple
             time,
             bid_price,
@@ -48,5 +165,22 @@ class IBWrapper(EWrapper): # define a custom class that inherits from Ewrapper
             bid_size,
             ask_size,
         )
-        self.streaming_data[request_id] = tick_data # stores the tuple in our dictionary and used request_id as the key
-        self.stream_event.set() # communicates new data is ready for usage
\ No newline at end of file
+        buffer = self.streaming_data.get(request_id)
+        if buffer is None: # a stream that was never registered, or a tick still on its way after stop_streaming_data
+            self.dropped_counts[request_id] = self.dropped_counts.get(request_id, 0) + 1
+            return
+        if latency is None:
+            buffer.put(tick_data) # queues the tuple and wakes up the consumer of this stream
+            return
+
+        if request_id in self.timed_streams:
+            tick_data += (arrival,) # read back by latency.timed_ticks on the consumer side
+        if buffer.put(tick_data) is False:
+            latency.count("ticks_dropped", request_id)
+        latency.record("tick_callback", request_id, perf_counter_ns() - arrival)
+        latency.count("ticks_received", request_id)
+
+    # Number of ticks lost on a stream because its consumer fell behind or no buffer was registered, also after it stopped
+    def dropped_ticks(self, request_id):
+        buffer = self.streaming_data.get(request_id)
+        return self.dropped_counts.get(request_id, 0) + (buffer.dropped if buffer is not None else 0)
\ No newline at end of file
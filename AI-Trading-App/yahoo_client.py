@@ -1,37 +1,30 @@
 import time
 import pandas as pd
 import yfinance as yf
-from dataclasses import dataclass, field
 import threading
-from datetime import datetime, timedelta
-
-# List of constants for candlestick data
-TRADE_BAR_PROPERTIES = ["time", "open", "high", "low", "close", "volume"]
-
-# This represents each price tick
-@dataclass
-class Tick:
-    time: int
-    bid_price: float
-    ask_price: float
-    bid_size: float
-    ask_size: float
-    timestamp_: pd.Timestamp = field(init=False)
-    
-    def __post_init__(self):
-        self.timestamp_ = pd.to_datetime(self.time, unit="s") # chanages self.time to a pandas datetime object and sets the value as seconds
-        self.bid_price = float(self.bid_price)
-        self.ask_price = float(self.ask_price)
-        self.bid_size = int(self.bid_size)
-        self.ask_size = int(self.ask_size)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from bar_cache import to_timedelta, yahoo_interval
+from history_planner import fetch_history, max_request_span # splits ranges longer than Yahoo sends at once
+from ohlcv import PRICE_DTYPE, canonical, from_yahoo, pivot_bars # the bar format shared by every client
+from ticks import Tick, TickBatch
+from tick_buffer import TickBuffer, BufferClosed, DROP_OLDEST
+from latency import timed_ticks
+
+MAX_DOWNLOADS = 4 # symbols of get_historical_data_for_many downloaded at once
 
 class YahooFinanceClient:
-    def __init__(self):
-        self.historical_data = {}
-        self.streaming_data = {}
-        self.stream_event = threading.Event() # makes new event object 
+    def __init__(self, bar_cache=None):
+        self.bar_cache = bar_cache # optional BarCache, when set only bars missing on disk are downloaded
+        self.price_dtype = PRICE_DTYPE # dtype of the price columns of historical bars, np.float32 halves their memory
+        self.streaming_data = {} # Dictionary of request_id -> TickBuffer of that stream
         self.active_streams = {} # Dictionary to store data about active data streams
         self.stop_flag = False # Used to initialize our streaming state as cotinue streaming, when set to true will stop streaming
+        self.lookback_minutes = 5 # how far back each poll downloads 1 minute bars, enough to find the last trade
+        self._streams_changed = threading.Condition() # wakes the poller when streams are added or stopped
+        self._poller = None # the single thread that polls for all streams
+        self.latency = None # LatencyRecorder from latency.py, None switches the instrumentation off
+        self.timed_streams = set() # request ids whose ticks carry their arrival time
     
     def get_historical_data(self, request_id, symbol, duration="2d", bar_size="30m"):
         """Get historical data for a symbol
@@ -51,78 +44,102 @@ class YahooFinanceClient:
             duration = duration.replace(" M", "mo")
             
         # Convert bar size to yfinance format
-        bar_size_map = {
-            "1 min": "1m",
-            "5 mins": "5m",
-            "15 mins": "15m",
-            "30 secs": "1m",  # Yahoo doesn't support 30s, default to 1m
-            "30 mins": "30m",
-            "1 hour": "60m",
-            "1 day": "1d",
-        }
-        interval = bar_size_map.get(bar_size, bar_size)
-        
+        interval = yahoo_interval(bar_size)
+
+        try:
+            length = to_timedelta(duration)
+        except ValueError: # "ytd" and "max" have no fixed length, they always go to Yahoo
+            length = None
+        span = max_request_span("yahoo", interval)
+        if self.bar_cache is None or length is None:
+            if length is not None and span is not None and length > span: # e.g. a month of 1m bars, Yahoo sends 7 days at once
+                df = fetch_history(self, request_id, symbol, interval, duration=duration).to_frame()
+                df.request_id = request_id
+                return df
+            return self._download(request_id, symbol, interval, period=duration)
+
+        end = pd.Timestamp.now(tz="UTC") # the bars are indexed by UTC time
+
+        def fetch(start, end):
+            if span is not None and end - start > span:
+                return fetch_history(self, request_id, symbol, interval, start=start, end=end).to_frame()
+            return self._download(request_id, symbol, interval, start=start, end=end)
+
+        df = self.bar_cache.get("yahoo", symbol, interval, end - length, end, fetch)
+        df = canonical(df, symbol, self.price_dtype) # also the empty frame when nothing was traded in the range
+        df.request_id = request_id
+        return df
+
+    def _download(self, request_id, symbol, interval, **kwargs):
+        """Download bars from Yahoo Finance, kwargs is either period or start and end"""
         # Get data from Yahoo Finance - removed 'show_errors' parameter for compatibility
         data = yf.download(
             symbol,
-            period=duration,
             interval=interval,
-            progress=False
+            progress=False,
+            **kwargs
         )
-        
-        # Format data to match expected format
-        data.reset_index(inplace=True)
-        data.rename(columns={
-            'Date': 'time',
-            'Datetime': 'time',
-            'High': 'high',
-            'Low': 'low',
-            'Open': 'open',
-            'Close': 'close',
-            'Volume': 'volume',
-        }, inplace=True)
-        
-        # Store historical data
-        self.historical_data[request_id] = data[['time', 'open', 'high', 'low', 'close', 'volume']].values.tolist()
-        
-        # Create and return DataFrame
-        df = pd.DataFrame(self.historical_data[request_id], columns=TRADE_BAR_PROPERTIES)
-        df.set_index(pd.to_datetime(df.time), inplace=True)
-        df.drop("time", axis=1, inplace=True)
-        df["symbol"] = symbol
+
+        # the columns of yfinance's frame as they are, intraday times converted from the exchange time zone to UTC
+        df = from_yahoo(data, symbol, self.price_dtype)
         df.request_id = request_id
         return df
     
     def get_historical_data_for_many(self, request_id, symbols, duration, bar_size, col_to_use="close"):
-        """Get historical data for multiple symbols"""
+        """Get historical data for multiple symbols, downloaded on a few threads at once
+
+        Symbols whose download fails are printed and left out, like IBClient does.
+        """
+        with ThreadPoolExecutor(MAX_DOWNLOADS) as pool:
+            futures = [pool.submit(self.get_historical_data, request_id + i, symbol, duration, bar_size)
+                       for i, symbol in enumerate(symbols)]
         dfs = []
-        for symbol in symbols:
-            data = self.get_historical_data(request_id, symbol, duration, bar_size)
-            dfs.append(data)
-            request_id += 1
-        
-        return (
-            pd.concat(dfs)
-            .reset_index()
-            .pivot(
-                index="time", columns="symbol", values=col_to_use
-            )
-        )
+        for symbol, future in zip(symbols, futures):
+            try:
+                dfs.append(future.result())
+            except Exception as e:
+                print(f"Error retrieving data for {symbol}: {e}")
+        return pivot_bars(dfs, col_to_use) # an empty frame when every download failed
     
     # Function we use to poll as I said before not 'true' streaming
-    def _polling_thread(self, request_id, symbol, interval):
-        """Background thread that polls for updated data"""
-        ticker = yf.Ticker(symbol) # request data for stock based off symbol
-        
-        while not self.stop_flag and request_id in self.active_streams: # function runs as longs as streaming is on, and the stream is active
+    def _polling_thread(self):
+        """Background thread that polls every active stream with one batched download per round"""
+        while True:
+            with self._streams_changed:
+                if self.stop_flag or self._poller is not threading.current_thread(): # disconnected, maybe replaced already
+                    return
+                if not self.active_streams: # nothing to poll, sleep until a stream is added
+                    self._streams_changed.wait()
+                    continue
+                now = time.monotonic()
+                next_due = min(stream["next_due"] for stream in self.active_streams.values())
+                if next_due > now: # sleep until the next stream is due, or a stream is added or stopped
+                    self._streams_changed.wait(next_due - now)
+                    continue
+                due = {request_id: stream for request_id, stream in self.active_streams.items() if stream["next_due"] <= now}
+                for stream in due.values():
+                    stream["next_due"] = now + stream["interval"]
+
+            symbols = sorted({stream["symbol"] for stream in due.values()}) # several streams can watch the same symbol
+            latency = self.latency
+            if latency is not None:
+                poll_started = time.perf_counter_ns()
             try:
-                # Get latest quote
-                quote = ticker.history(period="1d", interval="1m").iloc[-1] # gets the market snapshot of latest data
-                last_price = quote['Close'] # extract specifically the closing price
-                
-                # Yahoo doesn't provide bid/ask directly, so we use last price for both
-                current_time = int(datetime.now().timestamp())
-                
+                last_prices = self._latest_prices(symbols)
+            except Exception as e:
+                print(f"Error polling Yahoo Finance data: {e}")
+                continue # the streams are already rescheduled, so we still wait before retrying
+            if latency is not None:
+                arrival = time.perf_counter_ns()
+                for request_id in due:
+                    latency.record("yahoo_poll", request_id, arrival - poll_started)
+
+            # Yahoo doesn't provide bid/ask directly, so we use last price for both
+            current_time = int(datetime.now().timestamp())
+            for request_id, stream in due.items():
+                last_price = last_prices.get(stream["symbol"])
+                if last_price is None: # no trade in the downloaded window
+                    continue
                 tick_data = (
                     current_time,
                     last_price,  # bid
@@ -130,54 +147,104 @@ class YahooFinanceClient:
                     0,  # bid size (not available)
                     0,  # ask size (not available)
                 )
-                
-                self.streaming_data[request_id] = tick_data # Updates our storage with the new tick data
-                self.stream_event.set() # communicates new data is available
-                
-                # Wait for the specified interval
-                time.sleep(interval)
-                
-            except Exception as e:
-                print(f"Error polling Yahoo Finance data: {e}")
-                time.sleep(interval)  # Still wait before retrying
-    
-    def get_streaming_data(self, request_id, symbol, polling_interval=5):
+                if latency is not None and request_id in self.timed_streams:
+                    tick_data += (arrival,) # read back by latency.timed_ticks
+                stream["buffer"].put(tick_data)
+
+    def _latest_prices(self, symbols):
+        """Last 1 minute close of every symbol, from one request for all of them
+
+        Symbols without a trade in the last lookback_minutes (e.g. outside market hours)
+        get their last daily close instead, from one more request for all of them.
+        """
+        data = yf.download(
+            symbols,
+            start=pd.Timestamp.now(tz="UTC") - pd.Timedelta(minutes=self.lookback_minutes), # only the latest bars, not the whole day
+            interval="1m",
+            progress=False,
+        )
+        prices = self._last_closes(data, symbols)
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        if missing: # an empty window, the market is closed or the symbol didn't trade
+            prices.update(self._last_closes(yf.download(missing, period="1d", interval="1d", progress=False), missing))
+        return prices
+
+    @staticmethod
+    def _last_closes(data, symbols):
+        # last non missing close of every symbol in a yf.download frame
+        if data is None or data.empty:
+            return {}
+        close = data["Close"]
+        if isinstance(close, pd.Series): # older yfinance versions return flat columns for a single symbol
+            close = close.to_frame(symbols[0])
+        last = close.ffill().iloc[-1]
+        return {symbol: float(last[symbol]) for symbol in symbols if symbol in last and pd.notna(last[symbol])}
+
+    def get_streaming_data(self, request_id, symbol, polling_interval=5, batch_size=None):
         """Generator that yields streaming tick data by polling at regular intervals
         
         Parameters:
         - request_id: Unique identifier for this stream
         - symbol: Stock ticker symbol
         - polling_interval: How often to poll for new data, in seconds
+        - batch_size: When given, yield TickBatch objects of up to that many ticks instead of single Ticks
         """
-        # Start polling thread
-        self.active_streams[request_id] = True
-        thread = threading.Thread(
-            target=self._polling_thread,
-            args=(request_id, symbol, polling_interval),
-            daemon=True
-        )
-        thread.start()
-        
+        buffer = TickBuffer(overflow=DROP_OLDEST) # a slow consumer only ever needs the latest prices
+        latency = self.latency
+        if latency is not None:
+            self.timed_streams.add(request_id)
+        self.start_polling(request_id, symbol, polling_interval, buffer)
+
         try:
-            while not self.stop_flag:
-                if self.stream_event.is_set() and request_id in self.streaming_data:
-                    yield Tick(*self.streaming_data[request_id])
-                    self.stream_event.clear()
-                time.sleep(0.1)  # Small sleep to prevent busy waiting
-        except KeyboardInterrupt:
+            if latency is not None:
+                yield from timed_ticks(buffer, latency, request_id, batch_size)
+                return
+            while True:
+                if batch_size:
+                    yield TickBatch.from_tuples(buffer.get_batch(batch_size))
+                else:
+                    yield Tick(*buffer.get()) # sleeps until the poller delivers a new tick
+        except (BufferClosed, KeyboardInterrupt):
             pass
         finally:
             # Clean up
-            if request_id in self.active_streams:
-                del self.active_streams[request_id]
+            self.stop_streaming_data(request_id)
+
+    def start_polling(self, request_id, symbol, polling_interval, buffer):
+        """Register a stream with the poller, its ticks are put into buffer (anything with put() and close())"""
+        self.streaming_data[request_id] = buffer
+        with self._streams_changed:
+            self.active_streams[request_id] = {
+                "symbol": symbol,
+                "interval": polling_interval,
+                "buffer": buffer,
+                "next_due": time.monotonic(), # poll right away
+            }
+            if self._poller is None: # one thread serves every stream of this client
+                self._poller = threading.Thread(target=self._polling_thread, daemon=True)
+                self._poller.start()
+            self._streams_changed.notify()
     
     def stop_streaming_data(self, request_id):
         """Stop streaming for a specific request"""
-        if request_id in self.active_streams:
-            del self.active_streams[request_id]
+        with self._streams_changed:
+            stream = self.active_streams.pop(request_id, None)
+            self._streams_changed.notify()
+        self.streaming_data.pop(request_id, None)
+        self.timed_streams.discard(request_id)
+        if stream is not None:
+            stream["buffer"].close() # ends the generator of this stream
     
     def disconnect(self):
         """Stop all streams and clean up"""
-        self.stop_flag = True
-        self.active_streams.clear()
-        time.sleep(1)  # Give threads time to stop
\ No newline at end of file
+        with self._streams_changed:
+            self.stop_flag = True
+            streams = list(self.active_streams.values())
+            self.active_streams.clear()
+            poller, self._poller = self._poller, None
+            self._streams_changed.notify()
+        for stream in streams:
+            stream["buffer"].close()
+        if poller is not None:
+            poller.join(timeout=5) # wait for a download in progress to finish
+        self.stop_flag = False # the client can poll again, the next start_polling starts a new poller
\ No newline at end of file